@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+#
+# lockstep simulation of many MSP430 instances with NumPy. all instances
+# (lanes) start as copies of one Core and run the same code with different
+# data, e.g. one CRC routine over thousands of input vectors. lanes at the
+# same PC execute the decoded instruction together with array operations,
+# lanes that diverge are grouped by their PC.
+#
+# registers, cycle and instruction counters are arrays with one entry per
+# lane. memory is shared between the lanes until a page is written, then
+# that page gets a copy per lane. peripherals are only supported if they
+# provide a view() of their memory (RAM, Flash) or are the hardware
+# multiplier, which is simulated with one state per lane. other peripheral
+# addresses raise a BatchException when they are accessed.
+#
+# the results are the same as running each lane with Core.run.
+#
+# this is distributed under a free software license, see license.txt
+
+import numpy
+import core
+from core import RegisterArgument, IndexedRegisterArgument, MemoryArgument, \
+    IndirectRegisterArgument, IndirectAutoincrementRegisterArgument, ImmediateArgument
+
+class BatchException(Exception): pass
+
+#kinds of addresses, see BatchCore.kinds
+SHARED      = 0     #same for all lanes, value in image
+PRIVATE     = 1     #each lane has its own copy of the page
+PERIPHERAL  = 2     #handled by a peripheral without view, not supported
+MULTIPLIER  = 3     #handled by the hardware multiplier, see Multiplier
+
+class Multiplier:
+    """core.Multiplier with one state per lane. the attributes of
+    core.Multiplier are arrays with one entry per lane, get() and set()
+    behave the same for each lane"""
+
+    STATE = ('mode', 'op1', 'op2', 'acc', 'sumext', 'mpy', 'mpys', 'mac', 'macs')
+    #registers for get(), RESHI is acc >> 16
+    REGISTERS = {0x130: 'mpy', 0x132: 'mpys', 0x134: 'mac', 0x136: 'macs',
+                 0x138: 'op2', 0x13a: 'acc', 0x13e: 'sumext'}
+
+    def __init__(self, template, lanes):
+        """copy the state of a core.Multiplier to lanes"""
+        for name in self.STATE:
+            setattr(self, name, numpy.zeros(lanes, numpy.int64) + getattr(template, name))
+
+    def _makesigned(self, values, bytemode):
+        mask = bytemode and 0xff or 0xffff
+        values = values & mask
+        return numpy.where(values & (bytemode and 0x80 or 0x8000), values - mask - 1, values)
+
+    def get(self, lanes, address, bytemode):
+        """read the register at address for the lanes"""
+        if address == 0x13c:
+            values = self.acc[lanes] >> 16
+        elif address in self.REGISTERS:
+            values = getattr(self, self.REGISTERS[address])[lanes]
+        else:
+            values = numpy.zeros(len(lanes), numpy.int64)
+        return values & (bytemode and 0xff or 0xffff)
+
+    def set(self, lanes, address, values, bytemode):
+        """write values to the register at address for the lanes"""
+        if address == 0x130:
+            self.mode[lanes] = core.Multiplier.MUL
+            self.op1[lanes] = self.mpy[lanes] = values
+        elif address == 0x132:
+            self.mode[lanes] = core.Multiplier.SIGNEDMUL
+            self.mpys[lanes] = values
+            self.op1[lanes] = self._makesigned(values, bytemode)
+        elif address == 0x134:
+            self.mode[lanes] = core.Multiplier.MULANDACCUM
+            self.op1[lanes] = self.mac[lanes] = values
+        elif address == 0x136:
+            self.mode[lanes] = core.Multiplier.SIGNEDMULANDACCUM
+            self.macs[lanes] = values
+            self.op1[lanes] = self._makesigned(values, bytemode)
+        elif address == 0x138:
+            mode = self.mode[lanes]
+            signed = (mode == core.Multiplier.SIGNEDMUL) | (mode == core.Multiplier.SIGNEDMULANDACCUM)
+            op1 = self.op1[lanes]
+            op2 = numpy.where(signed, self._makesigned(values, bytemode), values)
+            self.op2[lanes] = op2
+            r = abs(op1) * abs(op2)
+            negative = (op1 < 0) != (op2 < 0)
+            acc = self.acc[lanes]
+            acc = numpy.where(mode == core.Multiplier.MUL, r, acc)
+            acc = numpy.where(mode == core.Multiplier.SIGNEDMUL, numpy.where(negative, -r, r), acc)
+            acc = numpy.where(mode == core.Multiplier.MULANDACCUM, acc + r, acc)
+            acc = numpy.where(mode == core.Multiplier.SIGNEDMULANDACCUM,
+                acc + numpy.where(negative, -r, r), acc)
+            self.acc[lanes] = acc
+            self.sumext[lanes] = numpy.select([
+                mode == core.Multiplier.SIGNEDMUL,
+                mode == core.Multiplier.MULANDACCUM,
+                mode == core.Multiplier.SIGNEDMULANDACCUM],
+                [negative * 0xffff, (acc > 0xffffffff) * 0x0001, (acc > 0x7fffffff) * 0xffff], 0)
+        elif address == 0x13a:
+            self.acc[lanes] = (self.acc[lanes] & 0xffff0000) | values
+        elif address == 0x13c:
+            self.acc[lanes] = (self.acc[lanes] & 0x0000ffff) | (values << 16)
+
+class BatchCore:
+    """N copies of a Core that are run in lockstep"""
+
+    def __init__(self, template, lanes):
+        """create lanes copies of the state of the template Core"""
+        self.lanes = lanes
+        self.regs = numpy.empty((16, lanes), numpy.int64)
+        self.regs[:] = numpy.array(template.regs, numpy.int64)[:, numpy.newaxis]
+        self.regs[2] = template.SR.value        #include pending flags
+        self.cycles = numpy.zeros(lanes, numpy.int64) + template.cycles
+        self.instructions = numpy.zeros(lanes, numpy.int64) + template.instructions
+        self.image = numpy.zeros(0x10000, numpy.uint8)          #shared memory contents
+        self.kinds = numpy.zeros(0x10000, numpy.uint8)          #SHARED, PRIVATE or PERIPHERAL
+        self.alignmask = numpy.zeros(0x10000, numpy.int64) + 0xffff #peripherals align words
+        self.lanepages = {}         #page number -> (lanes, 256) array
+        self.insns = {}             #(pc, code) -> decoded instruction
+        self.scratch = core.Core(trace=core.Core.TRACE_OFF)    #used to decode
+        self.multiplier = None      #Multiplier if the template has one
+        self._copymemory(template.memory)
+
+    def _copymemory(self, memory):
+        """fill image and kinds from a Memory, set up the multiplier"""
+        self.image[:] = numpy.frombuffer(str(memory.memory), numpy.uint8)
+        for page in range(256):
+            a = page << 8
+            p = memory.pages[page]
+            if p is None:
+                continue
+            if p.__class__ is not list:
+                p = [p] * 256
+            for address in range(a, a + 256):
+                peripheral = p[address & 0xff]
+                if peripheral is None:
+                    continue
+                view = peripheral.view(address, 1)
+                if isinstance(peripheral, core.Multiplier):
+                    if self.multiplier is None:
+                        self.multiplier = Multiplier(peripheral, self.lanes)
+                    self.kinds[address] = MULTIPLIER
+                elif view is None:
+                    self.kinds[address] = PERIPHERAL
+                else:
+                    self.image[address] = ord(view.tobytes())
+                    self.alignmask[address] = 0xfffe
+
+    #---
+    # memory access, addresses and values are arrays with one entry per lane
+
+    def _bypage(self, addresses):
+        """yield (page, selection) for the pages in addresses"""
+        pages = addresses >> 8
+        if (pages == pages[0]).all():
+            yield pages[0], slice(None)
+        else:
+            for page in numpy.unique(pages):
+                yield page, pages == page
+
+    def readbytes(self, lanes, addresses):
+        """bytes at addresses, one per lane"""
+        values = self.image[addresses].astype(numpy.int64)
+        kinds = self.kinds[addresses]
+        if kinds.any():
+            if (kinds >= PERIPHERAL).any():
+                raise BatchException('peripheral access at 0x%04x' % addresses[kinds >= PERIPHERAL][0])
+            private = numpy.flatnonzero(kinds)
+            for page, sel in self._bypage(addresses[private]):
+                where = private[sel]
+                values[where] = self.lanepages[page][lanes[where], addresses[where] & 0xff]
+        return values
+
+    def writebytes(self, lanes, addresses, values):
+        """write bytes to addresses, one per lane"""
+        kinds = self.kinds[addresses]
+        if (kinds >= PERIPHERAL).any():
+            raise BatchException('peripheral access at 0x%04x' % addresses[kinds >= PERIPHERAL][0])
+        for page, sel in self._bypage(addresses):
+            lanepage = self.lanepages.get(page)
+            if lanepage is None:
+                lanepage = self._private(page)
+            lanepage[lanes[sel], addresses[sel] & 0xff] = values[sel] & 0xff
+
+    def _private(self, page):
+        """give each lane its own copy of a page"""
+        a = page << 8
+        lanepage = numpy.tile(self.image[a:a+256], (self.lanes, 1))
+        self.lanepages[page] = lanepage
+        kinds = self.kinds[a:a+256]
+        kinds[kinds == SHARED] = PRIVATE
+        return lanepage
+
+    def _multiplied(self, addresses):
+        """return a selection of the addresses that go to the multiplier or
+        None"""
+        if self.multiplier is None:
+            return None
+        selection = self.kinds[addresses] == MULTIPLIER
+        if not selection.any():
+            return None
+        return selection
+
+    def mget(self, lanes, addresses, bytemode):
+        """like Memory.get"""
+        addresses = addresses & 0xffff
+        selection = self._multiplied(addresses)
+        if selection is not None:
+            values = numpy.empty(len(lanes), numpy.int64)
+            for address in numpy.unique(addresses[selection]):
+                where = addresses == address
+                values[where] = self.multiplier.get(lanes[where], address, bytemode)
+            if not selection.all():
+                values[~selection] = self.mget(lanes[~selection], addresses[~selection], bytemode)
+            return values
+        if bytemode:
+            return self.readbytes(lanes, addresses)
+        addresses &= self.alignmask[addresses]
+        return self.readbytes(lanes, addresses) | (self.readbytes(lanes, (addresses + 1) & 0xffff) << 8)
+
+    def mset(self, lanes, addresses, values, bytemode):
+        """like Memory.set"""
+        addresses = addresses & 0xffff
+        selection = self._multiplied(addresses)
+        if selection is not None:
+            for address in numpy.unique(addresses[selection]):
+                where = addresses == address
+                self.multiplier.set(lanes[where], address, values[where], bytemode)
+            if not selection.all():
+                self.mset(lanes[~selection], addresses[~selection], values[~selection], bytemode)
+            return
+        if bytemode:
+            self.writebytes(lanes, addresses, values)
+        else:
+            addresses &= self.alignmask[addresses]
+            self.writebytes(lanes, addresses, values)
+            self.writebytes(lanes, (addresses + 1) & 0xffff, values >> 8)
+
+    def _chunks(self, address, length):
+        """split address..address+length-1 into runs within one page.
+        yields (address, offset, length)"""
+        offset = 0
+        while offset < length:
+            a = (address + offset) & 0xffff
+            n = min(length - offset, 0x100 - (a & 0xff))
+            if (self.kinds[a:a+n] >= PERIPHERAL).any():
+                raise BatchException('peripheral access in 0x%04x-0x%04x' % (a, a + n - 1))
+            yield a, offset, n
+            offset += n
+
+    def write(self, address, data):
+        """write data to all lanes. data is a string that is the same for
+        all lanes or an array with one row per lane"""
+        if isinstance(data, str):
+            data = numpy.frombuffer(data, numpy.uint8)
+        data = numpy.asarray(data, numpy.uint8)
+        if data.ndim == 1:
+            data = data[numpy.newaxis]
+        for a, offset, n in self._chunks(address, data.shape[1]):
+            lanepage = self.lanepages.get(a >> 8)
+            if lanepage is None:
+                lanepage = self._private(a >> 8)
+            lanepage[:, (a & 0xff):(a & 0xff) + n] = data[:, offset:offset + n]
+
+    def read(self, address, length):
+        """return the bytes address..address+length-1 of all lanes as an
+        array with one row per lane"""
+        result = numpy.empty((self.lanes, length), numpy.uint8)
+        for a, offset, n in self._chunks(address, length):
+            lanepage = self.lanepages.get(a >> 8)
+            if lanepage is None:
+                result[:, offset:offset + n] = self.image[a:a + n]
+            else:
+                result[:, offset:offset + n] = lanepage[:, (a & 0xff):(a & 0xff) + n]
+        return result
+
+    #---
+    # operands, see the argument wrappers in core
+
+    def get(self, arg, R, lanes):
+        """values of arg.get() for the lanes, R are their registers"""
+        cls = arg.__class__
+        if cls is RegisterArgument:
+            mask = arg.bytemode and 0xff or 0xffff
+            n = arg.reg.regnum
+            if n == 3:
+                return numpy.zeros(len(lanes), numpy.int64) + (core.CG2.consts[arg.am] & mask)
+            if n == 2 and arg.am:
+                return numpy.zeros(len(lanes), numpy.int64) + (core.SR.consts[arg.am] & mask)
+            return R[n] & mask
+        elif cls is ImmediateArgument:
+            return numpy.zeros(len(lanes), numpy.int64) + arg.value
+        elif cls is IndexedRegisterArgument:
+            return self.mget(lanes, arg.offset + (R[arg.reg.regnum] & 0xffff), arg.bytemode)
+        elif cls is MemoryArgument:
+            return self.mget(lanes, numpy.zeros(len(lanes), numpy.int64) + arg.address, arg.bytemode)
+        elif cls is IndirectRegisterArgument:
+            return self.mget(lanes, R[arg.reg.regnum] & 0xffff, arg.bytemode)
+        elif cls is IndirectAutoincrementRegisterArgument:
+            n = arg.reg.regnum
+            value = self.mget(lanes, R[n] & 0xffff, arg.bytemode)
+            R[n] = (R[n] + (arg.bytemode and 1 or 2)) & 0xffff
+            return value
+        raise BatchException('unknown argument %r' % (arg,))
+
+    def set(self, arg, R, lanes, values):
+        """arg.set(values) for the lanes"""
+        cls = arg.__class__
+        if cls is RegisterArgument:
+            R[arg.reg.regnum] = values & (arg.bytemode and 0xff or 0xffff)
+        elif cls is IndexedRegisterArgument:
+            self.mset(lanes, arg.offset + (R[arg.reg.regnum] & 0xffff), values, arg.bytemode)
+        elif cls is MemoryArgument:
+            self.mset(lanes, numpy.zeros(len(lanes), numpy.int64) + arg.address, values, arg.bytemode)
+        else:
+            raise ValueError("not possible as destination")
+
+    def flags(self, R, bytemode, z, n, c, v=None):
+        """set the C, Z, N and V bits of the SR from boolean arrays"""
+        bits = (z << 1) | (n << 2) | c
+        if v is not None:
+            bits |= v << 8
+        R[2] = (R[2] & 0xfef8) | bits
+
+    #---
+    # instructions, see Core.execXXX
+
+    def insn_rrc(self, R, lanes, bytemode, arg):
+        a = self.get(arg, R, lanes)
+        r = ((R[2] & 1) << (bytemode and 7 or 15)) | ((a >> 1) & (bytemode and 0x7f or 0x7fff))
+        self.flags(R, bytemode, r == 0, (r & (bytemode and 0x80 or 0x8000)) != 0, a & 1)
+        self.set(arg, R, lanes, r)
+
+    def insn_swpb(self, R, lanes, bytemode, arg):
+        if bytemode:
+            raise core.MSP430CoreException("illegal use of SWPB")
+        a = self.get(arg, R, lanes)
+        self.set(arg, R, lanes, ((a & 0xff00) >> 8) | ((a & 0x00ff) << 8))
+
+    def insn_rra(self, R, lanes, bytemode, arg):
+        a = self.get(arg, R, lanes)
+        r = (a & (bytemode and 0x80 or 0x8000)) | ((a >> 1) & (bytemode and 0x7f or 0x7fff))
+        self.flags(R, bytemode, r == 0, (r & (bytemode and 0x80 or 0x8000)) != 0, a & 1)
+        self.set(arg, R, lanes, r)
+
+    def insn_sxt(self, R, lanes, bytemode, arg):
+        if bytemode:
+            raise core.MSP430CoreException("illegal use of SXT")
+        a = self.get(arg, R, lanes)
+        r = (a & 0xff) | numpy.where(a & 0x80, 0xff00, 0)
+        self.flags(R, bytemode, r == 0, (r & 0x8000) != 0, a & 1)
+        self.set(arg, R, lanes, r)
+
+    def insn_push(self, R, lanes, bytemode, arg):
+        a = self.get(arg, R, lanes)
+        R[1] = (R[1] - 2) & 0xffff
+        self.mset(lanes, R[1], a, 0)
+
+    def insn_call(self, R, lanes, bytemode, arg):
+        R[1] = (R[1] - 2) & 0xffff
+        self.mset(lanes, R[1], R[0], 0)
+        R[0] = self.get(arg, R, lanes) & 0xffff
+
+    def insn_reti(self, R, lanes, bytemode, arg):
+        R[2] = self.mget(lanes, R[1], 0)
+        R[1] = (R[1] + 2) & 0xffff
+        R[0] = self.mget(lanes, R[1], 0)
+        R[1] = (R[1] + 2) & 0xffff
+
+    def insn_mov(self, R, lanes, bytemode, src, dst):
+        self.set(dst, R, lanes, self.get(src, R, lanes))
+
+    def _addc(self, R, lanes, bytemode, src, dst, carry):
+        m = bytemode and 0xff or 0xffff
+        b = bytemode and 0x80 or 0x8000
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        r = d + s + carry
+        self.flags(R, bytemode, (r & m) == 0, (r & b) != 0, (r < 0) | (r > m),
+            ((s ^ r) & (d ^ r) & b) != 0)
+        self.set(dst, R, lanes, r)
+
+    def insn_add(self, R, lanes, bytemode, src, dst):
+        self._addc(R, lanes, bytemode, src, dst, 0)
+
+    def insn_addc(self, R, lanes, bytemode, src, dst):
+        self._addc(R, lanes, bytemode, src, dst, R[2] & 1)
+
+    def _subc(self, R, lanes, bytemode, src, dst, carry, store):
+        m = bytemode and 0xff or 0xffff
+        b = bytemode and 0x80 or 0x8000
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        if carry is None:
+            carry = R[2] & 1
+        r = d + ((~s) & m) + carry
+        self.flags(R, bytemode, (r & m) == 0, (r & b) != 0, (r < 0) | (r > m),
+            ((d ^ s) & (d ^ r) & b) != 0)
+        if store:
+            self.set(dst, R, lanes, r)
+
+    def insn_subc(self, R, lanes, bytemode, src, dst):
+        self._subc(R, lanes, bytemode, src, dst, None, True)
+
+    def insn_sub(self, R, lanes, bytemode, src, dst):
+        self._subc(R, lanes, bytemode, src, dst, 1, True)
+
+    def insn_cmp(self, R, lanes, bytemode, src, dst):
+        self._subc(R, lanes, bytemode, src, dst, 1, False)
+
+    def insn_dadd(self, R, lanes, bytemode, src, dst):
+        raise BatchException('dadd is not supported')
+
+    def insn_bit(self, R, lanes, bytemode, src, dst):
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        r = d & s
+        self.flags(R, bytemode, r == 0, (r & (bytemode and 0x80 or 0x8000)) != 0, r != 0)
+
+    def insn_bic(self, R, lanes, bytemode, src, dst):
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        self.set(dst, R, lanes, d & ~s)
+
+    def insn_bis(self, R, lanes, bytemode, src, dst):
+        #execBIS reads and writes the destination twice
+        for i in range(2):
+            d = self.get(dst, R, lanes)
+            s = self.get(src, R, lanes)
+            self.set(dst, R, lanes, d | s)
+
+    def insn_xor(self, R, lanes, bytemode, src, dst):
+        b = bytemode and 0x80 or 0x8000
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        r = d ^ s
+        self.flags(R, bytemode, (r & (bytemode and 0xff or 0xffff)) == 0, (r & b) != 0,
+            r != 0, (s & d & b) != 0)
+        self.set(dst, R, lanes, r)
+
+    def insn_and(self, R, lanes, bytemode, src, dst):
+        d = self.get(dst, R, lanes)
+        s = self.get(src, R, lanes)
+        r = d & s
+        self.flags(R, bytemode, r == 0, (r & (bytemode and 0x80 or 0x8000)) != 0, r != 0)
+        self.set(dst, R, lanes, r)
+
+    #conditions of the jump instructions, functions of the SR
+    jumpconditions = {
+        'jnz':  lambda sr: (sr & 2) == 0,
+        'jz':   lambda sr: (sr & 2) != 0,
+        'jnc':  lambda sr: (sr & 1) == 0,
+        'jc':   lambda sr: (sr & 1) != 0,
+        'jn':   lambda sr: (sr & 4) == 0,       #same as execJN
+        'jge':  lambda sr: (((sr >> 2) ^ (sr >> 8)) & 1) == 0,
+        'jl':   lambda sr: (((sr >> 2) ^ (sr >> 8)) & 1) != 0,
+        'jmp':  None,
+    }
+
+    #---
+    # execution
+
+    def decode(self, lanes, pc):
+        """decode the instruction at pc for the lanes. returns a list of
+        (lanes, (name, args, legal, cycles, nextpc)), lanes that have
+        written different code to pc get different entries"""
+        pc = int(pc)
+        addresses = numpy.arange(pc, pc + 6) & 0xffff
+        if not (self.kinds[addresses] == PRIVATE).any():
+            return [(lanes, self._decode(pc, None))]
+        #the code is in a written page, group the lanes by its contents
+        code = numpy.empty((len(lanes), 6), numpy.int64)
+        for i, address in enumerate(addresses):
+            if self.kinds[address] == PRIVATE:
+                code[:, i] = self.lanepages[address >> 8][lanes, address & 0xff]
+            else:
+                code[:, i] = self.image[address]
+        if (code == code[0]).all():
+            return [(lanes, self._decode(pc, tuple(code[0])))]
+        rows, inverse = numpy.unique(code, axis=0, return_inverse=True)
+        return [(lanes[inverse == i], self._decode(pc, tuple(row))) for i, row in enumerate(rows)]
+
+    def _decode(self, pc, code):
+        """decode the instruction at pc, code are the bytes at pc or None
+        if they are in the shared image"""
+        insn = self.insns.get((pc, code))
+        if insn is None:
+            memory = self.scratch.memory.memory
+            for i in range(6):
+                address = (pc + i) & 0xffff
+                if code is None:
+                    memory[address] = self.image[address]
+                else:
+                    memory[address] = code[i]
+            pcreg = core.PC(self.scratch, pc)
+            name, args, execfu, cycles = self.scratch.disassemble(pcreg)
+            insn = (name, args, execfu is not None, cycles, int(pcreg))
+            self.insns[(pc, code)] = insn
+        return insn
+
+    def step(self, lanes, pc):
+        """execute one instruction for the lanes, their PC has to be pc"""
+        for lanes, (name, args, legal, cycles, nextpc) in self.decode(lanes, pc):
+            self.cycles[lanes] += cycles
+            self.instructions[lanes] += 1
+            if not legal:
+                self.regs[0, lanes] = nextpc
+                continue
+            R = self.regs[:, lanes]
+            R[0] = nextpc
+            if name in self.jumpconditions:
+                condition = self.jumpconditions[name]
+                target = (nextpc + int(args[1])) & 0xffff
+                if condition is None:
+                    R[0] = target
+                else:
+                    R[0] = numpy.where(condition(R[2]), target, nextpc)
+            else:
+                getattr(self, 'insn_%s' % name)(R, lanes, *args)
+            self.regs[:, lanes] = R
+
+    def run(self, max_cycles=None, max_instructions=None, breakpoints=None):
+        """run all lanes until each one has used up its cycle or instruction
+        budget or its PC reaches an address in breakpoints (after at least
+        one instruction), like Core.run. returns a list with the reason
+        (Core.RUN_xxx) for each lane"""
+        reasons = [None] * self.lanes
+        running = numpy.ones(self.lanes, bool)
+        limits = []
+        if max_cycles is not None:
+            limits.append((self.cycles, self.cycles + max_cycles, core.Core.RUN_CYCLES))
+        if max_instructions is not None:
+            limits.append((self.instructions, self.instructions + max_instructions, core.Core.RUN_INSTRUCTIONS))
+        if breakpoints:
+            stops = numpy.zeros(0x10000, bool)
+            stops[list(breakpoints)] = True
+        while True:
+            for counter, limit, reason in limits:
+                done = running & (counter >= limit)
+                for lane in numpy.flatnonzero(done):
+                    reasons[lane] = reason
+                running &= ~done
+            lanes = numpy.flatnonzero(running)
+            if not len(lanes):
+                break
+            pcs = self.regs[0, lanes]
+            if (pcs == pcs[0]).all():
+                self.step(lanes, pcs[0])
+            else:
+                for pc in numpy.unique(pcs):
+                    self.step(lanes[pcs == pc], pc)
+            if breakpoints:
+                done = running & stops[self.regs[0]]
+                for lane in numpy.flatnonzero(done):
+                    reasons[lane] = core.Core.RUN_BREAKPOINT
+                running &= ~done
+        return reasons
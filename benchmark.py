@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+#
+# benchmarks of the MSP430 simulator itself. synthetic workloads are
+# assembled into memory in-process and run with Core.step and Core.run;
+# the results are instructions and simulated cycles per second. it also
+# times disassembly, loading images and creating a core.
+#
+# workloads (all endless loops, run for a fixed number of instructions):
+#   loop        decrement and jump
+#   memcpy      word copy between RAM buffers
+#   hwmul       __umul32 from hwmul32.s on the hardware multiplier
+#   recursion   recursive fibonacci, calls, pushes and returns
+#   io          byte accesses to the port registers
+#
+# the results are written as JSON and can be compared with an earlier
+# run. rates that got lower or times that got higher by more than the
+# threshold are reported as regressions and give exit code 1:
+#
+#   benchmark.py -o base.json
+#   ...change core.py...
+#   benchmark.py -b base.json -t 5
+#
+# benchmarks are named like run.loop.insns, step.io.cycles, disassemble,
+# load.ihex or core; names given as arguments select the benchmarks
+# that start with them, e.g. "benchmark.py run load".
+#
+# timings are the best of several repeats; compare runs on the same
+# machine and python only.
+#
+# this is distributed under a free software license, see license.txt
+
+import sys, os, re, time
+import json
+import logging
+import tempfile
+import platform
+import core
+
+class AssemblerException(Exception): pass
+
+#------------------------
+# a small assembler for the workloads
+#------------------------
+
+DOUBLE = {'mov': 0x4, 'add': 0x5, 'addc': 0x6, 'subc': 0x7, 'sub': 0x8,
+          'cmp': 0x9, 'dadd': 0xa, 'bit': 0xb, 'bic': 0xc, 'bis': 0xd,
+          'xor': 0xe, 'and': 0xf}
+SINGLE = {'rrc': 0, 'swpb': 1, 'rra': 2, 'sxt': 3, 'push': 4, 'call': 5, 'reti': 6}
+JUMPS = {'jnz': 0, 'jne': 0, 'jz': 1, 'jeq': 1, 'jnc': 2, 'jlo': 2, 'jc': 3,
+         'jhs': 3, 'jn': 4, 'jge': 5, 'jl': 6, 'jmp': 7}
+#emulated instructions: mnemonic -> (instruction, source, destination), None
+#is filled in with the operand (both for rla)
+EMULATED = {'ret': ('mov', '@sp+', 'pc'), 'nop': ('mov', '#0', 'r3'),
+            'pop': ('mov', '@sp+', None), 'br': ('mov', None, 'pc'),
+            'clr': ('mov', '#0', None), 'inc': ('add', '#1', None),
+            'incd': ('add', '#2', None), 'dec': ('sub', '#1', None),
+            'decd': ('sub', '#2', None), 'tst': ('cmp', '#0', None),
+            'adc': ('addc', '#0', None), 'rla': ('add', None, None)}
+REGISTERS = {'pc': 0, 'sp': 1, 'sr': 2, 'cg': 3}
+#constant generator: value -> (register, As)
+CONSTANTS = {0: (3, 0), 1: (3, 1), 2: (3, 2), 0xffff: (3, 3), 4: (2, 2), 8: (2, 3)}
+#multiplier registers, as from msp430x14x.h
+MULTIPLIER = {'MPY': 0x130, 'MPYS': 0x132, 'MAC': 0x134, 'MACS': 0x136,
+              'OP2': 0x138, 'RESLO': 0x13a, 'RESHI': 0x13c, 'SUMEXT': 0x13e}
+
+def register(text):
+    text = text.lower()
+    if text in REGISTERS:
+        return REGISTERS[text]
+    if re.match(r'r(\d|1[0-5])$', text):
+        return int(text[1:])
+    return None
+
+def assemble(source, origin=0xf000, defines=None):
+    """assemble MSP430 source text to a list of words at origin. labels,
+    #define, the emulated instructions and the addressing modes are
+    supported; other directives and #include are ignored. returns the
+    words and a dict of the labels"""
+    defines = dict(defines or {})
+    lines = []
+    for lineno, line in enumerate(source.splitlines()):
+        line = line.split(';')[0].strip()
+        m = re.match(r'#define\s+(\w+)\s+(\S+)$', line)
+        if m:
+            defines[m.group(1)] = m.group(2)
+            continue
+        if not line or line[0] in '#.':
+            continue
+        m = re.match(r'(\w+):\s*(.*)$', line)
+        if m:
+            lines.append((lineno + 1, m.group(1), None, []))
+            line = m.group(2)
+            if not line:
+                continue
+        parts = line.split(None, 1)
+        operands = len(parts) > 1 and [o.strip() for o in parts[1].split(',')] or []
+        operands = [defines.get(o, o) for o in operands]
+        lines.append((lineno + 1, None, parts[0].lower(), operands))
+    #two passes: the lengths do not depend on label values
+    labels = {}
+    for final in (False, True):
+        words = []
+        for lineno, label, mnemonic, operands in lines:
+            address = origin + 2 * len(words)
+            if label is not None:
+                labels[label] = address
+                continue
+            try:
+                words.extend(encode(mnemonic, operands, address, labels, defines, final))
+            except (AssemblerException, ValueError), e:
+                raise AssemblerException('line %d: %s' % (lineno, e))
+    return words, labels
+
+def value(text, labels, defines, final):
+    text = defines.get(text, text)
+    if text in labels:
+        return labels[text]
+    if text in MULTIPLIER:
+        return MULTIPLIER[text]
+    if re.match(r'-?(0x[0-9a-fA-F]+|\d+)$', text):
+        return int(text, 0) & 0xffff
+    if final:
+        raise AssemblerException('unknown symbol %r' % text)
+    return 0            #label defined later, first pass
+
+def operand(text, labels, defines, final):
+    """return (register, As or Ad, extension words) of an operand"""
+    if text.startswith('#'):
+        v = value(text[1:], labels, defines, final)
+        #only numbers use the constant generator, labels always take the
+        #same length in both passes
+        if re.match(r'-?(0x[0-9a-fA-F]+|\d+)$', defines.get(text[1:], text[1:])) and v in CONSTANTS:
+            return CONSTANTS[v][0], CONSTANTS[v][1], []
+        return 0, 3, [v]
+    if text.startswith('&'):
+        return 2, 1, [value(text[1:], labels, defines, final)]
+    if text.startswith('@'):
+        if text.endswith('+'):
+            r = register(text[1:-1])
+            mode = 3
+        else:
+            r = register(text[1:])
+            mode = 2
+        if r is None:
+            raise AssemblerException('bad operand %r' % text)
+        return r, mode, []
+    m = re.match(r'(.+)\((\w+)\)$', text)
+    if m and register(m.group(2)) is not None:
+        return register(m.group(2)), 1, [value(m.group(1), labels, defines, final)]
+    r = register(text)
+    if r is None:
+        raise AssemblerException('bad operand %r' % text)
+    return r, 0, []
+
+def encode(mnemonic, operands, address, labels, defines, final):
+    """return the words of one instruction"""
+    bytemode = 0
+    if mnemonic.endswith('.b'):
+        bytemode = 1
+        mnemonic = mnemonic[:-2]
+    elif mnemonic.endswith('.w'):
+        mnemonic = mnemonic[:-2]
+    if mnemonic in EMULATED:
+        mnemonic, src, dst = EMULATED[mnemonic]
+        if src is None and dst is None:
+            operands = operands * 2         #rla x: add x, x
+        else:
+            operands = (src and [src] or []) + operands + (dst and [dst] or [])
+    if mnemonic in JUMPS:
+        if len(operands) != 1:
+            raise AssemblerException('%s takes one operand' % mnemonic)
+        offset = (value(operands[0], labels, defines, final) - address - 2) & 0xffff
+        if offset & 0x8000:
+            offset -= 0x10000
+        if final and not -1024 <= offset <= 1022:
+            raise AssemblerException('jump out of range')
+        return [0x2000 | (JUMPS[mnemonic] << 10) | ((offset >> 1) & 0x3ff)]
+    if mnemonic in SINGLE:
+        if mnemonic == 'reti':
+            return [0x1300]
+        if len(operands) != 1:
+            raise AssemblerException('%s takes one operand' % mnemonic)
+        r, mode, ext = operand(operands[0], labels, defines, final)
+        return [0x1000 | (SINGLE[mnemonic] << 7) | (bytemode << 6) | (mode << 4) | r] + ext
+    if mnemonic in DOUBLE:
+        if len(operands) != 2:
+            raise AssemblerException('%s takes two operands' % mnemonic)
+        s, smode, sext = operand(operands[0], labels, defines, final)
+        d, dmode, dext = operand(operands[1], labels, defines, final)
+        if dmode > 1:
+            raise AssemblerException('bad destination %r' % operands[1])
+        return [(DOUBLE[mnemonic] << 12) | (s << 8) | (dmode << 7) | (bytemode << 6) |
+                (smode << 4) | d] + sext + dext
+    raise AssemblerException('unknown instruction %r' % mnemonic)
+
+#------------------------
+# workloads
+#------------------------
+
+LOOP = """
+start:  mov #1000, r5
+loop:   dec r5
+        jnz loop
+        jmp start
+"""
+
+MEMCPY = """
+start:  mov #0x0200, r6
+        mov #0x0400, r7
+        mov #64, r8
+copy:   mov @r6+, 0(r7)
+        incd r7
+        dec r8
+        jnz copy
+        inc &0x0200
+        jmp start
+"""
+
+HWMUL = """
+start:  mov #0x1234, r12
+        mov #0x5678, r13
+        mov #0x9abc, r10
+        mov #0xdef0, r11
+again:  call #__umul32
+        inc r12
+        add r12, r10
+        jmp again
+"""
+
+RECURSION = """
+start:  mov #12, r15
+        call #fib
+        jmp start
+fib:    cmp #2, r15
+        jl base
+        push r14
+        push r15
+        dec r15
+        call #fib
+        mov r15, r14
+        pop r15
+        decd r15
+        call #fib
+        add r14, r15
+        pop r14
+base:   ret
+"""
+
+IO = """
+start:  mov.b #0xff, &0x0022
+        mov #100, r5
+toggle: xor.b #1, &0x0021
+        mov.b &0x0020, r6
+        bis.b r6, &0x0029
+        bic.b #0x0f, &0x0029
+        dec r5
+        jnz toggle
+        jmp start
+"""
+
+def hwmul32():
+    """return the source of hwmul32.s next to this file"""
+    return open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hwmul32.s')).read()
+
+WORKLOADS = [
+    ('loop', lambda: LOOP),
+    ('memcpy', lambda: MEMCPY),
+    ('hwmul', lambda: HWMUL + hwmul32()),
+    ('recursion', lambda: RECURSION),
+    ('io', lambda: IO),
+]
+
+def machine():
+    """return a core with flash, RAM, the multiplier and the ports"""
+    c = core.Core(trace=core.Core.TRACE_OFF)
+    for p in (core.Flash(), core.RAM(0x0200, 0x09ff), core.Multiplier(), core.ExtendedPorts()):
+        c.memory.append(p)
+    return c
+
+def prepare(source):
+    """return a core with the program loaded and ready to run"""
+    c = machine()
+    words, labels = assemble(source)
+    for n, word in enumerate(words):
+        c.memory._set(0xf000 + 2 * n, word)
+    c.SP.set(0x0a00)
+    c.PC.set(0xf000)
+    return c
+
+#------------------------
+# measurements
+#------------------------
+
+def best(fu, repeat, number=1):
+    """return the time of one call of fu(), the best of repeat samples
+    of number calls each"""
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        for i in xrange(number):
+            fu()
+        times.append((time.time() - start) / number)
+    return min(times)
+
+def execution(source, engine, count, repeat):
+    """return (instructions, cycles, seconds) of the best of repeat runs
+    of count instructions"""
+    results = []
+    for n in range(repeat):
+        c = prepare(source)
+        if engine == 'step':
+            step = c.step
+            start = time.time()
+            for i in xrange(count):
+                step()
+        else:
+            start = time.time()
+            c.run(max_instructions=count)
+        results.append((time.time() - start, c.instructions, c.cycles))
+    seconds, instructions, cycles = min(results)
+    return instructions, cycles, seconds
+
+def disassembly(count, repeat):
+    """return decoded instructions per second of Core.disassemble over the
+    code of all workloads, without the decode cache"""
+    programs = []       #(core, instruction addresses)
+    for name, source in WORKLOADS:
+        c = prepare(source())
+        end = 0xf000 + 2 * len(assemble(source())[0])
+        addresses = []
+        while c.regs[0] < end:
+            addresses.append(c.regs[0])
+            c.disassemble(c.PC)
+        programs.append((c, addresses))
+    total = sum([len(addresses) for c, addresses in programs])
+    rounds = max(1, count // total)
+    def decode():
+        for n in xrange(rounds):
+            for c, addresses in programs:
+                pc = c.PC
+                disassemble = c.disassemble
+                for address in addresses:
+                    pc.set(address)
+                    disassemble(pc)
+    return rounds * total / best(decode, repeat)
+
+def images(directory):
+    """write test images of 60K of data as Intel HEX and TI-Text, return
+    a list of (name, filename)"""
+    data = bytearray([(n * 7 + (n >> 8)) & 0xff for n in range(0x1000, 0x10000)])
+    ihex = os.path.join(directory, 'image.a43')
+    f = open(ihex, 'w')
+    for offset in range(0, len(data), 16):
+        address = 0x1000 + offset
+        record = bytearray([16, address >> 8, address & 0xff, 0]) + data[offset:offset + 16]
+        record.append(-sum(record) & 0xff)
+        f.write(':%s\n' % str(record).encode('hex').upper())
+    f.write(':00000001FF\n')
+    f.close()
+    titext = os.path.join(directory, 'image.txt')
+    f = open(titext, 'w')
+    f.write('@1000\n')
+    for offset in range(0, len(data), 16):
+        f.write(' '.join(['%02X' % b for b in data[offset:offset + 16]]) + '\n')
+    f.write('q\n')
+    f.close()
+    return [('ihex', ihex), ('titext', titext)]
+
+def runall(names=None, scale=1.0, repeat=3):
+    """run the benchmarks whose name starts with one of names (all if
+    None). returns a dict name -> {'value': .., 'unit': ..}"""
+    results = {}
+    def wanted(name):
+        return names is None or [n for n in names if name.startswith(n)]
+    def put(name, value, unit):
+        results[name] = {'value': value, 'unit': unit}
+    for workload, source in WORKLOADS:
+        for engine, count in (('step', 20000), ('run', 200000)):
+            name = '%s.%s' % (engine, workload)
+            if not wanted(name):
+                continue
+            instructions, cycles, seconds = execution(source(), engine, int(count * scale), repeat)
+            put(name + '.insns', instructions / seconds, 'insns/s')
+            put(name + '.cycles', cycles / seconds, 'cycles/s')
+    if wanted('disassemble'):
+        put('disassemble', disassembly(int(20000 * scale), repeat), 'insns/s')
+    if wanted('load'):
+        directory = tempfile.mkdtemp()
+        try:
+            memory = machine().memory
+            for kind, filename in images(directory):
+                if wanted('load.' + kind):
+                    put('load.' + kind, best(lambda: memory.load(filename), repeat, 10), 's')
+                os.remove(filename)
+        finally:
+            os.rmdir(directory)
+    if wanted('core'):
+        put('core', best(machine, repeat, 100), 's')
+    return results
+
+#------------------------
+# results
+#------------------------
+
+def save(filename, results):
+    """write results with a description of the host to a JSON file"""
+    f = open(filename, 'w')
+    try:
+        json.dump({
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'results': results,
+        }, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+def load(filename):
+    """return the results of a JSON file written by save()"""
+    return json.load(open(filename))['results']
+
+def compare(results, baseline, threshold):
+    """return a list of (name, value, unit, base value, change) for the
+    benchmarks in both, change is positive for improvements; and the
+    names of the regressions: changes below -threshold (a fraction)"""
+    rows = []
+    regressions = []
+    for name in sorted(results):
+        value, unit = results[name]['value'], results[name]['unit']
+        base = baseline.get(name)
+        if base is None or not base['value'] or not value:
+            rows.append((name, value, unit, None, None))
+            continue
+        if unit.endswith('/s'):
+            change = value / base['value'] - 1
+        else:
+            change = base['value'] / value - 1      #times, lower is better
+        rows.append((name, value, unit, base['value'], change))
+        if change < -threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def report(rows, regressions):
+    """return the comparison as text"""
+    lines = ['%-24s %14s %-9s %14s %8s' % ('benchmark', 'value', 'unit', 'baseline', 'change')]
+    for name, value, unit, base, change in rows:
+        if base is None:
+            lines.append('%-24s %14.6g %-9s' % (name, value, unit))
+        else:
+            lines.append('%-24s %14.6g %-9s %14.6g %+7.1f%%%s' % (name, value, unit, base,
+                100 * change, name in regressions and ' REGRESSION' or ''))
+    return '\n'.join(lines) + '\n'
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] [benchmark...]')
+    parser.add_option('-o', '--output', metavar='FILE', default=None,
+        help='write the results to FILE as JSON')
+    parser.add_option('-b', '--baseline', metavar='FILE', default=None,
+        help='compare with the results in FILE')
+    parser.add_option('-t', '--threshold', type='float', default=10.0, metavar='PERCENT',
+        help='slow down that counts as regression (default: %default)')
+    parser.add_option('-r', '--repeat', type='int', default=3, metavar='N',
+        help='best of N runs (default: %default)')
+    parser.add_option('-s', '--scale', type='float', default=1.0, metavar='X',
+        help='multiply the instruction counts by X (default: %default)')
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = runall(args or None, options.scale, options.repeat)
+    if options.output:
+        save(options.output, results)
+    baseline = {}
+    if options.baseline:
+        baseline = load(options.baseline)
+    rows, regressions = compare(results, baseline, options.threshold / 100.0)
+    sys.stdout.write(report(rows, regressions))
+    if regressions:
+        sys.stdout.write('%d regressions over %g%%\n' % (len(regressions), options.threshold))
+    sys.exit(regressions and 1 or 0)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+#
+# compact binary execution trace for the MSP430 simulator. a Recorder
+# attached to a core writes one fixed size record per translated block
+# that Core.run executes (and per instruction of Core.step) into a ring
+# buffer. full parts of the ring are compressed and written by a
+# background thread, together with an index by cycle count so that a
+# Reader can jump to any part of a long trace.
+#
+# record: block, instruction count, cycles after it and the registers
+# R0..R15 after it. the memory writes of a record are buffered and
+# stored with its number. the addresses of the instructions inside a
+# block are not recorded for every run of it: each chunk has a table of
+# the blocks it uses with their Block.addresses, and the reader rebuilds
+# the PCs from it. an instruction run by Core.step is a block of its
+# own. a record with count 0 sets the registers from outside, e.g. when
+# recording starts; the reader calls it REGS, the others EXEC.
+#
+# file: header, chunks, index (first cycles, last cycles, offset (QQQ) of
+# each chunk), footer (index offset, chunks, magic (QI8s)). a chunk is a
+# header (first cycles, last cycles, records, writes, block table words,
+# compressed size (QQIIII)) and zlib data that holds the records and
+# writes field by field:
+#   block (H), count (H), cycles (Q) of each record, then for each
+#   register the values of all records as XOR with the previous record
+#   (H), the first record of a chunk is stored whole; record number (I),
+#   bytemode (B), address (H), value (H) of each write; the block table,
+#   start and count (HH) and the addresses (H) of each block.
+#
+# as script it prints a trace file, optionally only a range of cycles.
+#
+# this is distributed under a free software license, see license.txt
+
+import sys, struct, zlib
+import threading
+import Queue
+import bisect
+import array
+import binascii
+
+MAGIC = 'MSPTRC\x03\x00'
+CHUNK = struct.Struct('<QQIIII')
+INDEX = struct.Struct('<QQQ')
+FOOTER = struct.Struct('<QI8s')
+FOOTERMAGIC = 'MSPTRIDX'
+
+#record kinds
+EXEC    = 1
+REGS    = 2
+
+RECORD = 19                 #slots of a record in the ring: Block (or the
+                            #address of a single instruction), count,
+                            #cycles, R0..R15
+
+class TraceException(Exception): pass
+
+def words(values, typecode='H'):
+    """return values as little endian string of an array type"""
+    values = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tostring()
+
+def xorstrings(a, b):
+    """return the bytewise XOR of two strings of the same length. they are
+    XORed as long integers, which is much faster than byte by byte"""
+    if not a:
+        return a
+    value = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+    return binascii.unhexlify('%0*x' % (2 * len(a), value))
+
+def unwords(data, offset, count, typecode='H'):
+    """return count values of an array type from data at offset and the
+    offset after them"""
+    values = array.array(typecode)
+    end = offset + count * values.itemsize
+    values.fromstring(data[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+class Recorder:
+    """record the execution of a core to a file, see the description at
+    the top. the ring holds chunks parts of chunksize records that are
+    used in turn; if the writer falls behind, recording waits for a free
+    part"""
+
+    def __init__(self, core, filename, chunksize=4096, chunks=8, level=1):
+        self.core = core
+        self.level = level          #zlib compression level
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.index = []             #(first cycles, last cycles, offset)
+        self.ring = [0] * (RECORD * chunksize * chunks)
+        self.free = Queue.Queue()
+        for n in range(chunks):
+            self.free.put(n * RECORD * chunksize)
+        self.full = Queue.Queue()
+        self.size = RECORD * chunksize
+        self.start = self.free.get()    #first slot of the part being filled
+        self.fill = self.start      #next free slot
+        self.end = self.start + self.size
+        self.pending = []           #(address, value, bytemode) not yet recorded
+        self.writes = []            #(record, address, value, bytemode) of the part
+        self.error = None           #exception of the writer thread
+        self.writer = threading.Thread(target=self._write, name='trace writer')
+        self.writer.setDaemon(True)
+        self.writer.start()
+        self.attach()
+
+    def attach(self):
+        """record the memory writes and become core.recorder. translated
+        code is dropped so that it writes through the recorder"""
+        memory = self.core.memory
+        set = memory.set
+        def recordedset(address, value, bytemode=0, append=self.pending.append):
+            set(address, value, bytemode)
+            append((address, value, bytemode))
+        self.saved = memory.__dict__.get('set')
+        memory.set = recordedset
+        self.core.recorder = self
+        memory.invalidatecode(0, 0x10000)
+        self.registers()
+
+    def detach(self):
+        memory = self.core.memory
+        if self.saved is None:
+            del memory.__dict__['set']      #back to the method of the class
+        else:
+            memory.set = self.saved
+        self.core.recorder = None
+        memory.invalidatecode(0, 0x10000)
+
+    def close(self):
+        """stop recording, write the rest and the index and close the file"""
+        self.detach()
+        if self.pending:
+            self.registers()            #writes not done by an instruction
+        if self.fill > self.start:
+            self.full.put((self.start, self.fill, self.writes))
+        self.full.put(None)
+        self.writer.join()
+        if self.error is not None:
+            self.file.close()
+            raise TraceException('trace writer failed: %s' % (self.error,))
+        offset = self.file.tell()
+        self.file.write(''.join([INDEX.pack(*entry) for entry in self.index]))
+        self.file.write(FOOTER.pack(offset, len(self.index), FOOTERMAGIC))
+        self.file.close()
+
+    def _write(self):
+        """writer thread: encode, compress and write full parts"""
+        while True:
+            item = self.full.get()
+            if item is None:
+                break
+            start, fill, writes = item
+            try:
+                if self.error is None:
+                    self.chunk(self.ring[start:fill], writes)
+            except Exception, e:
+                self.error = e
+            self.free.put(start)
+
+    def chunk(self, slots, writes):
+        """write the records in slots and their writes as one chunk"""
+        blocks = slots[0::RECORD]
+        cycles = slots[2::RECORD]
+        table = sorted(set(blocks), key=lambda block: (getattr(block, 'start', block), blocks.index(block)))
+        numbers = dict(zip(table, range(len(table))))
+        data = [words(map(numbers.__getitem__, blocks)), words(slots[1::RECORD]),
+            struct.pack('<%dQ' % len(cycles), *cycles)]
+        for n in range(3, RECORD):
+            column = words(slots[n::RECORD])
+            data.append(xorstrings(column, '\0\0' + column[:-2]))
+        if writes:
+            records, addresses, values, bytemodes = zip(*writes)
+            bytemodes = [bytemode and 1 or 0 for bytemode in bytemodes]
+            data.extend([words(records, 'I'), words(bytemodes, 'B'),
+                words([address & 0xffff for address in addresses]),
+                words([value & (bytemode and 0xff or 0xffff) for value, bytemode in zip(values, bytemodes)])])
+        blockwords = []
+        for block in table:
+            if block.__class__ is int:
+                blockwords.extend([block, 1, block])    #a single instruction
+            else:
+                blockwords.extend([block.start, block.count])
+                blockwords.extend(block.addresses)
+        data.append(words(blockwords))
+        data = zlib.compress(''.join(data), self.level)
+        self.index.append((cycles[0], cycles[-1], self.file.tell()))
+        self.file.write(CHUNK.pack(cycles[0], cycles[-1], len(blocks), len(writes),
+            len(blockwords), len(data)))
+        self.file.write(data)
+
+    #---
+    # recording
+
+    def record(self, block, count):
+        """add a record with the current cycles and registers. block is a
+        Block or the address of a single instruction, count 0 makes it a
+        REGS record"""
+        core = self.core
+        fill = self.fill
+        ring = self.ring
+        ring[fill:fill + 3] = (block, count, core.cycles)
+        ring[fill + 3:fill + RECORD] = core.regs
+        if self.pending:
+            self.buffer(fill)
+        fill += RECORD
+        self.fill = fill
+        if fill == self.end:
+            self.flush()
+
+    def buffer(self, fill):
+        """move the pending memory writes to the record at fill"""
+        record = (fill - self.start) // RECORD
+        self.writes.extend([(record,) + write for write in self.pending])
+        del self.pending[:]
+
+    def flush(self):
+        """hand the filled part of the ring to the writer and continue in
+        the next free one"""
+        self.full.put((self.start, self.fill, self.writes))
+        self.writes = []
+        self.start = self.fill = self.free.get()
+        self.end = self.start + self.size
+
+    def registers(self):
+        """record all registers, e.g. after they were changed from outside"""
+        core = self.core
+        if core.pendingflags is not None:
+            core.SR.value           #materialize pending flags
+        self.record(core.regs[0], 0)
+
+    #hooks called by the core
+
+    def block(self, block, count, pc):
+        """count instructions of a Block were run by Core.run. translated
+        code leaves no pending flags. this is called for every block, so
+        record() is inlined"""
+        core = self.core
+        fill = self.fill
+        ring = self.ring
+        ring[fill:fill + 3] = (block, count, core.cycles)
+        ring[fill + 3:fill + RECORD] = core.regs
+        if self.pending:
+            self.buffer(fill)
+        fill += RECORD
+        self.fill = fill
+        if fill == self.end:
+            self.flush()
+
+    def instruction(self, address, name, args, pc):
+        """one instruction was executed by Core.step"""
+        if self.core.pendingflags is not None:
+            self.core.SR.value
+        self.record(address, 1)
+
+class Reader:
+    """random access to a file written by Recorder"""
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise TraceException('%s: not a trace file' % filename)
+        self.file.seek(-FOOTER.size, 2)
+        offset, count, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != FOOTERMAGIC:
+            raise TraceException('%s: trace file without index, not closed?' % filename)
+        self.file.seek(offset)
+        data = self.file.read(count * INDEX.size)
+        self.index = [INDEX.unpack_from(data, n * INDEX.size) for n in range(count)]
+        self.lasts = [last for first, last, offset in self.index]
+
+    def close(self):
+        self.file.close()
+
+    def chunk(self, n):
+        """return the records of chunk n as list of tuples (kind, addresses,
+        cycles, registers, writes). addresses are the PCs of the executed
+        instructions, registers the values of R0..R15 after them and
+        writes a list of (bytemode, address, value)"""
+        self.file.seek(self.index[n][2])
+        first, last, count, nwrites, nblockwords, size = CHUNK.unpack(self.file.read(CHUNK.size))
+        data = zlib.decompress(self.file.read(size))
+        blocks, offset = unwords(data, 0, count)
+        counts, offset = unwords(data, offset, count)
+        cycles = struct.unpack_from('<%dQ' % count, data, offset)
+        offset += 8 * count
+        registers = []
+        for r in range(16):
+            values, offset = unwords(data, offset, count)
+            for i in range(1, count):
+                values[i] ^= values[i - 1]
+            registers.append(values)
+        columns = []
+        for typecode in 'IBHH':
+            values, offset = unwords(data, offset, nwrites, typecode)
+            columns.append(values)
+        writes = [[] for i in range(count)]
+        for record, bytemode, address, value in zip(*columns):
+            writes[record].append((bytemode, address, value))
+        blockwords, offset = unwords(data, offset, nblockwords)
+        table = []
+        i = 0
+        while i < nblockwords:
+            table.append(list(blockwords[i + 2:i + 2 + blockwords[i + 1]]))
+            i += 2 + blockwords[i + 1]
+        records = []
+        for i, regs in enumerate(zip(*registers)):
+            if counts[i]:
+                records.append((EXEC, table[blocks[i]][:counts[i]], cycles[i], list(regs), writes[i]))
+            else:
+                records.append((REGS, [], cycles[i], list(regs), writes[i]))
+        return records
+
+    def records(self, first=0, last=None):
+        """yield the records (kind, addresses, cycles, registers, writes)
+        with first <= cycles <= last"""
+        for n in range(bisect.bisect_left(self.lasts, first), len(self.index)):
+            if last is not None and self.index[n][0] > last:
+                break
+            for record in self.chunk(n):
+                if record[2] < first:
+                    continue
+                if last is not None and record[2] > last:
+                    return
+                yield record
+
+    def __iter__(self):
+        return self.records()
+
+def changes(records):
+    """yield (record, changed) for records, changed is a list of (register,
+    value) of the registers that differ from the previous record, all for
+    the first one"""
+    previous = None
+    for record in records:
+        registers = record[3]
+        if previous is None:
+            changed = list(enumerate(registers))
+        else:
+            changed = [(n, value) for n, value in enumerate(registers) if value != previous[n]]
+        previous = registers
+        yield record, changed
+
+def describe(record, changed=()):
+    """return the text for a record, one line per memory write and one
+    for the record"""
+    kind, addresses, cycles, registers, writes = record
+    lines = ['%10d        [0x%04x] <- 0x%04x %s' % (cycles, address, value, bytemode and 'b' or 'w')
+        for bytemode, address, value in writes]
+    regs = ' '.join(['R%d=0x%04x' % r for r in changed])
+    if kind == EXEC:
+        lines.append('%10d %s: %s' % (cycles, ' '.join(['0x%04x' % a for a in addresses]), regs))
+    elif kind == REGS:
+        lines.append('%10d registers %s' % (cycles, regs))
+    else:
+        lines.append('%10d unknown record kind %d' % (cycles, kind))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] trace')
+    parser.add_option('-f', '--from', dest='first', type='int', default=0, metavar='CYCLES',
+        help='start at this cycle count')
+    parser.add_option('-t', '--to', dest='last', type='int', default=None, metavar='CYCLES',
+        help='stop after this cycle count')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected one trace file')
+    reader = Reader(args[0])
+    for record, changed in changes(reader.records(options.first, options.last)):
+        print describe(record, changed)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# execution history for reverse debugging with the MSP430 simulator.
+# History.run() executes like Core.run() and takes a checkpoint
+# (Core.snapshot) every interval cycles. the core is deterministic, so
+# any earlier instruction can be reached again by restoring the nearest
+# checkpoint before it and running forward: goto(), stepback() and
+# continueback() build on that.
+#
+# positions are instruction counts (core.instructions). checkpoints
+# share unchanged pages of the memory and of peripheral buffers (RAM,
+# flash), their size is estimated from the pages that differ from the
+# previous one. when the budget is exceeded, every other checkpoint of
+# the older half is dropped, so that the history covers the whole run
+# with fewer checkpoints the further back it goes.
+# the first checkpoint is never dropped.
+#
+# when the state of the core is changed from outside (registers, memory,
+# reset), the recorded past no longer leads to it and forget() has to
+# be called.
+#
+# this is distributed under a free software license, see license.txt
+
+import bisect
+import core
+
+def unshared(pages, previous):
+    """return the bytes of the pages that are not the same objects as
+    the pages at the same positions of previous"""
+    return sum([len(page) for n, page in enumerate(pages)
+        if n >= len(previous) or page is not previous[n]])
+
+class History:
+    """checkpoints of a core, see the description at the top"""
+
+    INTERVAL = 20000        #cycles between checkpoints
+    BUDGET = 64 << 20       #bytes of checkpoints kept at most
+    OVERHEAD = 1024         #estimated bytes of a checkpoint besides its pages
+
+    def __init__(self, core, interval=INTERVAL, budget=BUDGET):
+        self.core = core
+        self.interval = interval
+        self.budget = budget
+        self.forget()
+
+    def forget(self):
+        """drop all checkpoints, the history starts over at the next run"""
+        self.checkpoints = []       #Snapshots sorted by instructions
+        self.positions = []         #instructions of the checkpoints
+        self.sizes = []             #estimated bytes of the checkpoints
+        self.size = 0
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def begin(self):
+        """return the first position that can be reached, None if there is
+        no history"""
+        if not self.positions:
+            return None
+        return self.positions[0]
+
+    #---
+    # recording
+
+    def estimate(self, n):
+        """return the bytes used by checkpoint n, counting the pages of the
+        memory and of the peripherals that it does not share with its
+        predecessor"""
+        pages, peripherals = self.checkpoints[n].memory
+        if n:
+            previous, previousperipherals = self.checkpoints[n - 1].memory
+        else:
+            previous, previousperipherals = (), [{}] * len(peripherals)
+        size = self.OVERHEAD + unshared(pages, previous)
+        for state, previousstate in zip(peripherals, previousperipherals):
+            for name, value in state.items():
+                if isinstance(value, core.Pages):
+                    size += unshared(value, previousstate.get(name, ()))
+        return size
+
+    def checkpoint(self):
+        """take a checkpoint if the last one before the current position is
+        at least interval cycles ago. returns the cycle count at which
+        the next one is due"""
+        c = self.core
+        n = bisect.bisect_right(self.positions, c.instructions)
+        if n and (self.positions[n - 1] == c.instructions or
+                  c.cycles - self.checkpoints[n - 1].cycles < self.interval):
+            return self.checkpoints[n - 1].cycles + self.interval
+        self.checkpoints.insert(n, c.snapshot())
+        self.positions.insert(n, c.instructions)
+        self.sizes.insert(n, self.estimate(n))
+        self.size += self.sizes[n]
+        if n + 1 < len(self.checkpoints):
+            self.resize(n + 1)
+        if self.size > self.budget:
+            self.thin()
+        return c.cycles + self.interval
+
+    def resize(self, n):
+        size = self.estimate(n)
+        self.size += size - self.sizes[n]
+        self.sizes[n] = size
+
+    def thin(self):
+        """drop every other checkpoint of the older half, but the first"""
+        for n in range(len(self.checkpoints) // 2 - 1, 0, -2):
+            self.size -= self.sizes[n]
+            del self.checkpoints[n], self.positions[n], self.sizes[n]
+            self.resize(n)
+
+    def run(self, max_instructions=None, breakpoints=None, until=None, illegal_is_fatal=False):
+        """like Core.run, taking checkpoints on the way"""
+        c = self.core
+        if max_instructions is not None:
+            max_instructions += c.instructions
+        while True:
+            due = self.checkpoint()
+            remaining = None
+            if max_instructions is not None:
+                remaining = max_instructions - c.instructions
+            reason = c.run(max_cycles=max(1, due - c.cycles), max_instructions=remaining,
+                breakpoints=breakpoints, until=until, illegal_is_fatal=illegal_is_fatal)
+            if reason != c.RUN_CYCLES:
+                return reason
+
+    def step(self, illegal_is_fatal=False):
+        """like Core.step, taking a checkpoint if one is due"""
+        self.checkpoint()
+        return self.core.step(illegal_is_fatal)
+
+    #---
+    # going back
+
+    def goto(self, position):
+        """bring the core to the state after position instructions.
+        returns false if that is before the first checkpoint. the replay
+        is at most one checkpoint interval long and not stopped by
+        Core.stop(), e.g. from watches"""
+        if not self.positions or position < self.positions[0]:
+            return False
+        c = self.core
+        n = bisect.bisect_right(self.positions, position) - 1
+        if not self.positions[n] <= c.instructions <= position:
+            c.restore(self.checkpoints[n])      #else continue from here
+        while c.instructions < position:
+            self.run(max_instructions=position - c.instructions)
+        return True
+
+    def stepback(self):
+        """go back one instruction. returns false if the first checkpoint
+        is reached"""
+        return self.goto(self.core.instructions - 1)
+
+    def continueback(self, breakpoints, until=None):
+        """go back to the last position before the current one where the
+        PC is in breakpoints or until(core) is true after an instruction.
+        returns false and goes to the first checkpoint if there is none"""
+        c = self.core
+        limit = end = c.instructions
+        while self.positions and end > self.positions[0]:
+            n = bisect.bisect_left(self.positions, end) - 1
+            start = self.positions[n]
+            c.restore(self.checkpoints[n])
+            hits = []
+            if not n and c.regs[0] in breakpoints:
+                hits.append(start)      #other starts are the end of the previous scan
+            while c.instructions < end:
+                reason = self.run(max_instructions=end - c.instructions,
+                    breakpoints=breakpoints, until=until)
+                if reason == c.RUN_STOPPED:
+                    return False
+                if reason in (c.RUN_BREAKPOINT, c.RUN_UNTIL) and c.instructions < limit:
+                    hits.append(c.instructions)
+            if hits:
+                return self.goto(hits[-1])
+            end = start
+        self.goto(self.begin())
+        return False
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+# execution coverage for the MSP430 simulator. a Coverage object is
+# attached to a core with core.coverage = Coverage(). it records every
+# executed instruction address in a 64K bitmap and how often each
+# conditional jump was taken and not taken. data of several runs or
+# processes is combined with merge() or by loading several files.
+#
+# as script it merges coverage files for an image and writes an
+# annotated disassembly listing and optionally an lcov tracefile that
+# refers to the lines of that listing. for ELF images the listing has
+# labels and the lcov file functions from the symbol table:
+#
+#   codecoverage.py -o fw.lst --lcov fw.info fw.a43 run1.cov run2.cov
+#
+# this is distributed under a free software license, see license.txt
+
+import sys, zlib, binascii
+import json
+import core
+
+#jumps that can go either way, the others of Core.jumpInstructions are jmp
+CONDITIONAL = frozenset([name for name, fu, cycles in core.Core.jumpInstructions
+    if name != 'jmp'])
+
+class CoverageException(Exception): pass
+
+class Coverage:
+    """executed addresses and branch counters of one or more runs"""
+
+    def __init__(self):
+        self.executed = bytearray(0x10000)  #1 for each executed insn address
+        self.branches = {}                  #jump address -> [taken, not taken]
+        self.marked = {}                    #block start -> (addresses, branch), see mark()
+
+    def __getstate__(self):
+        #only a cache
+        state = self.__dict__.copy()
+        state['marked'] = {}
+        return state
+
+    def instruction(self, address, name, args, pc):
+        """record one instruction executed by Core.step. pc is the PC
+        after the instruction"""
+        self.executed[address] = 1
+        if name in CONDITIONAL:
+            counts = self.branches.get(address)
+            if counts is None:
+                counts = self.branches[address] = [0, 0]
+            counts[pc != (address + 2 + int(args[1])) & 0xffff] += 1
+
+    def block(self, block, count, pc):
+        """record count instructions of a Block executed by Core.run. pc is
+        the PC after them"""
+        if count == block.count:
+            marked = self.marked.get(block.start)
+            if marked is not None and marked[0] is block.addresses:
+                branch = marked[1]
+            else:
+                branch = self.mark(block)
+            if branch is not None:
+                branch[0][pc != branch[1]] += 1
+        else:
+            for address in block.addresses[:count]:
+                self.executed[address] = 1
+
+    def mark(self, block):
+        """record all addresses of block as executed. returns the branch
+        counters and the jump target when it ends with a conditional jump.
+        the result is cached by start address, with the addresses of the
+        block: a block translated again for the same start has new ones
+        and is marked again, so only one entry per address is kept and
+        the replaced blocks are not held"""
+        for address in block.addresses:
+            self.executed[address] = 1
+        branch = None
+        if block.branch is not None:
+            address, target = block.branch
+            counts = self.branches.get(address)
+            if counts is None:
+                counts = self.branches[address] = [0, 0]
+            branch = (counts, target)
+        self.marked[block.start] = (block.addresses, branch)
+        return branch
+
+    def reset(self):
+        """forget everything recorded so far"""
+        self.executed[:] = bytearray(0x10000)
+        self.branches.clear()
+        self.marked.clear()
+
+    def merge(self, other):
+        """add the data of an other Coverage"""
+        executed = self.executed
+        for address in other.addresses():
+            executed[address] = 1
+        for address, (taken, nottaken) in other.branches.items():
+            counts = self.branches.get(address)
+            if counts is None:
+                counts = self.branches[address] = [0, 0]
+            counts[0] += taken
+            counts[1] += nottaken
+
+    def addresses(self):
+        """return the sorted list of executed addresses"""
+        executed = self.executed
+        addresses = []
+        start = executed.find('\x01')
+        while start >= 0:
+            addresses.append(start)
+            start = executed.find('\x01', start + 1)
+        return addresses
+
+    def __len__(self):
+        return self.executed.count('\x01')
+
+    #---
+    # files
+
+    def save(self, filename):
+        """write the data as JSON, the bitmap is compressed"""
+        data = {
+            'version': 1,
+            'executed': binascii.b2a_base64(zlib.compress(str(self.executed), 9)).strip(),
+            'branches': sorted([[address, taken, nottaken]
+                for address, (taken, nottaken) in self.branches.items()]),
+        }
+        f = open(filename, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+
+    def load(self, filename):
+        """merge the data of a file written by save()"""
+        f = open(filename)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        if data.get('version') != 1:
+            raise CoverageException('%s: unknown coverage file version' % filename)
+        other = Coverage()
+        executed = zlib.decompress(binascii.a2b_base64(data['executed']))
+        if len(executed) != 0x10000:
+            raise CoverageException('%s: bad bitmap size' % filename)
+        other.executed = bytearray(executed)
+        for address, taken, nottaken in data['branches']:
+            other.branches[address] = [taken, nottaken]
+        self.merge(other)
+
+    #---
+    # reports
+
+    def regions(self, gap=32):
+        """return (start, end) ranges of executed code. executed addresses
+        that are less than gap bytes apart are put in one range"""
+        regions = []
+        for address in self.addresses():
+            if regions and address - regions[-1][1] < gap:
+                regions[-1][1] = address + 2
+            else:
+                regions.append([address, address + 2])
+        return [tuple(r) for r in regions]
+
+    def annotate(self, msp, symbols=None, gap=32):
+        """disassemble the executed regions of the memory of the core msp.
+        symbols is an optional mapping address -> name. returns a list of
+        (address, name, text) where address and name are None for label
+        and separator lines and name is the insn name otherwise"""
+        symbols = symbols or {}
+        executed = self.executed
+        rows = []
+        for start, end in self.regions(gap):
+            if rows:
+                rows.append((None, None, ''))
+            address = start
+            while address < end:
+                label = symbols.get(address)
+                if label is not None:
+                    rows.append((None, None, '%s:' % label))
+                pc = core.PC(msp, address)
+                name, args, execfu, cycles = msp.disassemble(pc)
+                nextpc = int(pc)
+                #resynchronize when an executed insn starts inside this one
+                for a in range(address + 2, min(nextpc, end), 2):
+                    if executed[a]:
+                        nextpc = a
+                        name, args = '.word', [0, '0x%04x' % msp.memory.get(address)]
+                        break
+                text = '%s%s %s' % (name, ('', '.b')[args[0]], ', '.join(map(str, args[1:])))
+                counts = self.branches.get(address)
+                if counts is not None:
+                    text = '%-40s [taken %d, not taken %d]' % (text, counts[0], counts[1])
+                rows.append((address, name, '%s  0x%04x:  %s' % (
+                    executed[address] and '     1' or '######', address, text)))
+                if nextpc <= address:
+                    break       #wrap around
+                address = nextpc
+        return rows
+
+    def listing(self, msp, symbols=None, gap=32):
+        """return the annotated disassembly as text, see annotate()"""
+        return '\n'.join([text for address, name, text in self.annotate(msp, symbols, gap)]) + '\n'
+
+    def lcov(self, msp, listingname, symbols=None, gap=32, testname=''):
+        """return an lcov tracefile for the listing written to listingname.
+        lines are instructions, functions are the symbols"""
+        symbols = symbols or {}
+        executed = self.executed
+        functions = []      #(line, name, hit)
+        branches = []       #(line, n, count or None)
+        lines = []          #(line, hit)
+        rows = self.annotate(msp, symbols, gap)
+        for lineno, (address, name, text) in enumerate(rows):
+            if address is None:
+                continue
+            lineno += 1
+            label = symbols.get(address)
+            if label is not None:
+                functions.append((lineno - 1, label, executed[address]))   #label line
+            lines.append((lineno, executed[address]))
+            if name in CONDITIONAL:
+                counts = self.branches.get(address)
+                for n in (0, 1):
+                    branches.append((lineno, n, counts and counts[n]))
+        records = ['TN:%s' % testname, 'SF:%s' % listingname]
+        records.extend(['FN:%d,%s' % (lineno, label) for lineno, label, hit in functions])
+        records.extend(['FNDA:%d,%s' % (hit, label) for lineno, label, hit in functions])
+        records.append('FNF:%d' % len(functions))
+        records.append('FNH:%d' % len([f for f in functions if f[2]]))
+        records.extend(['BRDA:%d,0,%d,%s' % (lineno, n, count is None and '-' or count)
+            for lineno, n, count in branches])
+        records.append('BRF:%d' % len(branches))
+        records.append('BRH:%d' % len([b for b in branches if b[2]]))
+        records.extend(['DA:%d,%d' % line for line in lines])
+        records.append('LF:%d' % len(lines))
+        records.append('LH:%d' % len([l for l in lines if l[1]]))
+        records.append('end_of_record')
+        return '\n'.join(records) + '\n'
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] image coverage...')
+    parser.add_option('-o', '--output', metavar='FILE', default=None,
+        help='write the listing to FILE instead of stdout')
+    parser.add_option('--lcov', metavar='FILE', default=None,
+        help='also write an lcov tracefile, requires -o')
+    parser.add_option('--save', metavar='FILE', default=None,
+        help='save the merged coverage data to FILE')
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error('expected an image and at least one coverage file')
+    if options.lcov and not options.output:
+        parser.error('--lcov needs a listing written with -o')
+
+    coverage = Coverage()
+    for filename in args[1:]:
+        coverage.load(filename)
+    if options.save:
+        coverage.save(options.save)
+    msp = core.Core(trace=core.Core.TRACE_OFF)
+    msp.memory.load(args[0])
+    symbols = msp.memory.symbols    #only ELF files have symbols
+    listing = coverage.listing(msp, symbols)
+    if options.output:
+        open(options.output, 'w').write(listing)
+        if options.lcov:
+            open(options.lcov, 'w').write(coverage.lcov(msp, options.output, symbols, testname=args[0]))
+    else:
+        sys.stdout.write(listing)
+    both = [c for c in coverage.branches.values() if c[0] and c[1]]
+    sys.stderr.write('%d instructions executed, %d of %d branches went both ways\n' % (
+        len(coverage), len(both), len(coverage.branches)))
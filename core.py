@@ -8,7 +8,10 @@
 # $Id: core.py,v 1.20 2008/05/29 13:48:17 cliechti Exp $
 
 import sys
+import copy
 import logging
+import binascii
+import elf
 
 try:
     import psyco
@@ -84,31 +87,96 @@ class MemoryAccessWatch:
                 address, bytemode and 'b' or 'w', self.description
             ))
 
+#kinds of Watchpoints
+WATCH_READ      = 1
+WATCH_WRITE     = 2
+WATCH_ACCESS    = WATCH_READ | WATCH_WRITE
+
+class Watchpoint:
+    """watch on the address range first..last, see Memory.watch().
+    callback(memory, bytemode, writing, address, value) is called after
+    each access of the given kind that overlaps the range and, when value
+    is not None, reads or writes that value. without callback the access
+    is logged"""
+    def __init__(self, first, last, kind=WATCH_ACCESS, description='', callback=None, value=None):
+        self.log = logging.getLogger('watch')
+        self.first = first
+        self.last = last
+        self.kind = kind
+        self.description = description
+        self.callback = callback
+        self.value = value
+
+    def __call__(self, memory, bytemode, writing, address, value):
+        if self.callback is not None:
+            self.callback(memory, bytemode, writing, address, value)
+        else:
+            self.log.info('%s: @0x%04x: 0x%04x %s %s' % (
+                writing and 'write' or 'read', address, value,
+                bytemode and 'b' or 'w', self.description
+            ))
+
+    def __repr__(self):
+        return '<Watchpoint 0x%04x-0x%04x %s>' % (self.first, self.last,
+            ('', 'read', 'write', 'access')[self.kind])
+
+class WatchDict(dict):
+    """address -> watch function dict, for Memory.getwatches and
+    Memory.setwatches. it keeps the watch bits of the memory up to date"""
+    def __init__(self, memory, bit):
+        dict.__init__(self)
+        self.memory = memory
+        self.bit = bit
+
+    def __setitem__(self, address, watch):
+        dict.__setitem__(self, address, watch)
+        if 0 <= address <= 0xffff:
+            self.memory.watchmap[address] |= self.bit
+
+    def __delitem__(self, address):
+        dict.__delitem__(self, address)
+        if 0 <= address <= 0xffff:
+            self.memory.watchmap[address] &= ~self.bit
+
+    def update(self, other):
+        for address, watch in other.items():
+            self[address] = watch
+
+    def clear(self):
+        for address in self.keys():
+            del self[address]
+
 ##################################################################
 ## CPU registers
 ##################################################################
 
-class Register(Subject):
-    """generic register"""
-    def __init__(self, core, value=0, regnum=None):
-        Subject.__init__(self)          #init model for observer pattern
+class Register(object):
+    """generic register. registers are views on one entry of a register
+    file, a list of 16 ints. the core's registers share core.regs, other
+    registers (e.g. a PC used to disassemble) get their own"""
+    __slots__ = ('core', 'regs', 'regnum')
+
+    def __init__(self, core, value=0, regnum=None, regs=None):
         self.core = core
-        self.value = value
+        if regs is None:
+            regs = [0]*16
+        self.regs = regs
         self.regnum = regnum
-        self.log = logging.getLogger('register')
-        self.log.debug('initiliaize R%02d -> 0x%04x' % (self.regnum, value))
+        self.value = value
+
+    def _getvalue(self):
+        return self.regs[self.regnum]
+    def _setvalue(self, value):
+        self.regs[self.regnum] = value
+    value = property(_getvalue, _setvalue)
 
     def set(self, value, bytemode=0, am=0):
         """write value to register"""
-        self.log.debug('write 0x%04x -> R%02d mode:%s' % (value, self.regnum, bytemode and 'b' or 'w'))
-        self.value = value & (bytemode and 0xff or 0xffff)
-        self.notify()
+        self.regs[self.regnum] = value & (bytemode and 0xff or 0xffff)
 
     def get(self, bytemode=0, am=0):
         """read register"""
-        value = self.value & (bytemode and 0xff or 0xffff)
-        self.log.debug('read R%02d -> 0x%04x mode:%s' % (self.regnum, value, bytemode and 'b' or 'w'))
-        return value
+        return self.regs[self.regnum] & (bytemode and 0xff or 0xffff)
     
     def __getitem__(self, index):
         """indexed memory access"""
@@ -129,15 +197,17 @@ class Register(Subject):
 #programm counter
 class PC(Register):
     """Program counter"""
+    __slots__ = ()
     
-    def __init__(self, core, value=0):
-        Register.__init__(self, core, value, regnum=0)
+    def __init__(self, core, value=0, regs=None):
+        Register.__init__(self, core, value, regnum=0, regs=regs)
 
     def next(self):
-        """fetch a value and advance one word"""
-        if self.log: self.log.debug('next @PC+')
-        value = self.core.memory.get(bytemode=0, address=self.value)
-        self.set(self.value + 2)
+        """fetch a value and advance one word. fetches are not data
+        accesses, they do not trigger watches"""
+        regs = self.regs
+        value = self.core.memory._get(regs[0])
+        regs[0] = (regs[0] + 2) & 0xffff
         return value
 
     def __repr__(self):
@@ -155,21 +225,18 @@ class PC(Register):
 
 class SP(Register):
     """Stack pointer"""
+    __slots__ = ()
     
-    def __init__(self, core, value=0):
-        Register.__init__(self, core, value, regnum=1)
+    def __init__(self, core, value=0, regs=None):
+        Register.__init__(self, core, value, regnum=1, regs=regs)
     
     def push(self, value):
         self.set(self.value - 2)
-        self.log.debug('push @-SP, 0x%04x' % (value))
         self.core.memory.set(bytemode=0, address=self.value, value=value)
-        self.notify()
     
     def pop(self):
         value = self.core.memory.get(bytemode=0, address=self.value)
         self.set(self.value + 2)
-        self.log.debug('pop @SP+ -> 0x%04x' % (value))
-        self.notify()
         return value
 
     def __repr__(self):
@@ -179,13 +246,41 @@ class SP(Register):
     def __str__(self):
         return "SP"
 
+def _srbit(mask):
+    """property for one bit of the SR"""
+    def get(self):
+        return (self.value & mask) != 0
+    def set(self, value):
+        if value:
+            self.value |= mask
+        else:
+            self.value &= ~mask
+    return property(get, set)
+
 #status register/CG1
 class SR(Register):
-    """SR combined with Constant Generator Register 1"""
+    """SR combined with Constant Generator Register 1
+
+    the C, Z, N and V bits are evaluated lazily: the ALU instructions
+    store a flag function with their result and operands in
+    core.pendingflags and the bits are only computed when the value of
+    the SR is read. regs[2] does not include pending flags."""
+    __slots__ = ()
     consts = (None,None,4,8)
 
-    def __init__(self, core, value=0):
-        Register.__init__(self, core, value, regnum=2)
+    def __init__(self, core, value=0, regs=None):
+        Register.__init__(self, core, value, regnum=2, regs=regs)
+
+    def _getvalue(self):
+        pending = self.core.pendingflags
+        if pending is not None:
+            self.core.pendingflags = None
+            self.regs[2] = (self.regs[2] & 0xfef8) | pending[0](*pending[1:])
+        return self.regs[2]
+    def _setvalue(self, value):
+        self.core.pendingflags = None   #overwritten
+        self.regs[2] = value
+    value = property(_getvalue, _setvalue)
 
     bits = {
         'C':      0x0001,
@@ -198,31 +293,23 @@ class SR(Register):
         'SCG1':   0x0080,
         'V':      0x0100,
     }
+    C       = _srbit(0x0001)
+    Z       = _srbit(0x0002)
+    N       = _srbit(0x0004)
+    GIE     = _srbit(0x0008)
+    CPUOff  = _srbit(0x0010)
+    OSCOff  = _srbit(0x0020)
+    SCG0    = _srbit(0x0040)
+    SCG1    = _srbit(0x0080)
+    V       = _srbit(0x0100)
 
-    def __getattr__(self, name):
-        if self.bits.has_key(name):
-            mask = self.bits[name]
-            return (self.value & mask) != 0
-        else:
-            return self.__dict__[name]
-
-    def __setattr__(self, name, value):
-        if self.bits.has_key(name):
-            mask = self.bits[name]
-            if value:
-                self.value  |= mask
-            else:
-                self.value  &= ~mask
-            self.notify()
-        else:
-            self.__dict__[name] = value
+    def set(self, value, bytemode=0, am=0):
+        self.value = value & (bytemode and 0xff or 0xffff)
 
     #custom get for CG1
     def get(self, bytemode=0, am=0):
         if am == 0: return self.value & (bytemode and 0xff or 0xffff)
-        value = self.consts[am] & (bytemode and 0xff or 0xffff)
-        self.log.debug('REGSTR: read     R%02d -> 0x%04x mode:%s' % (self.regnum, value, bytemode and 'b' or 'w'))
-        return value
+        return self.consts[am] & (bytemode and 0xff or 0xffff)
 
     def __repr__(self):
         """return register name and contents"""
@@ -238,15 +325,14 @@ class SR(Register):
 
 class CG2(Register):
     """Constant Generator Register 2"""
+    __slots__ = ()
     consts = (0,1,2,0xffff)
 
-    def __init__(self, core, value=0):
-        Register.__init__(self, core, value, regnum=3)
+    def __init__(self, core, value=0, regs=None):
+        Register.__init__(self, core, value, regnum=3, regs=regs)
 
     def get(self, bytemode=0, am=0):
-        value = self.consts[am] & (bytemode and 0xff or 0xffff)
-        self.log.debug('read R%02d -> 0x%04x mode:%s' % (self.regnum, value, bytemode and 'b' or 'w'))
-        return value
+        return self.consts[am] & (bytemode and 0xff or 0xffff)
 
     def __repr__(self):
         return "CG2 = -"
@@ -257,6 +343,10 @@ class CG2(Register):
 ##################################################################
 ## Main Memory
 ##################################################################
+class Pages(tuple):
+    """the contents of a bytearray as strings of 256 bytes, see
+    Peripheral.snapshot()"""
+
 class Peripheral:
     color = (0x33, 0x33, 0x33)      #color for graphical representation
     def __init__(self):
@@ -267,6 +357,24 @@ class Peripheral:
         """return true if address is handled by this peripheral"""
         raise NotImplementedError
 
+    def ranges(self):
+        """return a list of (first, last) address ranges that are handled
+        by this peripheral. Memory uses it to build its address decoder
+        when the peripheral is appended. the default asks __contains__ for
+        every address, override it for faster setup"""
+        ranges = []
+        first = None
+        for address in range(0x10000):
+            if address in self:
+                if first is None:
+                    first = address
+            elif first is not None:
+                ranges.append((first, address - 1))
+                first = None
+        if first is not None:
+            ranges.append((first, 0xffff))
+        return ranges
+
     def reset(self):
         """perform a power up reset"""
         raise NotImplementedError
@@ -279,6 +387,53 @@ class Peripheral:
         """read from address"""
         raise NotImplementedError
 
+    def snapshot(self):
+        """return the state of the peripheral, see Core.snapshot(). the
+        default copies all attributes but the logger. bytearrays are
+        stored as Pages; like the pages of Memory.snapshot(), pages that
+        did not change since the last snapshot or restore share the
+        string"""
+        state = {}
+        lastpages = self.__dict__.setdefault('lastpages', {})
+        for name, value in self.__dict__.items():
+            if name in ('log', 'lastpages'):
+                continue
+            if isinstance(value, bytearray):
+                last = lastpages.get(name, ())
+                pages = []
+                for n, offset in enumerate(range(0, len(value), 256)):
+                    data = value[offset:offset + 256]
+                    if n < len(last) and data == last[n]:
+                        pages.append(last[n])
+                    else:
+                        pages.append(str(data))
+                state[name] = lastpages[name] = Pages(pages)
+            else:
+                state[name] = copy.deepcopy(value)
+        return state
+
+    def restore(self, state):
+        """set the state that was returned by snapshot()"""
+        lastpages = self.__dict__.setdefault('lastpages', {})
+        for name, value in state.items():
+            old = self.__dict__.get(name)
+            if isinstance(value, Pages):
+                lastpages[name] = value
+                value = ''.join(value)
+            if isinstance(old, bytearray) and len(old) == len(value):
+                if old != value:
+                    old[:] = value
+            elif isinstance(old, bytearray):
+                self.__dict__[name] = bytearray(value)
+            else:
+                self.__dict__[name] = copy.deepcopy(value)
+
+    def view(self, address, length):
+        """return a memoryview of the bytes at address..address+length-1
+        if they are held in a buffer, or None if they have to be accessed
+        with get/set"""
+        return None
+
 class Flash(Peripheral):
     """flash memory"""
     color = (0xff, 0xaa, 0x88)      #color for graphical representation
@@ -300,9 +455,13 @@ class Flash(Peripheral):
         return self.startaddress <= address <= self.endaddress \
             or self.FCTL1 <= address <= self.FCTL3+1
 
+    def ranges(self):
+        """return the handled address ranges"""
+        return [(self.FCTL1, self.FCTL3+1), (self.startaddress, self.endaddress)]
+
     def reset(self):
         """perform a power up reset"""
-        self.values = [0xff] * (self.endaddress - self.startaddress + 1)
+        self.values = bytearray('\xff' * (self.endaddress - self.startaddress + 1))
 
     def set(self, address, value, bytemode=0):
         """write value to address"""
@@ -328,6 +487,12 @@ class Flash(Peripheral):
                          self.values[(address-self.startaddress & 0xfffe)]
         return value
 
+    def view(self, address, length):
+        """return a memoryview of the flash contents"""
+        if self.startaddress <= address and address + length - 1 <= self.endaddress:
+            offset = address - self.startaddress
+            return memoryview(self.values)[offset:offset+length]
+
 class RAM(Peripheral):
     """RAM memory"""
     color = (0xaa, 0xff, 0x88)      #color for graphical representation
@@ -342,9 +507,13 @@ class RAM(Peripheral):
         """return true if address is handled by this peripheral"""
         return self.startaddress <= address <= self.endaddress
 
+    def ranges(self):
+        """return the handled address ranges"""
+        return [(self.startaddress, self.endaddress)]
+
     def reset(self):
         """perform a power up reset"""
-        self.values = [0] * (self.endaddress - self.startaddress + 1)
+        self.values = bytearray(self.endaddress - self.startaddress + 1)
 
     def set(self, address, value, bytemode=0):
         """write value to address"""
@@ -363,6 +532,12 @@ class RAM(Peripheral):
                      self.values[(address-self.startaddress & 0xfffe)]
         return value
 
+    def view(self, address, length):
+        """return a memoryview of the RAM contents"""
+        if self.startaddress <= address and address + length - 1 <= self.endaddress:
+            offset = address - self.startaddress
+            return memoryview(self.values)[offset:offset+length]
+
 class Multiplier(Peripheral):
     """hardware mutiplier"""
     #op1, op2 contain signed numbers
@@ -378,6 +553,10 @@ class Multiplier(Peripheral):
         """return true if address is handled by this peripheral"""
         return 0x0130 <= address <= 0x013f
 
+    def ranges(self):
+        """return the handled address ranges"""
+        return [(0x0130, 0x013f)]
+
     def reset(self):
         """perform a power up reset"""
         self.mode = 0
@@ -483,6 +662,10 @@ class ExtendedPorts(Peripheral):
         """return true if address is handled by this peripheral"""
         return self.values.has_key(address)
 
+    def ranges(self):
+        """return the handled address ranges"""
+        return [(address, address) for address in sorted(self.values)]
+
     def reset(self):
         """perform a power up reset"""
         self.values = {
@@ -508,85 +691,306 @@ class Memory(Subject):
     def __init__(self):
         Subject.__init__(self)          #init model for observer pattern
         self.log = logging.getLogger('memory')
-        self.setwatches = {}        #serached on reads
-        self.getwatches = {}        #serached on writes
-        self.accesswatches = []     #searched allways
+        self.watchmap = bytearray(65536) #watch bits per address, see watch()
+        self.watchpages = {}        #address>>8 -> list of Watchpoints in that page
+        self.setwatches = WatchDict(self, self.SETWATCH)    #address -> fu, called on writes
+        self.getwatches = WatchDict(self, self.GETWATCH)    #address -> fu, called on reads
+        self.accesswatches = []     #called on every access, slow, use watch()
         self.peripherals = []
+        self.pages = [None] * 256   #address decoder, see append()
+        self.codecaches = []        #caches of decoded code, see invalidatecode()
+        self.codemap = bytearray(65536) #nonzero where cached code may be affected by a write
+        self.lastpages = (None,) * 256  #pages of the last snapshot, see snapshot()
+        self.symbols = elf.SymbolTable()    #names from loaded ELF files
         self.reset()                #init memory
 
     def append(self, peripheral):
+        """add a peripheral to the address space. addresses that are already
+        handled by an other peripheral are not taken over.
+
+        the address decoder has one entry per 256 byte page. it is None
+        for plain memory, the peripheral when it handles the whole page or
+        a list with an entry per address for pages that are shared."""
         self.peripherals.append(peripheral)
+        for first, last in peripheral.ranges():
+            for address in range(first & 0xffff, (last & 0xffff) + 1):
+                page = self.pages[address >> 8]
+                if page is None and (address & 0xff) == 0 and last - address >= 0xff:
+                    self.pages[address >> 8] = peripheral    #whole page
+                    continue
+                if page.__class__ is not list:
+                    if page is not None:
+                        continue    #whole page is already taken
+                    page = self.pages[address >> 8] = [None] * 256
+                if page[address & 0xff] is None:
+                    page[address & 0xff] = peripheral
+
+    def peripheral(self, address):
+        """return the peripheral that handles address or None for plain memory"""
+        p = self.pages[(address >> 8) & 0xff]
+        if p.__class__ is list:
+            return p[address & 0xff]
+        return p
 
     def __getitem__(self, address):
-        for p in self.peripherals:
-            if address in p:
-                return p
-        return self
+        return self.peripheral(address) or self
+
+    #bits in watchmap, WATCH_READ and WATCH_WRITE are used for Watchpoints
+    GETWATCH = 4
+    SETWATCH = 8
+
+    def watch(self, first, last, kind=WATCH_ACCESS, description='', callback=None, value=None):
+        """watch the addresses first..last and return the Watchpoint.
+        accesses of unwatched addresses only cost a lookup in watchmap,
+        Python code is only run for hits. only data accesses are watched,
+        instruction fetches (also of immediates and other extension
+        words) never hit a watchpoint"""
+        watchpoint = Watchpoint(first & 0xffff, last & 0xffff, kind, description, callback, value)
+        for page in self._watchedpages(watchpoint):
+            self.watchpages.setdefault(page, []).append(watchpoint)
+        self.updatewatchmap(watchpoint.first - 1, watchpoint.last)
+        return watchpoint
+
+    def unwatch(self, watchpoint):
+        """remove a Watchpoint added with watch()"""
+        for page in self._watchedpages(watchpoint):
+            self.watchpages[page].remove(watchpoint)
+            if not self.watchpages[page]:
+                del self.watchpages[page]
+        self.updatewatchmap(watchpoint.first - 1, watchpoint.last)
+
+    def _watchedpages(self, watchpoint):
+        """pages in which accesses can hit a Watchpoint. word accesses
+        start one byte before the range"""
+        pages = range(watchpoint.first >> 8, (watchpoint.last >> 8) + 1)
+        before = ((watchpoint.first - 1) & 0xffff) >> 8
+        if before not in pages:
+            pages.insert(0, before)
+        return pages
+
+    def updatewatchmap(self, first, last):
+        """recalculate the Watchpoint bits of watchmap for first..last"""
+        for address in range(first, last + 1):
+            address &= 0xffff
+            bits = self.watchmap[address] & (self.GETWATCH | self.SETWATCH)
+            for w in self.watchpages.get(address >> 8, ()):
+                if w.first - 1 <= address <= w.last:
+                    bits |= w.kind
+            self.watchmap[address] = bits
+
+    def hitwatches(self, address, bytemode, writing, value):
+        """call the Watchpoints that cover an access"""
+        last = address + (not bytemode)
+        kind = writing and WATCH_WRITE or WATCH_READ
+        for w in tuple(self.watchpages.get(address >> 8, ())):
+            if w.first <= last and address <= w.last and w.kind & kind \
+                    and (w.value is None or w.value == value):
+                w(self, bytemode, writing, address, value)
 
     def reset(self):
         """perform a reset"""
         for p in self.peripherals: p.reset()
-        self.memory = [0]*65536
+        self.memory = bytearray(65536)
+        self.invalidatecode(0, 0x10000)
         self.notify()
 
-    def load(self, filename):
-        """fill memory with the contents of a file. file type is determined from extension"""
+    def snapshot(self):
+        """return the contents of the memory and the states of the
+        peripherals. the memory is held as one string per 256 byte page,
+        pages that did not change since the last snapshot or restore share
+        the string, so many snapshots of one image are cheap"""
+        last = self.lastpages
+        memory = self.memory
+        pages = []
+        for page in range(256):
+            data = memory[page << 8:(page + 1) << 8]
+            if data == last[page]:
+                pages.append(last[page])
+            else:
+                pages.append(str(data))
+        self.lastpages = pages = tuple(pages)
+        return pages, [p.snapshot() for p in self.peripherals]
+
+    def restore(self, state):
+        """set the contents returned by snapshot(). only pages that differ
+        are written and cached code is dropped for them"""
+        pages, peripherals = state
+        memory = self.memory
+        data = ''.join(pages)
+        if memory != data:
+            #search the changed pages in 4k chunks
+            for chunk in range(0, 0x10000, 0x1000):
+                if memory[chunk:chunk+0x1000] != data[chunk:chunk+0x1000]:
+                    for a in range(chunk, chunk + 0x1000, 0x100):
+                        if memory[a:a+0x100] != pages[a >> 8]:
+                            self.invalidatecode(a, 0x100)
+                            memory[a:a+0x100] = pages[a >> 8]
+        self.lastpages = pages
+        for p, pstate in zip(self.peripherals, peripherals):
+            for first, last in p.ranges():
+                if 1 in self.codemap[first:last+1] and p.snapshot() != pstate:
+                    self.invalidatecode(first, last - first + 1)
+            p.restore(pstate)
+        self.notify()
+
+    def markcode(self, address, length):
+        """remember that the bytes at address..address+length-1 are held
+        decoded in a code cache. the mark is one byte wider on each side
+        so that aligned word writes next to the code are seen too"""
+        for a in range(address - 1, address + length + 1):
+            self.codemap[a & 0xffff] = 1
+
+    def invalidatecode(self, address, length):
+        """tell all code caches that memory at address..address+length-1
+        was modified and clear the marks that are no longer needed"""
+        for c in self.codecaches:
+            c.invalidate(address, length)
+        if length >= 0x10000:
+            self.codemap = bytearray(65536)
+        else:
+            for a in range(address + 1, address + length - 1):
+                self.codemap[a & 0xffff] = 0
+
+    def load(self, filename, cache=None):
+        """fill memory with the contents of a file. file type is determined
+        from extension. cache is an optional imagecache.ImageCache that
+        keeps the parsed contents of files"""
         self.log.info('loading file %r' % filename)
-        if filename[-4:].lower() == '.txt':
-            self.loadTIText(open(filename, "r"))
+        if cache is not None:
+            spans, symbols = cache.read(filename, self.readfile)
         else:
-            self.loadIHex(open(filename, "r"))
+            spans, symbols = self.readfile(filename)
+        self.loadspans(spans, symbols)
+
+    def readfile(self, filename):
+        """parse a file, see load(). returns a list of (address, data)
+        and an elf.SymbolTable or None"""
+        file = open(filename, 'rb')
+        try:
+            if filename[-4:].lower() == '.txt':
+                return self.readTIText(file), None
+            elif filename[-4:].lower() == '.elf' or file.read(4) == '\x7fELF':
+                return self.readELF(filename)
+            else:
+                file.seek(0)
+                return self.readIHex(file), None
+        finally:
+            file.close()
+
+    def loadspans(self, spans, symbols=None):
+        """write a list of (address, data) to memory, add the symbols"""
+        for address, data in spans:
+            self._loadspan(address, data)
+        if symbols is not None:
+            self.symbols.update(symbols)
+        self.notify()
+
+    def loadELF(self, filename):
+        """load the segments of an ELF file and add its symbols to
+        self.symbols"""
+        self.loadspans(*self.readELF(filename))
+
+    def readELF(self, filename):
+        """return the segments and the symbols of an ELF file"""
+        image = elf.ELFFile(filename)
+        try:
+            return image.segments(), image.symbols()
+        finally:
+            image.close()
 
     def loadIHex(self, file):
         """load data from a (opened) file in Intel-HEX format"""
-        for l in file.readlines():
+        self.loadspans(self.readIHex(file))
+
+    def readIHex(self, file):
+        """parse an (opened) file in Intel-HEX format. checksums are
+        verified, extended address records (type 02, 04) are applied and
+        contiguous records are joined. returns a list of (address, data)"""
+        spans = []          #[address, length, list of data strings]
+        base = 0            #from extended address records
+        for lineno, l in enumerate(file):
+            l = l.strip()       #fix CR-LF issues...
+            if not l:
+                continue
             if l[0] != ':':
                 raise IOError("file format error")
-            l = l.strip()       #fix CR-LF issues...
-            count    = int(l[1:3],16)
-            address  = int(l[3:7],16)
-            code     = int(l[7:9],16)
-            checksum = int(l[-2:],16)
-
+            try:
+                record = binascii.unhexlify(l[1:])
+            except TypeError:
+                raise IOError("line %d: bad hex digits" % (lineno + 1,))
+            if len(record) < 5 or len(record) != ord(record[0]) + 5:
+                raise IOError("line %d: bad record length" % (lineno + 1,))
+            if sum(bytearray(record)) & 0xff:
+                raise IOError("line %d: checksum error" % (lineno + 1,))
+            code = ord(record[3])
+            if code in (0x02, 0x04) and ord(record[0]) != 2:
+                raise IOError("line %d: bad extended address record" % (lineno + 1,))
             if code == 0x00:
-                for i in range(count):
-                    value = int(l[9+i*2:11+i*2],16)
-                    self._set(address+i, value, bytemode=1)
-            elif code in [0x01, 0x02, 0x03]:
-                pass        #known types but not useful?!?
+                address = base + ((ord(record[1]) << 8) | ord(record[2]))
+                data = record[4:-1]
+                if spans and spans[-1][0] + spans[-1][1] == address:
+                    spans[-1][1] += len(data)
+                    spans[-1][2].append(data)
+                else:
+                    spans.append([address, len(data), [data]])
+            elif code == 0x01:
+                break       #end of file
+            elif code == 0x02:
+                base = ((ord(record[4]) << 8) | ord(record[5])) << 4
+            elif code == 0x04:
+                base = ((ord(record[4]) << 8) | ord(record[5])) << 16
+            elif code in (0x03, 0x05):
+                pass        #start address, the reset vector is used instead
             else:
                 self.log.warning("Ignored unknown field (type 0x%02x) in ihex file." % (code,))
-        self.notify()
+        return [(address, ''.join(chunks)) for address, length, chunks in spans]
 
     def loadTIText(self, file):
         """load data from a (opened) file in TI-Text format"""
-        next        = 1
-        currentAddr = 0
-        startAddr   = 0
-        segmentdata = []
-        #Convert data for MSP430, TXT-File is parsed line by line
-        while next >= 1:
-            #Read one line
-            l = file.readline()
-            if not l: break #EOF
+        self.loadspans(self.readTIText(file))
+
+    def readTIText(self, file):
+        """parse an (opened) file in TI-Text format. returns a list of
+        (address, data), one for each section"""
+        spans = []          #[address, list of data strings]
+        for lineno, l in enumerate(file):
             l = l.strip()
+            if not l:
+                continue
             if l[0] == 'q': break
-            elif l[0] == '@':        #if @ => new address => send frame and set new addr.
-                address = int(l[1:],16)
+            elif l[0] == '@':        #if @ => new address => new span
+                spans.append([int(l[1:],16), []])
             else:
-                for i in l.split():
-                    value = int(i,16)
-                    self._set(address, value, bytemode=1)
-                    address += 1
-
+                tokens = l.split()
+                try:
+                    data = binascii.unhexlify(''.join(tokens))
+                except TypeError:
+                    data = None
+                if not spans or data is None or len(data) != len(tokens):
+                    raise IOError("line %d: file format error" % (lineno + 1,))
+                spans[-1][1].append(data)
+        return [(address, ''.join(chunks)) for address, chunks in spans]
+
+    def _loadspan(self, address, data):
+        """write data from a file to memory, parts outside of the 64k
+        address space are dropped with a warning"""
+        if address + len(data) > 0x10000:
+            self.log.warning('data at 0x%x-0x%x is outside of the 64k address space, truncated' % (
+                address, address + len(data) - 1))
+            data = data[:max(0, 0x10000 - address)]
+        if data:
+            self.write(address, data)
 
     def _set(self, address, value, bytemode=0):
         """quiet set without logging"""
         address &= 0xffff       #16 bit wrap around
-        for p in self.peripherals:
-            if address in p:
-                p.set(address, value, bytemode)
-                break
+        if self.codemap[address]:   #overwriting cached code?
+            self.invalidatecode(address - 2, 5)
+        p = self.pages[address >> 8]
+        if p.__class__ is list:
+            p = p[address & 0xff]
+        if p is not None:
+            p.set(address, value, bytemode)
         else:
             if bytemode:
                 self.memory[address] = value & 0xff
@@ -599,19 +1003,21 @@ class Memory(Subject):
         if address > 0xffff:
             self.log.error('write outside valid of address range (0x%04x)' % (address, ))
             address &= 0xffff       #16 bit wrap around
-        self.log.debug('write 0x%04x <- 0x%04x mode:%s' % (address, value, bytemode and 'b' or 'w'))
-        if self.setwatches.has_key(address): self.setwatches[address](address, bytemode, self.memory[address], value)  #call watch
+        watched = self.watchmap[address]
+        if watched & self.SETWATCH: self.setwatches[address](address, bytemode, self.memory[address], value)  #call watch
         for a in self.accesswatches: a(self, bytemode, 1, address)
         self._set(address, value, bytemode)
+        if watched & WATCH_WRITE: self.hitwatches(address, bytemode, 1, value)
         self.notify(address, bytemode)
 
     def _get(self, address, bytemode=0):
         """quiet get without logging"""
         address &= 0xffff       #16 bit wrap around
-        for p in self.peripherals:
-            if address in p:
-                value = p.get(address, bytemode)
-                break
+        p = self.pages[address >> 8]
+        if p.__class__ is list:
+            p = p[address & 0xff]
+        if p is not None:
+            value = p.get(address, bytemode)
         else:
             if bytemode:
                 value = self.memory[address]
@@ -624,22 +1030,88 @@ class Memory(Subject):
         if address > 0xffff:
             self.log.error('read outside of valid address range (0x%04x)' % (address, ))
             address &= 0xffff       #16 bit wrap around
-        if self.getwatches.has_key(address): self.getwatches[address](address, bytemode, self.memory[address], None)  #call watch
+        watched = self.watchmap[address]
+        if watched & self.GETWATCH: self.getwatches[address](address, bytemode, self.memory[address], None)  #call watch
         for a in self.accesswatches: a(self, bytemode, 0, address)
         value = self._get(address, bytemode)
-        self.log.debug('read 0x%04x -> 0x%04x mode:%s' % (address, value, bytemode and 'b' or 'w'))
+        if watched & WATCH_READ: self.hitwatches(address, bytemode, 0, value)
+        return value
+
+    def tracedset(self, address, value, bytemode=0):
+        """set() that logs the access, used for Core.TRACE_MEMORY"""
+        self.log.debug('write 0x%04x <- 0x%04x mode:%s' % (address & 0xffff, value, bytemode and 'b' or 'w'))
+        Memory.set(self, address, value, bytemode)
+
+    def tracedget(self, address, bytemode=0):
+        """get() that logs the access, used for Core.TRACE_MEMORY"""
+        value = Memory.get(self, address, bytemode)
+        self.log.debug('read 0x%04x -> 0x%04x mode:%s' % (address & 0xffff, value, bytemode and 'b' or 'w'))
         return value
 
+    def _spans(self, address, length):
+        """split address..address+length-1 into runs that are handled by
+        the same peripheral. yields tuples (address, length, view) where
+        view is a memoryview of the bytes, or None if they have to be
+        accessed one by one"""
+        end = address + length
+        while address < end:
+            a = address & 0xffff
+            p = self.peripheral(a)
+            limit = a + min(end - address, 0x10000 - a)
+            stop = a + 1
+            while stop < limit:
+                entry = self.pages[stop >> 8]
+                if entry.__class__ is list:
+                    if entry[stop & 0xff] is not p:
+                        break
+                    stop += 1
+                elif entry is p:
+                    stop = (stop | 0xff) + 1    #skip to the next page
+                else:
+                    break
+            n = min(stop, limit) - a
+            if p is None:
+                yield a, n, memoryview(self.memory)[a:a+n]
+            else:
+                yield a, n, p.view(a, n)
+            address += n
+
+    def view(self, address, length):
+        """return a memoryview of address..address+length-1 if the range is
+        held in one buffer (plain memory, RAM or flash), else None. writes
+        through the view bypass watches and code cache invalidation"""
+        if address < 0 or length <= 0:
+            return None
+        for a, n, view in self._spans(address, length):
+            return n == length and view or None
+
     def read(self, address, length):
-        return ''.join([chr(self._get(a,1)) for a in range(address, address+length)])
+        """return a string with length bytes starting at address"""
+        data = []
+        for a, n, view in self._spans(address, length):
+            if view is not None:
+                data.append(view.tobytes())
+            else:
+                data.append(''.join([chr(self._get(x, 1)) for x in range(a, a+n)]))
+        return ''.join(data)
 
     def write(self, address, data):
-        for n, byte in enumerate(data):
-            self._set(address+n, ord(byte), 1)
+        """write a string of bytes to memory starting at address"""
+        offset = 0
+        for a, n, view in self._spans(address, len(data)):
+            chunk = data[offset:offset+n]
+            if view is not None:
+                if 1 in self.codemap[a:a+n]:    #overwriting cached code?
+                    self.invalidatecode(a - 2, n + 4)
+                view[:] = chunk
+            else:
+                for i, byte in enumerate(chunk):
+                    self._set(a+i, ord(byte), 1)
+            offset += n
 
     def hexline(self, address, width=16):
         """build a tuple with (address, hex values, ascii values)"""
-        bytes = [self._get(a, bytemode=1) for a in range(address, address+width)]
+        bytes = bytearray(self.read(address, width))
         return  (
             '0x%04x' % address, '%s%s' % (
                 ('%02x '*len(bytes)) % tuple(bytes),
@@ -773,6 +1245,17 @@ class MemoryArgument(Argument):
         return '0x%04x' % (self.address)
 
 
+def transfer(name, args):
+    """return 'call', 'ret' or 'reti' if the instruction enters or leaves
+    a function, else None. ret is mov @SP+, PC"""
+    if name == 'call' or name == 'reti':
+        return name
+    if name == 'mov' and isinstance(args[2], RegisterArgument) and args[2].reg.regnum == 0 \
+            and isinstance(args[1], IndirectAutoincrementRegisterArgument) \
+            and args[1].reg.regnum == 1:
+        return 'ret'
+    return None
+
 class JumpTarget:
     """jump target address"""
     def __init__(self, core, address, offset):
@@ -861,10 +1344,95 @@ def addressMode(core, pc, bytemode, asflag = None, ad = None, src = None, dest =
     return x,y,c
 
 
+##################################################################
+## decoded instruction cache
+##################################################################
+# decoding an instruction fetches its words through Memory.get and
+# builds new argument wrappers. the wrappers only hold the register,
+# offset or immediate value and look at the core when they are executed,
+# so they can be reused each time the same address is executed again.
+
+class DecodeCache:
+    """decoded instructions indexed by their address. entries are dropped
+    when the memory that holds them is written."""
+    MAXLENGTH = 6       #longest instruction: opcode + two extension words
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.entries = {}
+        memory.codecaches.append(self)
+
+    def get(self, address):
+        """return cached entry for address or None"""
+        return self.entries.get(address)
+
+    def put(self, address, length, entry):
+        """store entry for an instruction of length bytes at address"""
+        self.entries[address] = entry
+        self.memory.markcode(address, length)
+
+    def invalidate(self, address, length):
+        """drop all instructions that overlap address..address+length-1"""
+        if length >= 0x10000:
+            self.entries.clear()
+        elif self.entries:
+            for a in range(address - self.MAXLENGTH + 1, address + length):
+                self.entries.pop(a & 0xffff, None)
+
+##################################################################
+## lazy flags
+##################################################################
+# the ALU instructions don't set the C, Z, N and V bits one by one. they
+# store one of these functions together with the result, the source and
+# destination operands and the bytemode in Core.pendingflags. the SR
+# calls it when its value is needed. the functions return the new bits.
+
+def flagsADD(r, s, d, bytemode):
+    """flags of ADD and ADDC"""
+    m = bytemode and 0xff or 0xffff
+    b = bytemode and 0x80 or 0x8000
+    return ((r & m == 0) and 0x0002) | ((r & b) and 0x0004) | \
+           ((r < 0 or r > m) and 0x0001) | (((s ^ r) & (d ^ r) & b) and 0x0100)
+
+def flagsSUB(r, s, d, bytemode):
+    """flags of SUB, SUBC and CMP"""
+    m = bytemode and 0xff or 0xffff
+    b = bytemode and 0x80 or 0x8000
+    return ((r & m == 0) and 0x0002) | ((r & b) and 0x0004) | \
+           ((r < 0 or r > m) and 0x0001) | (((d ^ s) & (d ^ r) & b) and 0x0100)
+
+def flagsXOR(r, s, d, bytemode):
+    """flags of XOR"""
+    b = bytemode and 0x80 or 0x8000
+    return ((r & (bytemode and 0xff or 0xffff) == 0) and 0x0002) | \
+           ((r & b) and 0x0004) | ((r != 0) and 0x0001) | ((s & d & b) and 0x0100)
+
+def flagsLOGIC(r, s, d, bytemode):
+    """flags of AND and BIT"""
+    return ((r == 0) and 0x0002) | ((r & (bytemode and 0x80 or 0x8000)) and 0x0004) | \
+           ((r != 0) and 0x0001)
+
+def flagsSHIFT(r, s, d, bytemode):
+    """flags of RRC, RRA and SXT, s is the operand before the shift"""
+    return ((r == 0) and 0x0002) | ((r & (bytemode and 0x80 or 0x8000)) and 0x0004) | \
+           (s & 1)
+
 ##################################################################
 ## CORE (CPU with Regs, Mem, insn)
 ##################################################################
 
+class Snapshot:
+    """state of a Core, see Core.snapshot()"""
+    def __init__(self, regs, pendingflags, cycles, instructions, memory):
+        self.regs = regs
+        self.pendingflags = pendingflags
+        self.cycles = cycles
+        self.instructions = instructions
+        self.memory = memory
+
+    def __repr__(self):
+        return '<Snapshot PC=0x%04x, cycle %d>' % (self.regs[0], self.cycles)
+
 class MSP430CoreException(Exception):
     """this exception is raised when code execution errors are detected"""
     
@@ -884,10 +1452,7 @@ class Core(Subject):
         a = arg.get()
         c = self.SR.C
         r = (c<<shift) | ((a>>1) & mask)
-        self.SR.Z = (r == 0)
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (a & 1)
-        self.SR.V = 0
+        self.pendingflags = (flagsSHIFT, r, a, 0, bytemode)
         arg.set(r)
 
     def execSWPB(self, bytemode, arg):
@@ -901,10 +1466,7 @@ class Core(Subject):
         a = arg.get()
         n = a & (bytemode and 0x80 or 0x8000)
         r = n | ((a>>1) & (bytemode and 0x7f or 0x7fff))
-        self.SR.Z = (r == 0)
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (a & 1)
-        self.SR.V = 0
+        self.pendingflags = (flagsSHIFT, r, a, 0, bytemode)
         arg.set(r)
 
     def execSXT(self, bytemode, arg):
@@ -912,10 +1474,7 @@ class Core(Subject):
         a = arg.get()
         r = a & 0xff
         if a & 0x80:  r |= 0xff00
-        self.SR.Z = (r == 0)
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (a & 1)
-        self.SR.V = 0
+        self.pendingflags = (flagsSHIFT, r, a, 0, bytemode)
         arg.set(r)
 
     def execPUSH(self, bytemode, arg):
@@ -939,7 +1498,6 @@ class Core(Subject):
         self.execADDC(bytemode, src, dst, takecarry = 0)
 
     def execADDC(self, bytemode, src, dst, takecarry = 1):
-        b = (bytemode and 0x80 or 0x8000)
         d = dst.get()
         s = src.get()
         if takecarry:
@@ -947,10 +1505,7 @@ class Core(Subject):
         else:
             c = 0
         r = d + s + c
-        self.SR.Z = r & (bytemode and 0xff or 0xffff) == 0
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = r < 0 or r > (bytemode and 0xff or 0xffff)
-        self.SR.V = (not (r & b) and (s & b) and (d & b)) or ((r & b) and not (s & b) and not (d & b))
+        self.pendingflags = (flagsADD, r, s, d, bytemode)
         dst.set(r)
 
 
@@ -961,7 +1516,6 @@ class Core(Subject):
         self.execSUBC(bytemode, src, dst, takecarry = 0, store = 1)
 
     def execSUBC(self, bytemode, src, dst, takecarry = 1, store = 1):
-        b = (bytemode and 0x80 or 0x8000)
         m = (bytemode and 0xff or 0xffff)
         d = dst.get()
         s = src.get()
@@ -970,10 +1524,7 @@ class Core(Subject):
         else:
             c = 1
         r = d + ((~s) & m) + c
-        self.SR.Z = r & m == 0
-        self.SR.N = r & b
-        self.SR.C = r < 0 or r > m
-        self.SR.V = (not (r & b) and not (s & b) and (d & b)) or ((r & b) and (s & b) and not (d & b))
+        self.pendingflags = (flagsSUB, r, s, d, bytemode)
         if store: dst.set(r)
 
     def execDADD(self, bytemode, src, dst):
@@ -984,10 +1535,7 @@ class Core(Subject):
         d = dst.get()
         s = src.get()
         r = d & s
-        self.SR.Z = (r == 0)
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (r != 0)
-        self.SR.V = 0
+        self.pendingflags = (flagsLOGIC, r, s, d, bytemode)
 
     def execBIC(self, bytemode, src, dst):
         d = dst.get()
@@ -1006,20 +1554,14 @@ class Core(Subject):
         d = dst.get()
         s = src.get()
         r = d ^ s
-        self.SR.Z = r & (bytemode and 0xff or 0xffff) == 0
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (r != 0)
-        self.SR.V = s & (bytemode and 0x80 or 0x8000) and d & (bytemode and 0x80 or 0x8000)
+        self.pendingflags = (flagsXOR, r, s, d, bytemode)
         dst.set(r)
 
     def execAND(self, bytemode, src, dst):
         d = dst.get()
         s = src.get()
         r = d & s
-        self.SR.Z = (r == 0)
-        self.SR.N = r & (bytemode and 0x80 or 0x8000)
-        self.SR.C = (r != 0)
-        self.SR.V = 0
+        self.pendingflags = (flagsLOGIC, r, s, d, bytemode)
         dst.set(r)
 
     #---
@@ -1101,35 +1643,50 @@ class Core(Subject):
     # methods
     #------------------------
 
-    def __init__(self):
-        """initialize core with registers and memory"""
+    #trace levels, each includes the ones before
+    TRACE_OFF           = 0     #no logging at all in the hot paths
+    TRACE_INSTRUCTIONS  = 1     #step() logs each instruction
+    TRACE_REGISTERS     = 2     #step() also logs the changed registers
+    TRACE_MEMORY        = 3     #memory accesses are logged
+
+    def __init__(self, trace=TRACE_INSTRUCTIONS):
+        """initialize core with registers and memory. the trace level is
+        fixed here, step() and the memory accessors are chosen so that
+        disabled levels cost nothing"""
         Subject.__init__(self)          #init model for observer pattern
         self.log = logging.getLogger('core')
+        self.trace = trace
+        self.pendingflags = None        #lazy SR flags, see flagsADD etc.
         self.memory = Memory()
+        self.regs = [0]*16              #register file, see Register
+        regs = self.regs
         self.R = (
-            PC(self),
-            SP(self),
-            SR(self),
-            CG2(self),
-            Register(self, regnum=4),
-            Register(self, regnum=5),
-            Register(self, regnum=6),
-            Register(self, regnum=7),
-            Register(self, regnum=8),
-            Register(self, regnum=9),
-            Register(self, regnum=10),
-            Register(self, regnum=11),
-            Register(self, regnum=12),
-            Register(self, regnum=13),
-            Register(self, regnum=14),
-            Register(self, regnum=15)
-        )
+            PC(self, regs=regs),
+            SP(self, regs=regs),
+            SR(self, regs=regs),
+            CG2(self, regs=regs),
+        ) + tuple([Register(self, regnum=n, regs=regs) for n in range(4, 16)])
         #aliases
         self.PC = self.R[0]
         self.SP = self.R[1]
         self.SR = self.R[2]
         self.CG2 = self.R[3]
         self.cycles = 0
+        self.instructions = 0           #number of executed instructions
+        self.coverage = None            #opt-in collector, see codecoverage.py
+        self.profiler = None            #opt-in cycle profiler, see profiler.py
+        self.stats = None               #opt-in counters, see insnstats.py
+        self.recorder = None            #opt-in binary trace, see binarytrace.py
+        self.decodecache = DecodeCache(self.memory)
+        self.engine = BlockEngine(self)
+        self.stoprequest = False
+        if trace <= self.TRACE_OFF:
+            self.step = self._silentstep
+        elif trace >= self.TRACE_REGISTERS:
+            self.step = self._registerstep
+        if trace >= self.TRACE_MEMORY:
+            self.memory.get = self.memory.tracedget
+            self.memory.set = self.memory.tracedset
 
     def reset(self):
         for r in self.R:
@@ -1137,6 +1694,22 @@ class Core(Subject):
         self.memory.reset()
         self.notify()
 
+    def snapshot(self):
+        """return a Snapshot of the registers, counters, memory and
+        peripherals. see Memory.snapshot"""
+        return Snapshot(self.regs[:], self.pendingflags, self.cycles,
+            self.instructions, self.memory.snapshot())
+
+    def restore(self, snapshot):
+        """return to the state of a Snapshot. it can be restored any
+        number of times"""
+        self.regs[:] = snapshot.regs
+        self.pendingflags = snapshot.pendingflags
+        self.cycles = snapshot.cycles
+        self.instructions = snapshot.instructions
+        self.memory.restore(snapshot.memory)
+        self.notify()
+
     def disassemble(self, pc, illegal_is_fatal=False):
         """disassemble current PC location and advance PC to the next instruction.
         return a tuple with insn name, arguments (bytemode, arg1, arg2),
@@ -1193,11 +1766,31 @@ class Core(Subject):
             raise MSP430CoreException('illegal instruction 0x%04x' % (opcode,))
         return 'illegal insn 0x%04x' % opcode, [0], None, cycles
 
+    def fetch(self, illegal_is_fatal=False):
+        """decode the instruction at PC and advance PC to the next one.
+        repeated fetches of the same address are served from the decode cache.
+        return a tuple with insn name, arguments, execution function and
+        cycle count (like disassemble)"""
+        address = self.regs[0]
+        insn = self.decodecache.get(address)
+        if insn is None:
+            name, args, execfu, cycles = self.disassemble(self.PC, illegal_is_fatal)
+            if execfu is not None:
+                nextpc = self.regs[0]
+                self.decodecache.put(address, (nextpc - address) & 0xffff,
+                    (name, args, execfu, cycles, nextpc))
+            return name, args, execfu, cycles
+        name, args, execfu, cycles, nextpc = insn
+        self.regs[0] = nextpc
+        return name, args, execfu, cycles
+
     def step(self, illegal_is_fatal=False):
-        """perform one single step"""
+        """perform one single step, log it and notify the observers.
+        returns a description of the instruction"""
         address = int(self.PC)
-        name, args, execfu, cycles = self.disassemble(self.PC, illegal_is_fatal)
+        name, args, execfu, cycles = self.fetch(illegal_is_fatal)
         self.cycles += cycles
+        self.instructions += 1
         note = "%s%s %s (%d cycles)" % (
             name,
             ('','.b')[args[0]],
@@ -1209,12 +1802,615 @@ class Core(Subject):
             apply(execfu, [self]+args)
         else:
             self.log.warning("step: %s @0x%04x" % (name, address))
+        if self.coverage is not None:
+            self.coverage.instruction(address, name, args, self.regs[0])
+        if self.profiler is not None:
+            self.profiler.instruction(address, name, args, self.regs[0])
+        if self.stats is not None:
+            self.stats.instruction(address, name, args, self.regs[0])
+        if self.recorder is not None:
+            self.recorder.instruction(address, name, args, self.regs[0])
         self.notify()
         return note
 
+    def _silentstep(self, illegal_is_fatal=False):
+        """step() for TRACE_OFF, notifies but does not format a note, the
+        name of the instruction is returned instead"""
+        name = self._step(illegal_is_fatal)
+        self.notify()
+        return name
+
+    def _registerstep(self, illegal_is_fatal=False):
+        """step() for TRACE_REGISTERS, also logs the changed registers"""
+        self.SR.value           #include pending flags
+        before = self.regs[:]
+        note = Core.step(self, illegal_is_fatal)
+        self.SR.value
+        changed = ['%s=0x%04x' % (self.R[n], value)
+            for n, value in enumerate(self.regs) if value != before[n]]
+        if changed:
+            self.log.info('regs: %s' % ' '.join(changed))
+        return note
+
+    def _step(self, illegal_is_fatal=False):
+        """quiet step, no note, logging or notification. returns the name
+        of the instruction"""
+        address = self.regs[0]
+        name, args, execfu, cycles = self.fetch(illegal_is_fatal)
+        self.cycles += cycles
+        self.instructions += 1
+        if execfu:
+            execfu(self, *args)
+        else:
+            self.log.warning("step: %s @0x%04x" % (name, address))
+        if self.coverage is not None:
+            self.coverage.instruction(address, name, args, self.regs[0])
+        if self.profiler is not None:
+            self.profiler.instruction(address, name, args, self.regs[0])
+        if self.stats is not None:
+            self.stats.instruction(address, name, args, self.regs[0])
+        if self.recorder is not None:
+            self.recorder.instruction(address, name, args, self.regs[0])
+        return name
+
+    def stop(self):
+        """request that a running run() returns after the current
+        instruction, or the next run() before it executes anything. can be
+        called from other threads and from watches"""
+        self.stoprequest = True
+        self.engine.stop()
+
+    #reasons for run() to return
+    RUN_CYCLES          = 'cycles'
+    RUN_INSTRUCTIONS    = 'instructions'
+    RUN_BREAKPOINT      = 'breakpoint'
+    RUN_UNTIL           = 'until'
+    RUN_STOPPED         = 'stopped'
+
+    def run(self, max_cycles=None, max_instructions=None, until=None,
+            breakpoints=None, illegal_is_fatal=False, blocks=True, trace=False):
+        """execute code until max_cycles cycles or max_instructions
+        instructions are executed, the PC reaches an address in breakpoints
+        (at least one instruction is executed), until(core) returns true or
+        stop() is called. observers are notified once at the end.
+
+        with blocks, code is run with the BlockEngine. budgets and
+        breakpoints are still exact, until is then checked after each block
+        instead of each instruction. trace uses step() so that every
+        instruction is logged according to the trace level of the core
+        (and blocks are not used).
+
+        a stop() request is used up by the run() that returns for it (or
+        for a breakpoint or until on the same instruction).
+
+        returns one of the RUN_xxx reasons"""
+        engine = blocks and not trace and self.engine
+        if max_cycles is not None:
+            max_cycles += self.cycles
+        if max_instructions is not None:
+            max_instructions += self.instructions
+        inner = {}      #blocks with breakpoints after their first insn
+        try:
+            while True:
+                if self.stoprequest:
+                    self.stoprequest = False
+                    return self.RUN_STOPPED
+                if max_cycles is not None and self.cycles >= max_cycles:
+                    return self.RUN_CYCLES
+                if max_instructions is not None and self.instructions >= max_instructions:
+                    return self.RUN_INSTRUCTIONS
+                block = engine and engine.lookup(self.regs[0])
+                if block and block.fu is not None \
+                        and (max_cycles is None or self.cycles + block.cycles <= max_cycles) \
+                        and (max_instructions is None or self.instructions + block.count <= max_instructions):
+                    if breakpoints:
+                        if block not in inner:
+                            inner[block] = [a for a in block.addresses[1:] if a in breakpoints]
+                        if inner[block]:
+                            block = None
+                else:
+                    block = None
+                if block is not None:
+                    count = engine.execute(block)
+                    if self.coverage is not None:
+                        self.coverage.block(block, count, self.regs[0])
+                    if self.profiler is not None:
+                        self.profiler.block(block, count, self.regs[0])
+                    if self.stats is not None:
+                        self.stats.block(block, count, self.regs[0])
+                    if self.recorder is not None:
+                        self.recorder.block(block, count, self.regs[0])
+                elif trace:
+                    self.step(illegal_is_fatal)
+                else:
+                    self._step(illegal_is_fatal)
+                if breakpoints and self.regs[0] in breakpoints:
+                    self.stoprequest = False    #a stop() after this instruction is answered too
+                    return self.RUN_BREAKPOINT
+                if until is not None and until(self):
+                    self.stoprequest = False
+                    return self.RUN_UNTIL
+        finally:
+            self.notify()
+
     def __repr__(self):
         return ('%r\n'*15 + '%r') % self.R
 
+##################################################################
+## basic block translation
+##################################################################
+# straight-line code up to a jump, call, reti or an instruction that
+# writes the PC is translated into one python function. registers are
+# held in local variables while the block runs and addressing modes are
+# turned into direct expressions. the generated code does the same
+# memory accesses in the same order as the exec functions above, so the
+# results are exactly the same as with Core.step.
+
+class Untranslatable(Exception):
+    """raised when an instruction can not be translated. the block ends
+    before it and it is executed by Core.step"""
+
+class Block(object):
+    """translated code for the instructions start..end-1"""
+    branch = None       #(address, target) of a conditional jump at the end
+    exit = None         #'call', 'ret' or 'reti' at the end, see transfer()
+    insns = ()          #(name, args) of the instructions, for statistics
+    def __init__(self, start, end, addresses, cycles, fu, source=None):
+        self.start = start          #address of the first instruction
+        self.end = end              #address after the last instruction
+        self.addresses = addresses  #start address of each instruction
+        self.count = len(addresses) #number of instructions
+        self.cycles = cycles        #cycles when all instructions are run
+        self.fu = fu                #generated function, None if not translatable
+        self.source = source        #python source of fu, for debugging
+
+    def __repr__(self):
+        return '<Block 0x%04x-0x%04x, %d insns>' % (self.start, self.end, self.count)
+
+class BlockTranslator:
+    """generate python source for one basic block"""
+
+    def __init__(self, core):
+        self.core = core
+        self.used = {}          #register numbers used as locals
+        self.lines = []         #source lines of the body
+        self.memaccess = False  #data memory accessed by the current insn
+        self.pcwritten = False  #PC written by the current insn
+        self.flagline = None    #index of the flag update of the current insn
+
+    #---
+    # operand access
+
+    def regget(self, n, bytemode, am=0):
+        """expression for Register.get of register n"""
+        mask = bytemode and 0xff or 0xffff
+        if n == 0:
+            if self.pcwritten:
+                return '(pc & 0x%x)' % mask
+            return '0x%04x' % (self.nextpc & mask)
+        elif n == 3:
+            return '0x%04x' % (self.core.CG2.consts[am] & mask)
+        elif n == 2 and am:
+            return '0x%04x' % (self.core.SR.consts[am] & mask)
+        self.used[n] = True
+        if bytemode:
+            return '(R%d & 0xff)' % n
+        return 'R%d' % n
+
+    def regset(self, n, expr, bytemode, out):
+        """statement for Register.set of register n"""
+        if n == 0:
+            self.pcwritten = True
+            out.append('pc = (%s) & 0x%x' % (expr, bytemode and 0xff or 0xffff))
+        else:
+            self.used[n] = True
+            out.append('R%d = (%s) & 0x%x' % (n, expr, bytemode and 0xff or 0xffff))
+
+    def address(self, arg):
+        """expression for the memory address used by an argument"""
+        if isinstance(arg, MemoryArgument):
+            return '0x%04x' % arg.address
+        n = arg.reg.regnum
+        if isinstance(arg, IndexedRegisterArgument):
+            if n == 0 and not self.pcwritten:
+                return '0x%04x' % (arg.offset + self.nextpc)
+            return '0x%04x + %s' % (arg.offset, self.regget(n, 0))
+        return self.regget(n, 0)
+
+    def get(self, arg, var, out):
+        """statements that assign the value of arg.get() to var"""
+        if isinstance(arg, RegisterArgument):
+            out.append('%s = %s' % (var, self.regget(arg.reg.regnum, arg.bytemode, arg.am)))
+        elif isinstance(arg, ImmediateArgument):
+            out.append('%s = 0x%04x' % (var, arg.value))
+        elif isinstance(arg, (IndexedRegisterArgument, MemoryArgument, IndirectRegisterArgument)):
+            self.memaccess = True
+            out.append('%s = mget(%s, %d)' % (var, self.address(arg), arg.bytemode))
+        elif isinstance(arg, IndirectAutoincrementRegisterArgument):
+            n = arg.reg.regnum
+            if n in (0, 2, 3):
+                raise Untranslatable('autoincrement of R%d' % n)
+            self.memaccess = True
+            out.append('%s = mget(%s, %d)' % (var, self.regget(n, 0), arg.bytemode))
+            self.regset(n, 'R%d + %d' % (n, arg.bytemode and 1 or 2), 0, out)
+        else:
+            raise Untranslatable('unknown argument %r' % (arg,))
+
+    def set(self, arg, expr, out):
+        """statements for arg.set(expr)"""
+        if isinstance(arg, RegisterArgument):
+            self.regset(arg.reg.regnum, expr, arg.bytemode, out)
+        elif isinstance(arg, (IndexedRegisterArgument, MemoryArgument)):
+            self.memaccess = True
+            out.append('mset(%s, %s, %d)' % (self.address(arg), expr, arg.bytemode))
+        else:
+            #the interpreter raises an exception for these
+            raise Untranslatable('%r is not possible as destination' % (arg,))
+
+    def flags(self, bytemode, out, z=None, n=None, c=None, v=None):
+        """statement that updates the C, Z, N and V bits of the SR. the
+        arguments are expressions that are true when the flag is set"""
+        self.used[2] = True
+        self.flagline = len(out)
+        bits = ['(R2 & 0xfef8)']
+        if z: bits.append('((%s) << 1)' % z)
+        if n: bits.append('((%s) >> %d)' % (n, bytemode and 5 or 13))
+        if c: bits.append('(%s)' % c)
+        if v: bits.append('((%s) %s)' % (v, bytemode and '<< 1' or '>> 7'))
+        out.append('R2 = %s' % ' | '.join(bits))
+
+    #---
+    # instructions, see Core.execXXX for the reference implementations
+
+    def insn_rrc(self, bytemode, out, arg):
+        self.get(arg, 'a', out)
+        out.append('r = ((R2 & 1) << %d) | ((a >> 1) & 0x%x)' % (
+            bytemode and 7 or 15, bytemode and 0x7f or 0x7fff))
+        self.used[2] = True
+        self.flags(bytemode, out, z='r == 0', n='r & 0x%x' % (bytemode and 0x80 or 0x8000), c='a & 1')
+        self.set(arg, 'r', out)
+
+    def insn_swpb(self, bytemode, out, arg):
+        if bytemode:
+            raise Untranslatable('illegal use of SWPB')
+        self.get(arg, 'a', out)
+        self.set(arg, '((a & 0xff00) >> 8) | ((a & 0x00ff) << 8)', out)
+
+    def insn_rra(self, bytemode, out, arg):
+        self.get(arg, 'a', out)
+        out.append('r = (a & 0x%x) | ((a >> 1) & 0x%x)' % (
+            bytemode and 0x80 or 0x8000, bytemode and 0x7f or 0x7fff))
+        self.flags(bytemode, out, z='r == 0', n='r & 0x%x' % (bytemode and 0x80 or 0x8000), c='a & 1')
+        self.set(arg, 'r', out)
+
+    def insn_sxt(self, bytemode, out, arg):
+        if bytemode:
+            raise Untranslatable('illegal use of SXT')
+        self.get(arg, 'a', out)
+        out.append('r = a & 0xff')
+        out.append('if a & 0x80: r |= 0xff00')
+        self.flags(bytemode, out, z='r == 0', n='r & 0x8000', c='a & 1')
+        self.set(arg, 'r', out)
+
+    def insn_push(self, bytemode, out, arg):
+        self.get(arg, 'a', out)
+        self.regset(1, 'R1 - 2', 0, out)
+        self.memaccess = True
+        out.append('mset(R1, a, 0)')
+
+    def insn_call(self, bytemode, out, arg):
+        self.regset(1, 'R1 - 2', 0, out)
+        self.memaccess = True
+        out.append('mset(R1, 0x%04x, 0)' % self.nextpc)
+        self.get(arg, 'a', out)
+        self.regset(0, 'a', 0, out)
+
+    def insn_reti(self, bytemode, out, arg):
+        self.used[1] = True
+        self.memaccess = True
+        out.append('a = mget(R1, 0)')
+        self.regset(1, 'R1 + 2', 0, out)
+        self.regset(2, 'a', 0, out)
+        out.append('a = mget(R1, 0)')
+        self.regset(1, 'R1 + 2', 0, out)
+        self.regset(0, 'a', 0, out)
+
+    def insn_mov(self, bytemode, out, src, dst):
+        self.get(src, 's', out)
+        self.set(dst, 's', out)
+
+    def _add(self, bytemode, out, src, dst, carry):
+        mask = bytemode and 0xff or 0xffff
+        bit = bytemode and 0x80 or 0x8000
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        out.append('r = d + s + %s' % carry)
+        self.flags(bytemode, out, z='(r & 0x%x) == 0' % mask, n='r & 0x%x' % bit,
+            c='r > 0x%x' % mask, v='(s ^ r) & (d ^ r) & 0x%x' % bit)
+        self.set(dst, 'r', out)
+
+    def insn_add(self, bytemode, out, src, dst):
+        self._add(bytemode, out, src, dst, '0')
+
+    def insn_addc(self, bytemode, out, src, dst):
+        self.used[2] = True
+        self._add(bytemode, out, src, dst, '(R2 & 1)')
+
+    def _sub(self, bytemode, out, src, dst, carry, store):
+        mask = bytemode and 0xff or 0xffff
+        bit = bytemode and 0x80 or 0x8000
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        out.append('r = d + ((~s) & 0x%x) + %s' % (mask, carry))
+        self.flags(bytemode, out, z='(r & 0x%x) == 0' % mask, n='r & 0x%x' % bit,
+            c='r > 0x%x' % mask, v='(d ^ s) & (d ^ r) & 0x%x' % bit)
+        if store:
+            self.set(dst, 'r', out)
+
+    def insn_subc(self, bytemode, out, src, dst):
+        self.used[2] = True
+        self._sub(bytemode, out, src, dst, '(R2 & 1)', True)
+
+    def insn_sub(self, bytemode, out, src, dst):
+        self._sub(bytemode, out, src, dst, '1', True)
+
+    def insn_cmp(self, bytemode, out, src, dst):
+        self._sub(bytemode, out, src, dst, '1', False)
+
+    def insn_bit(self, bytemode, out, src, dst):
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        out.append('r = d & s')
+        self.flags(bytemode, out, z='r == 0', n='r & 0x%x' % (bytemode and 0x80 or 0x8000), c='r != 0')
+
+    def insn_bic(self, bytemode, out, src, dst):
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        self.set(dst, 'd & ~s', out)
+
+    def insn_bis(self, bytemode, out, src, dst):
+        #execBIS reads and writes the destination twice
+        for i in range(2):
+            self.get(dst, 'd', out)
+            self.get(src, 's', out)
+            self.set(dst, 'd | s', out)
+
+    def insn_xor(self, bytemode, out, src, dst):
+        mask = bytemode and 0xff or 0xffff
+        bit = bytemode and 0x80 or 0x8000
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        out.append('r = d ^ s')
+        self.flags(bytemode, out, z='(r & 0x%x) == 0' % mask, n='r & 0x%x' % bit,
+            c='r != 0', v='s & d & 0x%x' % bit)
+        self.set(dst, 'r', out)
+
+    def insn_and(self, bytemode, out, src, dst):
+        self.get(dst, 'd', out)
+        self.get(src, 's', out)
+        out.append('r = d & s')
+        self.flags(bytemode, out, z='r == 0', n='r & 0x%x' % (bytemode and 0x80 or 0x8000), c='r != 0')
+        self.set(dst, 'r', out)
+
+    #conditions of the jump instructions, in the order of Core.jumpInstructions
+    jumpconditions = {
+        'jnz':  'not (R2 & 2)',
+        'jz':   'R2 & 2',
+        'jnc':  'not (R2 & 1)',
+        'jc':   'R2 & 1',
+        'jn':   'not (R2 & 4)',     #same as execJN
+        'jge':  'not ((R2 >> 2) ^ (R2 >> 8)) & 1',
+        'jl':   '((R2 >> 2) ^ (R2 >> 8)) & 1',
+        'jmp':  None,
+    }
+
+    #---
+    # blocks
+
+    def translate(self, address, namespace, maxinsns=64):
+        """decode and translate the instructions at address. namespace
+        has to provide core, R, regs, mget, mset and brk for the generated code.
+        returns a Block"""
+        core = self.core
+        pc = PC(core, address)
+        addresses = []
+        decoded = []        #(name, args) of each insn
+        exits = []          #(nextpc, cycles, count) after each insn
+        insns = []          #(flag line in body, reads flags, memaccess)
+        body = []
+        cycles = 0
+        ending = False
+        while len(addresses) < maxinsns:
+            start = int(pc)
+            name, args, execfu, insncycles = core.disassemble(pc)
+            self.nextpc = nextpc = int(pc)
+            if execfu is None or nextpc < start:
+                break       #illegal insn or wrap around
+            out = ['#0x%04x: %s%s %s' % (start, name, ('', '.b')[args[0]], ', '.join(map(str, args[1:])))]
+            out.append('n = %d' % len(addresses))
+            self.memaccess = self.pcwritten = False
+            self.flagline = None
+            if name in self.jumpconditions:
+                condition = self.jumpconditions[name]
+                self.used[2] = True
+                ending = True
+            else:
+                method = getattr(self, 'insn_%s' % name, None)
+                if method is None:
+                    break
+                try:
+                    method(args[0], out, *args[1:])
+                except Untranslatable:
+                    break
+                ending = name in ('call', 'reti') or self.pcwritten or (
+                    isinstance(args[-1], RegisterArgument) and args[-1].reg.regnum == 0)
+            addresses.append(start)
+            decoded.append((name, args))
+            cycles += insncycles
+            count = len(addresses)
+            exits.append((nextpc, cycles, count))
+            reads = name in self.jumpconditions or [l for i, l in enumerate(out)
+                if i and i != self.flagline and 'R2' in l]
+            insns.append((self.flagline is not None and len(body) + self.flagline or None,
+                bool(reads), self.memaccess))
+            body.extend(out)
+            if ending:
+                if name in self.jumpconditions:
+                    target = (nextpc + int(args[1])) & 0xffff
+                    if condition is None:
+                        body.extend(self.exit('0x%04x' % target, cycles, count))
+                    else:
+                        body.append('if %s:' % condition)
+                        body.extend(['    ' + l for l in self.exit('0x%04x' % target, cycles, count)])
+                        body.extend(self.exit('0x%04x' % nextpc, cycles, count))
+                else:
+                    body.extend(self.exit(self.pcwritten and 'pc' or '0x%04x' % nextpc, cycles, count))
+                break
+            if self.memaccess:
+                #leave early when the block was overwritten or a stop was requested
+                body.append('if brk[0]:')
+                body.extend(['    ' + l for l in self.exit('0x%04x' % nextpc, cycles, count)])
+        if not addresses:
+            return Block(address, max(int(pc), address + 2), [address], 0, None)
+        if not ending:
+            body.extend(self.exit('0x%04x' % exits[-1][0], cycles, count))
+        body = self.deadflags(body, insns)
+        source = self.source(body, exits)
+        exec compile(source, '<block 0x%04x>' % address, 'exec') in namespace
+        block = Block(address, exits[-1][0], addresses, cycles, namespace['block'], source)
+        block.insns = decoded
+        if ending and name in self.jumpconditions and condition is not None:
+            block.branch = (addresses[-1], target)
+        elif ending:
+            block.exit = transfer(name, args)
+        return block
+
+    def deadflags(self, body, insns):
+        """remove the flag updates that are overwritten before they are
+        read. the flags are live at the end of the block and around insns
+        that access memory, as these can leave the block early"""
+        dead = {}
+        live = True
+        for flagline, reads, memaccess in reversed(insns):
+            if memaccess:
+                live = True
+            if flagline is not None and not live:
+                dead[flagline] = True
+            if memaccess or reads:
+                live = True
+            elif flagline is not None:
+                live = False
+        return [l for i, l in enumerate(body) if i not in dead]
+
+    def load(self, n):
+        """expression for the value of register n, the SR includes
+        pending flags"""
+        if n == 2:
+            return 'R[2].value'
+        return 'regs[%d]' % n
+
+    def store(self, n):
+        """statement that writes the local of register n back"""
+        if n == 2:
+            return 'R[2].value = R2'
+        return 'regs[%d] = R%d' % (n, n)
+
+    def exit(self, pc, cycles, count):
+        """lines that store the registers and leave the block"""
+        lines = [self.store(n) for n in sorted(self.used)]
+        lines.append('return %s, %d, %d' % (pc, cycles, count))
+        return lines
+
+    def source(self, body, exits):
+        """build the source of the function for a block"""
+        lines = ['def block(core=core, R=R, regs=regs, mget=mget, mset=mset, brk=brk, exits=%r):' % (exits,)]
+        lines.extend(['    R%d = %s' % (n, self.load(n)) for n in sorted(self.used)])
+        lines.append('    try:')
+        lines.extend(['        ' + l for l in body])
+        lines.append('    except:')
+        #state of the interpreter when the exception happened in insn n
+        lines.extend(['        ' + self.store(n) for n in sorted(self.used)])
+        lines.append('        regs[0], cycles, count = exits[n]')
+        lines.append('        core.cycles += cycles')
+        lines.append('        core.instructions += count')
+        lines.append('        raise')
+        return '\n'.join(lines) + '\n'
+
+class BlockEngine:
+    """cache of translated blocks, used by Core.run. instructions that can
+    not be translated get a Block without function and are run by Core.step"""
+    MAXINSNS = 64       #maximal number of instructions in one block
+
+    def __init__(self, core):
+        self.core = core
+        self.log = logging.getLogger('blocks')
+        self.blocks = {}            #start address -> Block
+        self.pages = {}             #address>>8 -> list of Blocks in that page
+        self.brk = [False]          #set to leave the running block early
+        core.memory.codecaches.append(self)
+
+    def stop(self):
+        """leave the running block after the current instruction"""
+        self.brk[0] = True
+
+    def translate(self, address):
+        """translate the block at address and add it to the cache"""
+        core = self.core
+        namespace = {
+            'core': core,
+            'R': core.R,
+            'regs': core.regs,
+            'mget': core.memory.get,
+            'mset': core.memory.set,
+            'brk': self.brk,
+        }
+        block = BlockTranslator(core).translate(address, namespace, self.MAXINSNS)
+        self.log.debug('translated %r', block)
+        self.blocks[address] = block
+        for page in range(block.start >> 8, ((block.end - 1) >> 8) + 1):
+            self.pages.setdefault(page, []).append(block)
+        core.memory.markcode(block.start, block.end - block.start)
+        return block
+
+    def invalidate(self, address, length):
+        """drop all blocks that overlap address..address+length-1"""
+        if length >= 0x10000:
+            if self.blocks:
+                self.brk[0] = True
+            self.blocks.clear()
+            self.pages.clear()
+            return
+        end = address + length
+        for page in range(address >> 8, ((end - 1) >> 8) + 1):
+            for block in self.pages.get(page, ())[:]:
+                if block.start < end and address < block.end:
+                    self.brk[0] = True  #it may be the running block
+                    if self.blocks.get(block.start) is block:
+                        del self.blocks[block.start]
+                    for p in range(block.start >> 8, ((block.end - 1) >> 8) + 1):
+                        self.pages[p].remove(block)
+
+    def lookup(self, address):
+        """return the Block for address, translate it if needed"""
+        block = self.blocks.get(address)
+        if block is None:
+            block = self.translate(address)
+        return block
+
+    def execute(self, block):
+        """run a translated block, it has to start at the current PC.
+        returns the number of executed instructions"""
+        core = self.core
+        self.brk[0] = False
+        try:
+            pc, cycles, count = block.fu()
+        finally:
+            self.brk[0] = False
+        core.regs[0] = pc
+        core.cycles += cycles
+        core.instructions += count
+        return count
+
 ##################################################################
 ## trace control object
 ##################################################################
@@ -1268,22 +2464,12 @@ if __name__ == '__main__':
     print "-"*40, "trace"
     core.memory.getwatches[0x200] = AddressWatch("Variable one READ")
     core.memory.setwatches[0x200] = AddressWatch("Variable one WRITE")
-    core.memory.accesswatches.append(MemoryAccessWatch(
-        lambda mem, wrt, adr: not(          #F1121 layout
-            0x0000 <= adr <= 0x01ff or      #Peripherals (not detailed)
-            0x0200 <= adr <= 0x02ff or      #RAM
-            0x1000 <= adr <= 0x10ff or      #INFOMEM
-            0xf000 <= adr <= 0xffff         #FLASH
-        ),
-        'Illegal memory access',
-    ))
-    core.memory.accesswatches.append(MemoryAccessWatch(
-        lambda mem, wrt, adr: wrt and(      #F1121 layout
-            0x1000 <= adr <= 0x10ff or      #INFOMEM
-            0xf000 <= adr <= 0xffff         #FLASH
-        ),
-        'flash memory written',
-    ))
+    #F1121 layout: peripherals 0x0000-0x01ff, RAM 0x0200-0x02ff,
+    #INFOMEM 0x1000-0x10ff, FLASH 0xf000-0xffff
+    core.memory.watch(0x0300, 0x0fff, WATCH_ACCESS, 'Illegal memory access')
+    core.memory.watch(0x1100, 0xefff, WATCH_ACCESS, 'Illegal memory access')
+    core.memory.watch(0x1000, 0x10ff, WATCH_WRITE, 'flash memory written')
+    core.memory.watch(0xf000, 0xffff, WATCH_WRITE, 'flash memory written')
     print core.memory.hexdump(0x0200, 0x02ff, log)
     tracer = Tracer(core)
     tracer.start(0xf000, 50) #only N steps
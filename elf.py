@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# ELF32 reader for the MSP430 simulator. images linked by msp430-gcc can
+# be loaded directly, without msp430-objcopy, and their symbols are
+# available as a SymbolTable for the disassembler, profiler and gdbserver.
+#
+# the file is mapped with mmap and parsed with struct. loadable segments
+# are taken from the program headers at their load (physical) address,
+# as msp430-objcopy does. symbols come from the .symtab section.
+#
+# as script it prints the segments and the function symbols of a file.
+#
+# this is distributed under a free software license, see license.txt
+
+import sys, struct, mmap
+import bisect
+
+EM_MSP430       = 105
+EM_MSP430_OLD   = 0x1059        #used by old mspgcc versions
+
+PT_LOAD         = 1
+SHT_SYMTAB      = 2
+SHN_UNDEF       = 0
+
+#symbol types and bindings (st_info)
+STT_NOTYPE      = 0
+STT_OBJECT      = 1
+STT_FUNC        = 2
+STT_SECTION     = 3
+STT_FILE        = 4
+STB_LOCAL       = 0
+STB_GLOBAL      = 1
+STB_WEAK        = 2
+
+class ELFException(Exception): pass
+
+class Symbol:
+    """one entry of a SymbolTable"""
+    def __init__(self, name, address, size=0, kind=STT_NOTYPE, binding=STB_GLOBAL):
+        self.name = name
+        self.address = address
+        self.size = size            #in bytes, 0 if unknown
+        self.kind = kind            #STT_xxx
+        self.binding = binding      #STB_xxx
+
+    def __repr__(self):
+        return '<Symbol %s 0x%04x size %d>' % (self.name, self.address, self.size)
+
+class SymbolTable:
+    """names of addresses and the other way round. it can be used like a
+    dict address -> name, e.g. for codecoverage"""
+
+    def __init__(self):
+        self.entries = []           #all Symbols
+        self.symbols = {}           #name -> Symbol
+        self.names = {}             #address -> name of the preferred Symbol
+        self.starts = None          #sorted function addresses, see function()
+        self.funcs = None           #Symbols for starts
+
+    def add(self, symbol):
+        """add a Symbol. for the name of an address, global symbols are
+        preferred over local ones, functions over other symbols and
+        symbols with a size over those without. this also decides between
+        symbols with the same name, e.g. static functions of two files"""
+        self.entries.append(symbol)
+        same = self.symbols.get(symbol.name)
+        if same is None or self._rank(symbol) >= self._rank(same):
+            self.symbols[symbol.name] = symbol
+        other = self.symbols.get(self.names.get(symbol.address))
+        if other is None or other.address != symbol.address or self._rank(symbol) > self._rank(other):
+            self.names[symbol.address] = symbol.name
+        self.starts = self.funcs = None
+
+    def _rank(self, symbol):
+        return (symbol.binding != STB_LOCAL, symbol.kind == STT_FUNC, symbol.size > 0)
+
+    def update(self, other):
+        """add all symbols of an other SymbolTable"""
+        for symbol in other.entries:
+            self.add(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def __getitem__(self, name):
+        return self.symbols[name]
+
+    def address(self, name):
+        """return the address of a name, KeyError if it is unknown"""
+        return self.symbols[name].address
+
+    def size(self, name):
+        """return the size of a name, 0 if unknown"""
+        return self.symbols[name].size
+
+    def get(self, address, default=None):
+        """return the name at exactly address"""
+        return self.names.get(address, default)
+
+    def functions(self):
+        """return the function Symbols sorted by address"""
+        if self.funcs is None:
+            self.funcs = sorted([s for s in self.entries if s.kind == STT_FUNC],
+                key=lambda s: (s.address, s.binding == STB_LOCAL, s.name))
+            self.starts = [s.address for s in self.funcs]
+        return self.funcs
+
+    def function(self, address):
+        """return the function Symbol that contains address or None. a
+        function without size extends to the next function"""
+        funcs = self.functions()
+        n = bisect.bisect_right(self.starts, address) - 1
+        if n < 0:
+            return None
+        symbol = self.symbols[self.names[self.starts[n]]]
+        if symbol.kind != STT_FUNC or symbol.address != self.starts[n]:
+            symbol = funcs[n]
+        if symbol.size and address >= symbol.address + symbol.size:
+            return None
+        return symbol
+
+    def describe(self, address):
+        """return 'name+offset' for address, or the hex address"""
+        symbol = self.function(address)
+        if symbol is None:
+            name = self.names.get(address)
+            return name is not None and name or '0x%04x' % address
+        offset = address - symbol.address
+        return offset and '%s+0x%x' % (symbol.name, offset) or symbol.name
+
+class ELFFile:
+    """read only view of an ELF32 file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = open(filename, 'rb')
+        try:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise ELFException('%s: empty or unreadable file' % filename)
+        finally:
+            f.close()
+        try:
+            self._parse()
+        except struct.error:
+            self.close()
+            raise ELFException('%s: truncated ELF file' % filename)
+        except ELFException:
+            self.close()
+            raise
+
+    def _parse(self):
+        data = self.data
+        if data[:4] != '\x7fELF':
+            raise ELFException('%s: not an ELF file' % self.filename)
+        if data[4] != '\x01':
+            raise ELFException('%s: not a 32 bit ELF file' % self.filename)
+        self.endian = data[5] == '\x02' and '>' or '<'
+        (self.type, self.machine, version, self.entry, self.phoff, self.shoff,
+         self.flags, ehsize, self.phentsize, self.phnum, self.shentsize,
+         self.shnum, self.shstrndx) = self.unpack('HHIIIIIHHHHHH', 16)
+        if self.machine not in (EM_MSP430, EM_MSP430_OLD):
+            raise ELFException('%s: not an MSP430 file (machine %d)' % (self.filename, self.machine))
+
+    def unpack(self, format, offset):
+        return struct.unpack_from(self.endian + format, self.data, offset)
+
+    def close(self):
+        self.data.close()
+
+    def segments(self):
+        """return a list of (address, data) of the loadable segments. the
+        address is the load address, data is the part stored in the file
+        (like msp430-objcopy, the zero filled rest is not included)"""
+        segments = []
+        for n in range(self.phnum):
+            (ptype, offset, vaddr, paddr, filesz, memsz,
+             flags, align) = self.unpack('IIIIIIII', self.phoff + n * self.phentsize)
+            if ptype == PT_LOAD and filesz:
+                if offset + filesz > len(self.data):
+                    raise ELFException('%s: segment outside of the file' % self.filename)
+                segments.append((paddr, self.data[offset:offset + filesz]))
+        return segments
+
+    def sections(self):
+        """return a list of section header tuples (name offset, type,
+        flags, address, offset, size, link, info, align, entry size)"""
+        return [self.unpack('IIIIIIIIII', self.shoff + n * self.shentsize)
+            for n in range(self.shoff and self.shnum or 0)]
+
+    def string(self, offset):
+        """return the zero terminated string at offset"""
+        end = self.data.find('\x00', offset)
+        if end < 0:
+            end = len(self.data)
+        return self.data[offset:end]
+
+    def symbols(self):
+        """return a SymbolTable with the named symbols of .symtab. section
+        and file symbols and undefined symbols are left out"""
+        table = SymbolTable()
+        sections = self.sections()
+        for header in sections:
+            if header[1] != SHT_SYMTAB:
+                continue
+            offset, length, link, entsize = header[4], header[5], header[6], header[9] or 16
+            strings = sections[link][4]
+            for n in range(length / entsize):
+                name, value, size, info, other, shndx = self.unpack(
+                    'IIIBBH', offset + n * entsize)
+                kind, binding = info & 0xf, info >> 4
+                if not name or shndx == SHN_UNDEF or kind in (STT_SECTION, STT_FILE):
+                    continue
+                table.add(Symbol(self.string(strings + name), value, size, kind, binding))
+        return table
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.stderr.write('usage: %s file.elf\n' % sys.argv[0])
+        sys.exit(2)
+    elf = ELFFile(sys.argv[1])
+    print 'entry 0x%04x' % elf.entry
+    for address, data in elf.segments():
+        print 'segment 0x%04x-0x%04x' % (address, address + len(data) - 1)
+    for symbol in elf.symbols().functions():
+        print '0x%04x %5d %s' % (symbol.address, symbol.size, symbol.name)
+    elf.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# fork server for the MSP430 simulator. a test image is loaded and booted
+# once, up to a PC or a command of the test peripheral (TEST_START by
+# default). each run request is then served by a child process created
+# with os.fork(), so it starts with the warm core and copy-on-write
+# memory instead of parsing the file and running the startup code again.
+#
+# as script it reads one request per line from stdin and writes one
+# result per line to stdout, both as JSON:
+#
+#   {"memory": [[address, "hexdata"], ...], "registers": [[n, value], ...],
+#    "max_cycles": n}
+#
+#   {"failures": 0, "subtests": [["name", true], ...], "cycles": n,
+#    "instructions": n, "finished": true, "timeout": false, "pc": n,
+#    "error": null}
+#
+# all request fields are optional. addresses and values are numbers.
+# without max_cycles, the default budget of the server is used (see
+# --max-cycles); a run that uses up its budget before TEST_END reports
+# "timeout": true.
+#
+# this is distributed under a free software license, see license.txt
+
+import sys, os, binascii
+import cPickle
+import logging
+import json
+import testing
+
+class ForkServerException(Exception): pass
+
+class ForkServer:
+    """boot a TestCore once and run requests in forked children"""
+
+    MAX_CYCLES = 10000000       #budget of requests without max_cycles
+
+    def __init__(self, filename, address=None, command=testing.TEST_START, maxsteps=2000,
+                 max_cycles=MAX_CYCLES):
+        """load filename and boot it until the PC reaches address or, if
+        address is None, until the firmware writes command to the test
+        peripheral. maxsteps limits the number of boot instructions,
+        max_cycles the cycles of requests that do not give a budget"""
+        if not hasattr(os, 'fork'):
+            raise ForkServerException('os.fork() is not available on this platform')
+        self.log = logging.getLogger('forkserver')
+        self.max_cycles = max_cycles
+        self.msp = testing.TestCore()
+        self.msp.memory.load(filename)
+        self.boot(address, command, maxsteps)
+
+    def boot(self, address, command, maxsteps):
+        """run from the reset vector up to the warm start point"""
+        msp = self.msp
+        msp.PC.set(msp.memory.get(0xfffe))
+        limit = msp.instructions + maxsteps
+        breakpoints = address is not None and set([address]) or None
+        while True:
+            if address is None and msp.testing.mode == command:
+                break
+            if msp.instructions >= limit:
+                raise ForkServerException('start point not reached within %d steps' % maxsteps)
+            reason = msp.run(max_instructions=limit - msp.instructions, breakpoints=breakpoints)
+            if reason == msp.RUN_BREAKPOINT:
+                break
+        self.log.info('booted to 0x%04x after %d cycles' % (msp.PC.get(), msp.cycles))
+
+    def run(self, request):
+        """serve one request (a dict, see the description at the top) in
+        a forked child and return the result dict"""
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            #child: run and send back the result, never return
+            try:
+                os.close(rfd)
+                try:
+                    result = self.execute(request)
+                except Exception, e:
+                    result = {'error': '%s: %s' % (e.__class__.__name__, e)}
+                data = cPickle.dumps(result, 2)
+                while data:
+                    data = data[os.write(wfd, data):]
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        chunks = []
+        while True:
+            chunk = os.read(rfd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(rfd)
+        os.waitpid(pid, 0)
+        if not chunks:
+            raise ForkServerException('child %d died without result' % pid)
+        return cPickle.loads(''.join(chunks))
+
+    def execute(self, request):
+        """apply a request to the core and run until TEST_END or the cycle
+        budget is used up. this runs in the child"""
+        msp = self.msp
+        for address, data in request.get('memory', ()):
+            msp.memory.write(address, binascii.unhexlify(data))
+        for n, value in request.get('registers', ()):
+            msp.R[n].set(value)
+        max_cycles = request.get('max_cycles')
+        if max_cycles is None:
+            max_cycles = self.max_cycles
+        max_cycles += msp.cycles
+        while msp.testing.mode != testing.TEST_END:
+            if msp.cycles >= max_cycles:
+                break
+            msp.run(max_cycles=max_cycles - msp.cycles)
+        finished = msp.testing.mode == testing.TEST_END
+        return {
+            'failures': msp.testing.failures,
+            'subtests': msp.testing.subtests,
+            'cycles': msp.cycles,
+            'instructions': msp.instructions,
+            'finished': finished,
+            'timeout': not finished,
+            'pc': msp.PC.get(),
+            'error': None,
+        }
+
+    def serve(self, infile, outfile):
+        """answer JSON requests from infile, one per line, on outfile"""
+        for line in iter(infile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                result = self.run(json.loads(line))
+            except ValueError, e:
+                result = {'error': 'bad request: %s' % (e,)}
+            outfile.write(json.dumps(result) + '\n')
+            outfile.flush()
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] file.a43')
+    parser.add_option('-p', '--pc', metavar='ADDRESS', default=None,
+        help='boot until the PC reaches ADDRESS instead of TEST_START')
+    parser.add_option('-c', '--command', metavar='CMD', default='0x10',
+        help='boot until CMD is written to the test peripheral (default TEST_START)')
+    parser.add_option('-m', '--max-cycles', type='int', metavar='N', default=ForkServer.MAX_CYCLES,
+        help='cycle budget of requests without max_cycles (default %default)')
+    parser.add_option('-l', '--log', metavar='FILE', default='forkserver.log',
+        help='log file (default forkserver.log)')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected one file')
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        filename=options.log,
+                        filemode='w')
+    server = ForkServer(args[0],
+        address=int(options.pc, 0) if options.pc is not None else None,
+        command=int(options.command, 0),
+        max_cycles=options.max_cycles)
+    server.serve(sys.stdin, sys.stdout)
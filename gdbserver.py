@@ -4,36 +4,55 @@
 # connect to the simulator and manipulate the simulated core.
 # An unllimited number of breakpoints is supported.
 #
+# Reverse execution (reverse-stepi, reverse-continue) is supported with
+# the checkpoints of a checkpoints.History that is recorded while the
+# target runs.
+#
+# Watchpoints (watch, rwatch, awatch) are evaluated by the simulator with
+# Memory.watch, gdb does not have to single step.
+#
+# For fast transfers, qSupported offers large packets, no-ack mode and
+# a memory map, and binary X and vFlashWrite writes are accepted.
+#
+# vCont is supported with range stepping ("r start,end"): gdb's step and
+# next run in the simulator until the PC leaves the range of a source
+# line, instead of one packet per instruction.
+#
 # (C) 2002-2004 Chris Liechti <cliechti@gmx.net>
 # this is distributed under a free software license, see license.txt
 #
 # $Id: gdbserver.py,v 1.3 2005/12/31 04:27:36 cliechti Exp $
 
 import sys, socket, threading, binascii
+import re
 import Queue
 import core
+import checkpoints
 import logging
 import time
 
 def checksum(data):
-    checksum = 0
-    for c in data:
-        checksum = (checksum + ord(c)) & 0xff
-    return checksum
+    return sum(bytearray(data)) & 0xff
 
 def unescape(data):
     """decode binary packets with escapes"""
-    esc_found = False
-    out = []
-    for byte in data:
-        if esc_found:
-            out.append(byte ^ 0x20)
-            esc_found = False
-        elif byte == 0x7d:
-            esc_found = True
-        else:
-            out.append(byte)
-    return ''.join(out)
+    return re.sub(r'\}(.)', lambda m: chr(ord(m.group(1)) ^ 0x20), data, flags=re.S)
+
+class StepRange:
+    """breakpoints for Core.run that stop a range step: every address
+    outside start..end-1 and the breakpoints. Core.run checks them after
+    each instruction of blocks that leave the range and after each block,
+    so the target stops on the first instruction outside the range"""
+    def __init__(self, start, end, breakpoints):
+        self.start = start
+        self.end = end
+        self.breakpoints = breakpoints
+
+    def __contains__(self, address):
+        return not self.start <= address < self.end or address in self.breakpoints
+
+    def __nonzero__(self):
+        return True
 
 
 class BreakpointRunner(threading.Thread):
@@ -42,10 +61,16 @@ class BreakpointRunner(threading.Thread):
         self.core = core
         self.interrupted = False
         self.breakpoints = {}
+        self.watchpoints = {}       #(gdb type, address, length) -> core.Watchpoint
+        self.hits = []              #(gdb type, address) of watchpoint hits
+        self.history = checkpoints.History(core)    #for reverse execution
+        self.steprange = None       #(start, end) of the range-step command
         #callback for signals
         self.sig_trap = self._signal
         self.sig_int = self._signal
         self.sig_segv = self._signal
+        self.sig_begin = self._signal   #reverse execution reached the start of the history
+        self.sig_watch = self._signal   #called with gdb type and address of a watchpoint hit
         
         self.cmd_queue = Queue.Queue(1)
         threading.Thread.__init__(self)
@@ -61,14 +86,59 @@ class BreakpointRunner(threading.Thread):
     def remove_breakpoint(self, address):
         if address in self.breakpoints:
             del self.breakpoints[address]
+
+    #gdb watchpoint types (Z2, Z3, Z4)
+    WATCHKINDS = {2: core.WATCH_WRITE, 3: core.WATCH_READ, 4: core.WATCH_ACCESS}
+
+    def set_watchpoint(self, ty, address, length):
+        """watch length bytes at address, ty is the gdb type 2, 3 or 4"""
+        def hit(memory, bytemode, writing, accessed, value):
+            self.hits.append((ty, max(accessed, address)))
+            self.core.stop()
+        key = (ty, address, length)
+        if key in self.watchpoints:
+            self.core.memory.unwatch(self.watchpoints[key])
+        self.watchpoints[key] = self.core.memory.watch(address, address + max(length, 1) - 1,
+            self.WATCHKINDS[ty], 'gdb watchpoint', hit)
+
+    def remove_watchpoint(self, ty, address, length):
+        """returns false if there is no such watchpoint"""
+        watchpoint = self.watchpoints.pop((ty, address, length), None)
+        if watchpoint is None:
+            return False
+        self.core.memory.unwatch(watchpoint)
+        return True
+
+    def _watched(self, core):
+        """until function for reverse execution: a watchpoint was hit"""
+        if self.hits:
+            del self.hits[:]
+            return True
+        return False
+
+    def _report(self):
+        """signal the stop after running forward"""
+        if self.hits:
+            ty, address = self.hits[-1]
+            self.log.info('watchpoint 0x%04x @0x%04x (cycle %d)' % (address, self.core.PC.get(), self.core.cycles))
+            del self.hits[:]
+            self.sig_watch(ty, address)
+        else:
+            self.sig_trap()
             
     def command(self, cmd):
         self.log.info('queing remote command %r' % cmd)
         self.cmd_queue.put(cmd)
+
+    def step_range(self, start, end):
+        """step once and then as long as the PC is in start..end-1"""
+        self.steprange = (start, end)
+        self.command('range-step')
     
     def interrupt(self):
         self.log.info('interruption')
         self.interrupted = True
+        self.core.stop()
         #empty command queue
         while self.cmd_queue.qsize():
             self.cmd_queue.get_nowait()
@@ -81,40 +151,76 @@ class BreakpointRunner(threading.Thread):
             try:
                 command = self.cmd_queue.get()
                 self.log.info('executing remote command %r' % command)
-                if command == 'run':
+                del self.hits[:]
+                self.core.stoprequest = False   #from an interrupt that came after the last stop
+                if command in ('run', 'range-step'):
                     self.interrupted = False
                     last_time = time.time()
-                    step_delta = 0
-                    self.log.info('continuing from 0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                    breakpoints = self.breakpoints
+                    if command == 'range-step':
+                        start, end = self.steprange
+                        self.log.info('stepping 0x%04x..0x%04x from 0x%04x (cycle %d)' % (
+                            start, end, self.core.PC.get(), self.core.cycles))
+                        #at least one instruction is run, also from outside the range
+                        breakpoints = StepRange(start, end, self.breakpoints)
+                    else:
+                        self.log.info('continuing from 0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
                     while not self.interrupted:
                         try:
-                            self.core.step(illegal_is_fatal=True)
+                            #run in slices so that we can tell the user that we're alive
+                            reason = self.history.run(max_instructions=100000,
+                                breakpoints=breakpoints, illegal_is_fatal=True)
                         except core.MSP430CoreException, e:
                             self.log.warning('could not execute instruction: %s' % e)
                             self.sig_segv()
                             break
                         else:
-                            if self.core.PC.get() in self.breakpoints:
+                            if self.hits:
+                                self._report()
+                                break
+                            if reason == core.Core.RUN_BREAKPOINT and self.core.PC.get() in self.breakpoints:
                                 self.log.info('breakpoint @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
                                 self.sig_trap()
                                 break
-                            step_delta += 1
-                            if step_delta > 1000:          #after a few steps..
-                                #time check is not done at every step for better performance
-                                step_delta = 0
-                                if time.time() - last_time > 3:     #check time, more than 1s passed?
-                                    #yes, make a log message so that the user knows we're alive
-                                    last_time = time.time()
-                                    self.log.info('still running @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                            if reason == core.Core.RUN_BREAKPOINT:
+                                self.log.info('left range @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                                self.sig_trap()
+                                break
+                            if time.time() - last_time > 3:     #check time, more than 3s passed?
+                                #yes, make a log message so that the user knows we're alive
+                                last_time = time.time()
+                                self.log.info('still running @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
                     else:
                         self.log.info('interrupted @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
                         self.sig_int()
                 elif command == 'step':
                     self.log.info('single step @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
-                    self.core.step()
+                    self.history.step()
                     if self.core.PC.get() in self.breakpoints:
                         self.log.info('breakpoint @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
-                    self.sig_trap()
+                    self._report()
+                elif command == 'reverse-step':
+                    self.log.info('reverse step @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                    if self.history.stepback():
+                        del self.hits[:]    #replayed accesses
+                        self.sig_trap()
+                    else:
+                        self.log.info('start of history @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                        self.sig_begin()
+                elif command == 'reverse-run':
+                    self.interrupted = False
+                    self.log.info('reverse continuing from 0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                    if self.history.continueback(self.breakpoints, self.watchpoints and self._watched or None):
+                        if self.core.PC.get() in self.breakpoints:
+                            del self.hits[:]
+                        self.log.info('stopped @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                        self._report()
+                    elif self.interrupted:
+                        self.log.info('interrupted @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                        self.sig_int()
+                    else:
+                        self.log.info('start of history @0x%04x (cycle %d)' % (self.core.PC.get(), self.core.cycles))
+                        self.sig_begin()
                 else:
                     self.log.error('unknown command %r' % (command, ))
             except:
@@ -142,8 +248,12 @@ class GDBClientHandler(threading.Thread):
         threading.Thread.__init__(self)
         self.setName('gdb remote connection %r' % clientsocket)
         self.clientsocket = clientsocket
-        self.netin = clientsocket.makefile("r")
+        #acks and replies are small writes, don't let them wait for the ACKs of gdb
+        clientsocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.inbuf = ''             #received data not yet parsed
         self.netout = clientsocket.makefile("w")
+        self.noack = False          #QStartNoAckMode
+        self.lastpacket = None      #for retransmissions
         self.setDaemon(1)
         self.core = core
         self.log = logging.getLogger("gdbclient")
@@ -152,12 +262,13 @@ class GDBClientHandler(threading.Thread):
         self.runner.sig_trap = self._sigtrap
         self.runner.sig_int = self._sigint
         self.runner.sig_segv = self._sigsegv
+        self.runner.sig_begin = self._sigbegin
+        self.runner.sig_watch = self._sigwatch
         self.runner.start()
 
     def close(self):
         self.alive = False
         self.log.info("closing...")
-        self.netin.close()
         self.netout.close()
         self.clientsocket.close()
         self.log.info("closed")
@@ -170,12 +281,18 @@ class GDBClientHandler(threading.Thread):
                     pkt = self.readPacket()
                     self.log.debug('processing remote command %r' % pkt)
                 except ValueError:
-                    self.netout.write("-")
-                    self.netout.flush()
+                    if not self.noack:
+                        self.netout.write("-")
+                        self.netout.flush()
                 else:
-                    self.netout.write("+")
-                    self.netout.flush()
-                    if pkt[0] == "?":
+                    if pkt is None:     #EOF
+                        break
+                    if not self.noack:
+                        self.netout.write("+")
+                        self.netout.flush()
+                    if not pkt:
+                        self.writePacket("")
+                    elif pkt[0] == "?":
                         sig = 0
                         #self.writePacket("T%02x%02x:%04x" % (sig, 0, 0x1234))
                         self.writePacket("S%02x" % (sig,))
@@ -183,15 +300,39 @@ class GDBClientHandler(threading.Thread):
                         if len(pkt) > 1:
                             adr = int(pkt[1:],16)
                             self.core.PC.set(adr)
+                            self.runner.history.forget()
                         self.runner.command('run')
                         #~ self.writePacket("S%02x" % (5,))    #SIGTRAP
                     elif pkt[0] == "s":     #single step
                         if len(pkt) > 1:
                             adr = int(pkt[1:],16)
                             self.core.PC.set(adr)
+                            self.runner.history.forget()
                         self.runner.command('step')
+                    elif pkt == "vCont?":
+                        self.writePacket("vCont;c;C;s;S;r")
+                    elif pkt.startswith("vCont;"):
+                        try:
+                            actions = self.vcont(pkt)
+                        except ValueError, e:
+                            self.log.warning(str(e))
+                            self.writeError(1)
+                        else:
+                            #there is only one thread, the leftmost action applies to it
+                            action, args = actions[0]
+                            if action == 'c':
+                                self.runner.command('run')
+                            elif action == 's':
+                                self.runner.command('step')
+                            else:
+                                self.runner.step_range(*args)
+                    elif pkt == "bs":       #reverse single step
+                        self.runner.command('reverse-step')
+                    elif pkt == "bc":       #reverse continue
+                        self.runner.command('reverse-run')
                     elif pkt[0] == "D":     #detach
                         self.core.reset()
+                        self.runner.history.forget()
                         
                     elif pkt[0] == "g":     #read registers
                         self.log.info("Reading device registers")
@@ -200,6 +341,7 @@ class GDBClientHandler(threading.Thread):
                         self.log.info("Writing device registers")
                         for n, value in enumerate([int(pkt[i:i+2],16) + int(pkt[i+2:i+4],16)<<8 for i in range(1, 1+16*4, 4)]):
                             self.core.R[n].set(value)
+                        self.runner.history.forget()
                         self.writeOK()
                     elif pkt[0] == "p":     #read register
                         reg = int(pkt[1:], 16)
@@ -213,12 +355,14 @@ class GDBClientHandler(threading.Thread):
                         value = ord(data[0]) | (ord(data[1]) << 8)
                         self.log.info("Writing device register R%d = 0x%04x" % (reg, value))
                         self.core.R[reg].set(value)
+                        self.runner.history.forget()
                         self.writeOK()
                         
                     elif pkt[0] == "H":
                         self.writeOK()
                     elif pkt[0] == "k":     #kill request
                         self.core.reset()
+                        self.runner.history.forget()
                         self.writeOK()
                     elif pkt[0] == "m":     #read memory
                         fromadr, length = [int(x, 16) for x in pkt[1:].split(',')]
@@ -230,28 +374,58 @@ class GDBClientHandler(threading.Thread):
                         fromadr, length = [int(x, 16) for x in meta[1:].split(',')]
                         self.log.info("Writing device memory @0x%04x %d bytes" % (fromadr, length))
                         sdata = binascii.unhexlify(data)
+                        self.runner.history.forget()
                         try:
                             self.core.memory.write(fromadr, sdata)
                         except IOError:
                             self.writeError(1) #write error
                         else:
                             self.writeOK()
-                    #~ elif pkt[0] == "X":     #write memory (binary)
-                        #~ meta, data = pkt.split(':')
-                        #~ fromadr, length = [int(x, 16) for x in meta[1:].split(',')]
-                        #~ if length:
-                            #~ self.log.info("Writing device memory @0x%04x %d bytes (X)" % (fromadr, length))
-                            #~ sdata = unescape(data)
-                            #~ try:
-                                #~ self.core.memory.write(fromadr, sdata)
-                            #~ except IOError:
-                                #~ self.writeError(1) #write error
-                            #~ else:
-                                #~ self.writeOK()
-                        #~ else:
-                            #~ self.writeOK()
+                    elif pkt[0] == "X":     #write memory (binary)
+                        meta, data = pkt.split(':', 1)
+                        fromadr, length = [int(x, 16) for x in meta[1:].split(',')]
+                        if length:
+                            self.log.info("Writing device memory @0x%04x %d bytes (X)" % (fromadr, length))
+                            sdata = unescape(data)
+                            self.runner.history.forget()
+                            try:
+                                self.core.memory.write(fromadr, sdata)
+                            except IOError:
+                                self.writeError(1) #write error
+                            else:
+                                self.writeOK()
+                        else:
+                            self.writeOK()      #probe for X support
+                    elif pkt.startswith("vFlashErase:"):
+                        fromadr, length = [int(x, 16) for x in pkt[12:].split(',')]
+                        self.log.info("Erasing flash @0x%04x %d bytes" % (fromadr, length))
+                        self.runner.history.forget()
+                        self.core.memory.write(fromadr, '\xff' * length)
+                        self.writeOK()
+                    elif pkt.startswith("vFlashWrite:"):
+                        fromadr, data = pkt[12:].split(':', 1)
+                        fromadr = int(fromadr, 16)
+                        sdata = unescape(data)
+                        self.log.info("Writing flash @0x%04x %d bytes" % (fromadr, len(sdata)))
+                        self.runner.history.forget()
+                        self.core.memory.write(fromadr, sdata)
+                        self.writeOK()
+                    elif pkt == "vFlashDone":
+                        self.writeOK()
+                    elif pkt == "QStartNoAckMode":
+                        self.writeOK()      #still acknowledged
+                        self.noack = True
                     elif pkt[0] == "q":     #remote commands
-                        if pkt[1:5] == "Rcmd":
+                        if pkt.startswith("qSupported"):
+                            self.writePacket(';'.join(['PacketSize=%x' % self.PACKETSIZE,
+                                'QStartNoAckMode+', 'qXfer:memory-map:read+',
+                                'ReverseStep+', 'ReverseContinue+']))
+                        elif pkt.startswith("qXfer:memory-map:read::"):
+                            offset, length = [int(x, 16) for x in pkt[23:].split(',')]
+                            xml = self.memorymap()
+                            chunk = xml[offset:offset + length]
+                            self.writePacket((offset + length < len(xml) and 'm' or 'l') + chunk)
+                        elif pkt[1:5] == "Rcmd":
                             cmd = binascii.unhexlify(pkt.split(',')[1]).strip()
                             self.log.info("monitor command: %r" % cmd)
                             if ' ' in cmd:
@@ -270,20 +444,25 @@ class GDBClientHandler(threading.Thread):
                                 self.log.warning('no such monitor command ("%s")' % command)
                                 self.writeError(2)
                         else:
-                            self.writeError(1) #commond not known
+                            self.writePacket("") #query not known
                     
                     elif pkt[0] == "Z":     #set break or watchpoint
                         ty, adr, length = pkt[1:].split(',')
-                        if ty == '0':
+                        if ty in ('0', '1'):    #software and hardware breakpoints are the same
                             address = int(adr,16)
                             self.log.info("Setting breakpoint @0x%04x" % (address))
                             self.runner.set_breakpoint(address)
                             self.writeOK()
+                        elif ty in ('2', '3', '4'):
+                            address, length = int(adr, 16), int(length, 16)
+                            self.log.info("Setting %s @0x%04x %d bytes" % (self.WATCHNAMES[int(ty)], address, length))
+                            self.runner.set_watchpoint(int(ty), address, length)
+                            self.writeOK()
                         else:
                             self.writeError(1)
                     elif pkt[0] == "z":     #remove break or watchpoint
                         ty, adr, length = pkt[1:].split(',')
-                        if ty == '0':
+                        if ty in ('0', '1'):
                             address = int(adr,16)
                             self.log.info("Clearing breakpoint @0x%04x" % (address))
                             if address in self.runner.breakpoints:
@@ -291,6 +470,13 @@ class GDBClientHandler(threading.Thread):
                                 self.writeOK()
                             else:
                                 self.writeError(2)
+                        elif ty in ('2', '3', '4'):
+                            address, length = int(adr, 16), int(length, 16)
+                            self.log.info("Clearing %s @0x%04x %d bytes" % (self.WATCHNAMES[int(ty)], address, length))
+                            if self.runner.remove_watchpoint(int(ty), address, length):
+                                self.writeOK()
+                            else:
+                                self.writeError(2)
                         else:
                             self.writeError(1)
                     else:   #command not supported
@@ -300,36 +486,84 @@ class GDBClientHandler(threading.Thread):
             self.close()
 
     def readPacket(self):
+        """return the next packet, None at EOF. the socket is read in
+        blocks, acks are handled and ctrl+c interrupts the target"""
         self.log.debug("readPacket")
-        gdbcommand = 0
-        csum = 0
-        packet = []
         while True:
-            c = self.netin.read(1)
-            if not c: self.close() #EOF
-            if c == '\x03':     #ctrl+c
-                self.runner.interrupt()
-                continue
-            #print repr(c),
-            if gdbcommand:
-                if c == '#':
-                    if csum != int(self.netin.read(1) + self.netin.read(1), 16):
-                        raise ValueError("wrong checksum")
-                    return ''.join(packet)
-                else:
-                    packet.append(c)
-                    csum = (csum + ord(c)) % 256
-            else:
-                if c == '$':
-                    gdbcommand = 1
+            buf = self.inbuf
+            start = 0
+            while start < len(buf) and buf[start] != '$':
+                c = buf[start]
+                if c == '\x03':     #ctrl+c
+                    self.runner.interrupt()
+                elif c == '-' and not self.noack and self.lastpacket is not None:
+                    self.log.warning("retransmitting packet")
+                    self.netout.write(self.lastpacket)
+                    self.netout.flush()
+                start += 1
+            buf = buf[start:]
+            end = buf.find('#')
+            if end >= 0 and len(buf) >= end + 3:
+                self.inbuf = buf[end + 3:]
+                if checksum(buf[1:end]) != int(buf[end + 1:end + 3], 16):
+                    raise ValueError("wrong checksum")
+                return buf[1:end]
+            self.inbuf = buf
+            data = self.clientsocket.recv(self.PACKETSIZE)
+            if not data:
+                return None
+            self.inbuf += data
 
     def writePacket(self, msg):
         self.log.debug("writePacket(%r)" % msg)
-        self.netout.write("$%s#%02x" % (msg, checksum(msg)))
+        self.lastpacket = "$%s#%02x" % (msg, checksum(msg))
+        self.netout.write(self.lastpacket)
         self.netout.flush()
 
     def writeOK(self):
         self.writePacket("OK")
+
+    PACKETSIZE = 0x4000     #largest packet offered to gdb
+
+    def vcont(self, pkt):
+        """return (action, arguments) for each action of a vCont packet,
+        'c', 's' or 'r' with start and end. raises ValueError for actions
+        that are not supported"""
+        actions = []
+        for item in pkt.split(';')[1:]:
+            action = item.split(':')[0]         #thread ids are not checked
+            if action in ('c', 's'):
+                actions.append((action, ()))
+            elif action[:1] in ('C', 'S') and len(action) == 3:
+                int(action[1:], 16)             #signals are ignored
+                actions.append((action[0].lower(), ()))
+            elif action[:1] == 'r':
+                start, end = [int(x, 16) for x in action[1:].split(',')]
+                actions.append(('r', (start, end)))
+            else:
+                raise ValueError('vCont action %r not supported' % action)
+        if not actions:
+            raise ValueError('vCont without actions')
+        return actions
+
+    def memorymap(self):
+        """return the memory map XML: the flash peripherals as flash, the
+        rest as RAM"""
+        flash = sorted([(p.startaddress, p.endaddress) for p in self.core.memory.peripherals
+            if isinstance(p, core.Flash)])
+        regions = []
+        address = 0
+        for first, last in flash + [(0x10000, 0x10000)]:
+            if first > address:
+                regions.append('<memory type="ram" start="0x%x" length="0x%x"/>' % (address, first - address))
+            if first <= 0xffff:
+                regions.append('<memory type="flash" start="0x%x" length="0x%x">'
+                    '<property name="blocksize">0x200</property></memory>' % (first, last - first + 1))
+            address = last + 1
+        return ('<?xml version="1.0"?>\n'
+            '<!DOCTYPE memory-map PUBLIC "+//IDN gnu.org//DTD GDB Memory Map V1.0//EN" '
+            '"http://sourceware.org/gdb/gdb-memory-map.dtd">\n'
+            '<memory-map>%s</memory-map>\n' % ''.join(regions))
         
     def writeError(self, errorcode=0):
         self.writePacket("E%02x" % (errorcode,))
@@ -343,6 +577,11 @@ class GDBClientHandler(threading.Thread):
     def _sigtrap(self): self.writeSignal(5)
     def _sigint(self): self.writeSignal(2)
     def _sigsegv(self): self.writeSignal(11)
+    def _sigbegin(self): self.writePacket("T%02xreplaylog:begin;" % (5,))
+    def _sigwatch(self, ty, address): self.writePacket("T%02x%s:%04x;" % (5, self.WATCHNAMES[ty], address))
+
+    #stop reasons of watchpoint types 2, 3 and 4
+    WATCHNAMES = {2: 'watch', 3: 'rwatch', 4: 'awatch'}
     
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     
@@ -372,11 +611,23 @@ class GDBClientHandler(threading.Thread):
     def monitor_puc(self, args):
         """reset target"""
         self.core.reset()
+        self.runner.history.forget()
         self.writeOK()
         
     def monitor_reset(self, args):
         """reset target"""
         self.core.reset()
+        self.runner.history.forget()
+        self.writeOK()
+
+    def monitor_history(self, args):
+        """show the checkpoints for reverse execution"""
+        history = self.runner.history
+        if len(history):
+            self.writeMessage("%d checkpoints, %d bytes, back to instruction %d (now %d)\n" % (
+                len(history), history.size, history.begin(), self.core.instructions))
+        else:
+            self.writeMessage("no history\n")
         self.writeOK()
 
     def monitor_vcc(self, args):
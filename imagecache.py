@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#
+# on-disk cache of parsed firmware images for the MSP430 simulator.
+# Memory.load(filename, cache) looks up the file by a hash of its
+# contents. on a hit, the data spans (and ELF symbols) are taken from a
+# binary blob with mmap instead of parsing the hex text again.
+#
+# the cache directory can be shared by concurrent processes: blobs are
+# written to a temporary file and renamed into place, so readers never
+# see partial files. the modification time of a blob is its last use;
+# when the directory grows over maxsize, the least recently used blobs
+# are removed.
+#
+# blob layout (little endian):
+#   header  "MSPIMG\x01\x00", number of spans, number of symbols (II)
+#   spans   address, length (II) for each span
+#   symbols address, size, kind, binding, name length (IIBBH) each
+#   names of the symbols, then the data of the spans, back to back
+#
+# as script it shows the cache statistics or clears the cache.
+#
+# this is distributed under a free software license, see license.txt
+
+import os, struct, mmap
+import hashlib
+import tempfile
+import logging
+import elf
+
+MAGIC = 'MSPIMG\x01\x00'
+HEADER = struct.Struct('<8sII')
+SPAN = struct.Struct('<II')
+SYMBOL = struct.Struct('<IIBBH')
+SUFFIX = '.img'
+
+class ImageCache:
+    """directory of parsed images, see the description at the top"""
+
+    def __init__(self, directory, maxsize=64 << 20):
+        self.directory = directory
+        self.maxsize = maxsize      #bytes of blobs kept at most
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):    #an other process may have made it
+                    raise
+
+    def key(self, filename, data):
+        """return the cache key of a file with the contents data. the
+        extension is included as it selects the parser"""
+        h = hashlib.sha1(MAGIC)
+        h.update(os.path.splitext(filename)[1].lower() + '\x00')
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def read(self, filename, parse):
+        """return the spans and symbols of filename from the cache. on a
+        miss, parse(filename) is called and its result is stored"""
+        f = open(filename, 'rb')
+        try:
+            key = self.key(filename, f.read())
+        finally:
+            f.close()
+        path = self.path(key)
+        result = self.fetch(path)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        spans, symbols = parse(filename)
+        self.store(path, spans, symbols)
+        return spans, symbols
+
+    def fetch(self, path):
+        """return (spans, symbols) of a blob or None if it is missing or
+        damaged"""
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                return None
+        finally:
+            f.close()
+        try:
+            try:
+                result = self.decode(blob)
+            except (struct.error, ValueError), e:
+                logging.getLogger('imagecache').warning('dropping damaged cache file %s: %s' % (path, e))
+                self.remove(path)
+                return None
+        finally:
+            blob.close()
+        try:
+            os.utime(path, None)        #mark as recently used
+        except OSError:
+            pass                        #evicted by an other process meanwhile
+        return result
+
+    def decode(self, blob):
+        """parse a blob, see the layout at the top"""
+        magic, nspans, nsymbols = HEADER.unpack_from(blob, 0)
+        if magic != MAGIC:
+            raise ValueError('bad magic')
+        offset = HEADER.size
+        table = []
+        for n in range(nspans):
+            table.append(SPAN.unpack_from(blob, offset))
+            offset += SPAN.size
+        entries = []
+        for n in range(nsymbols):
+            entries.append(SYMBOL.unpack_from(blob, offset))
+            offset += SYMBOL.size
+        symbols = None
+        if nsymbols:
+            symbols = elf.SymbolTable()
+            for address, size, kind, binding, length in entries:
+                symbols.add(elf.Symbol(blob[offset:offset + length], address, size, kind, binding))
+                offset += length
+        spans = []
+        for address, length in table:
+            spans.append((address, blob[offset:offset + length]))
+            offset += length
+        if offset != len(blob):
+            raise ValueError('bad length')
+        return spans, symbols
+
+    def encode(self, spans, symbols):
+        """return the blob for spans and symbols"""
+        entries = symbols is not None and symbols.entries or []
+        parts = [HEADER.pack(MAGIC, len(spans), len(entries))]
+        parts.extend([SPAN.pack(address, len(data)) for address, data in spans])
+        parts.extend([SYMBOL.pack(s.address, s.size, s.kind, s.binding, len(s.name)) for s in entries])
+        parts.extend([s.name for s in entries])
+        parts.extend([data for address, data in spans])
+        return ''.join(parts)
+
+    def store(self, path, spans, symbols):
+        """write a blob atomically and evict old ones if needed"""
+        fd, tmp = tempfile.mkstemp(SUFFIX + '.tmp', '', self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(self.encode(spans, symbols))
+            finally:
+                f.close()
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                #on windows rename fails if an other process stored it first
+                if not os.path.exists(path):
+                    raise
+        finally:
+            self.remove(tmp)
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass        #already gone, e.g. removed by an other process
+
+    def entries(self):
+        """return a list of (mtime, size, path) of the blobs, oldest first"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """remove the least recently used blobs until the total size is
+        below maxsize"""
+        entries = self.entries()
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in entries:
+            if total <= self.maxsize:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        """remove all blobs"""
+        for mtime, size, path in self.entries():
+            self.remove(path)
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] directory')
+    parser.add_option('--clear', action='store_true', default=False,
+        help='remove all cached images')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected the cache directory')
+    cache = ImageCache(args[0])
+    if options.clear:
+        cache.clear()
+    entries = cache.entries()
+    print '%d images, %d bytes' % (len(entries), sum([size for mtime, size, path in entries]))
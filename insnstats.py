@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# instruction mix and hot spot counters for the MSP430 simulator.
+# Statistics(core) attaches itself as core.stats and counts executed
+# instructions per mnemonic, per addressing mode of the source and
+# destination operand and per byte/word mode, the executions of each
+# address and the data memory reads and writes of each address. all
+# counters are preallocated arrays.
+#
+# translated blocks are only counted as a whole while they run; their
+# instructions are added to the counters when the results are read.
+# instruction fetches are not counted as memory reads.
+#
+# this is distributed under a free software license, see license.txt
+
+import array
+import json
+import core
+
+#mnemonics in the order of the core tables, 'illegal' for unknown opcodes
+MNEMONICS = [name for name, fu, cycles in
+    sorted(core.Core.singleOperandInstructions.values()) +
+    sorted(core.Core.doubleOperandInstructions.values()) +
+    list(core.Core.jumpInstructions)] + ['illegal']
+MNEMONIC = dict([(name, n) for n, name in enumerate(MNEMONICS)])
+
+MODES = ['register', 'indexed', 'symbolic', 'absolute', 'indirect',
+         'autoincrement', 'immediate', 'constant']
+WIDTHS = ['word', 'byte']
+
+def mode(arg):
+    """return the index in MODES of an argument wrapper"""
+    cls = arg.__class__
+    if cls is core.RegisterArgument:
+        if arg.reg.regnum == 3 or (arg.reg.regnum == 2 and arg.am > 1):
+            return 7        #constant generator
+        return 0
+    if cls is core.IndexedRegisterArgument:
+        return arg.reg.regnum == 0 and 2 or 1
+    if cls is core.MemoryArgument:
+        return 3
+    if cls is core.IndirectRegisterArgument:
+        return 4
+    if cls is core.IndirectAutoincrementRegisterArgument:
+        return 5
+    return 6            #ImmediateArgument
+
+def counters(size):
+    return array.array('L', [0]) * size
+
+class Statistics:
+    """counters of one core, see the description at the top"""
+
+    def __init__(self, core):
+        self.core = core
+        self.mnemonics = counters(len(MNEMONICS))
+        self.srcmodes = counters(len(MODES))
+        self.dstmodes = counters(len(MODES))
+        self.widths = counters(len(WIDTHS))
+        self.executions = counters(0x10000)     #per instruction address
+        self.reads = counters(0x10000)          #per data address
+        self.writes = counters(0x10000)
+        self.blockcounts = {}                   #Block -> complete runs not yet added
+        self.blockinfo = {}                     #Block -> info() of its insns
+        self.attach()
+
+    def attach(self):
+        """install the memory counters and become core.stats. translated
+        code is dropped so that it uses the counters too. instruction
+        fetches do not go through memory.get and are not counted"""
+        memory = self.core.memory
+        get, set = memory.get, memory.set
+        reads, writes = self.reads, self.writes
+        def countedget(address, bytemode=0):
+            reads[address & 0xffff] += 1
+            return get(address, bytemode)
+        def countedset(address, value, bytemode=0):
+            writes[address & 0xffff] += 1
+            set(address, value, bytemode)
+        self.saved = (memory.__dict__.get('get'), memory.__dict__.get('set'))
+        memory.get, memory.set = countedget, countedset
+        memory.invalidatecode(0, 0x10000)
+        self.core.stats = self
+
+    def detach(self):
+        """remove the counters from the core, the results are kept"""
+        self.fold()
+        memory = self.core.memory
+        for obj, name, value in ((memory, 'get', self.saved[0]), (memory, 'set', self.saved[1])):
+            if value is None:
+                del obj.__dict__[name]      #back to the method of the class
+            else:
+                setattr(obj, name, value)
+        memory.invalidatecode(0, 0x10000)
+        self.core.stats = None
+
+    #---
+    # hooks called by the core
+
+    def info(self, address, name, args):
+        """return (address, mnemonic, width, source mode, destination mode)
+        of an instruction as indexes, -1 where it does not apply"""
+        if name.startswith('illegal'):
+            return (address, MNEMONIC['illegal'], -1, -1, -1)
+        m = MNEMONIC[name]
+        if len(args) == 2 and args[1].__class__ is core.JumpTarget:
+            return (address, m, -1, -1, -1)
+        if len(args) == 2:
+            return (address, m, int(args[0]), mode(args[1]), -1)
+        return (address, m, int(args[0]), mode(args[1]), mode(args[2]))
+
+    def add(self, info, n):
+        address, m, width, src, dst = info
+        self.executions[address] += n
+        self.mnemonics[m] += n
+        if width >= 0:
+            self.widths[width] += n
+        if src >= 0:
+            self.srcmodes[src] += n
+        if dst >= 0:
+            self.dstmodes[dst] += n
+
+    def instruction(self, address, name, args, pc):
+        """one instruction was executed by Core.step"""
+        self.add(self.info(address, name, args), 1)
+
+    def block(self, block, count, pc):
+        """count instructions of a Block were executed by Core.run"""
+        if count == block.count:
+            self.blockcounts[block] = self.blockcounts.get(block, 0) + 1
+            return
+        try:
+            insns = self.blockinfo[block]
+        except KeyError:
+            insns = self.blockinfo[block] = self.blockdecode(block)
+        for info in insns[:count]:
+            self.add(info, 1)
+
+    def blockdecode(self, block):
+        return [self.info(address, name, args)
+            for address, (name, args) in zip(block.addresses, block.insns)]
+
+    def fold(self):
+        """add the counted blocks to the arrays"""
+        for block, n in self.blockcounts.items():
+            insns = self.blockinfo.get(block)
+            if insns is None:
+                insns = self.blockinfo[block] = self.blockdecode(block)
+            for info in insns:
+                self.add(info, n)
+        self.blockcounts.clear()
+        self.blockinfo.clear()
+
+    def reset(self):
+        """set all counters to zero"""
+        self.blockcounts.clear()
+        self.blockinfo.clear()
+        for a in (self.mnemonics, self.srcmodes, self.dstmodes, self.widths,
+                  self.executions, self.reads, self.writes):
+            a[:] = counters(len(a))
+
+    #---
+    # results
+
+    def instructions(self):
+        """return the number of counted instructions"""
+        self.fold()
+        return sum(self.mnemonics)
+
+    def hotspots(self, n=20):
+        """return the n most executed addresses as (address, count)"""
+        self.fold()
+        executions = self.executions
+        hot = sorted([(-c, a) for a, c in enumerate(executions) if c])[:n]
+        return [(a, -c) for c, a in hot]
+
+    def regions(self, counts):
+        """sum per address counts by the peripheral that handles them"""
+        memory = self.core.memory
+        result = {}
+        for address, c in enumerate(counts):
+            if c:
+                p = memory.peripheral(address)
+                region = p is None and 'memory' or p.__class__.__name__
+                result[region] = result.get(region, 0) + c
+        return result
+
+    def summary(self, hotspots=20):
+        """return all counters as a dict that can be dumped as JSON"""
+        self.fold()
+        named = lambda names, counts: dict([(name, c) for name, c in zip(names, counts) if c])
+        symbols = self.core.memory.symbols
+        return {
+            'instructions': sum(self.mnemonics),
+            'mnemonics': named(MNEMONICS, self.mnemonics),
+            'srcmodes': named(MODES, self.srcmodes),
+            'dstmodes': named(MODES, self.dstmodes),
+            'widths': named(WIDTHS, self.widths),
+            'reads': self.regions(self.reads),
+            'writes': self.regions(self.writes),
+            'hotspots': [['0x%04x' % a, symbols.describe(a), c] for a, c in self.hotspots(hotspots)],
+        }
+
+    def dump(self, filename, hotspots=20):
+        """write summary() to a JSON file"""
+        f = open(filename, 'w')
+        try:
+            json.dump(self.summary(hotspots), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+def merge(summaries):
+    """add the counters of several summary() dicts. hot spots are left
+    out as the addresses of different images do not relate"""
+    total = {'instructions': 0}
+    for summary in summaries:
+        total['instructions'] += summary['instructions']
+        for key in ('mnemonics', 'srcmodes', 'dstmodes', 'widths', 'reads', 'writes'):
+            counts = total.setdefault(key, {})
+            for name, c in summary[key].items():
+                counts[name] = counts.get(name, 0) + c
+    return total
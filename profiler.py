@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# function level cycle profiler for the MSP430 simulator. a Profiler is
+# attached to a core with core.profiler = Profiler(core). it keeps a
+# shadow call stack from call, ret (mov @SP+, PC) and reti and charges
+# the cycles of every instruction to the function on top of it. the
+# result is a Profile with call counts, inclusive and exclusive cycles
+# per function, the call graph and collapsed stacks for flame graphs
+# (flamegraph.pl or speedscope read them).
+#
+# functions are named with the symbols of an ELF file when available,
+# raw addresses otherwise. the core has no interrupt logic; code that
+# delivers interrupts can call Profiler.interrupt() after pushing PC
+# and SR so that the handler gets its own frame.
+#
+# as script it runs test files like testing.py and prints the profile:
+#
+#   profiler.py --folded fw.folded fw.elf
+#
+# this is distributed under a free software license, see license.txt
+
+import sys
+import core
+
+class Frame:
+    """one entry of the shadow call stack"""
+    def __init__(self, function, sp, key, start):
+        self.function = function    #entry address
+        self.sp = sp                #SP while the function runs, see Profiler.leave()
+        self.key = key              #tuple of entry addresses from the root
+        self.start = start          #core cycles at the entry
+
+class Profiler:
+    """collect the cycles of a core per function"""
+
+    def __init__(self, core, symbols=None):
+        self.core = core
+        self.symbols = symbols      #None: use core.memory.symbols
+        self.reset()
+
+    def reset(self):
+        """forget everything and start over at the current cycle count"""
+        self.last = self.core.cycles    #cycles already charged
+        self.stack = []             #Frames, created at the first instruction
+        self.exclusive = {}         #entry address -> cycles
+        self.inclusive = {}         #entry address -> cycles incl. callees
+        self.calls = {}             #entry address -> number of calls
+        self.edges = {}             #(caller, callee) -> [calls, cycles]
+        self.stacks = {}            #Frame.key -> cycles
+        self.active = {}            #entry address -> frames on the stack
+
+    def getsymbols(self):
+        if self.symbols is not None:
+            return self.symbols
+        return self.core.memory.symbols
+
+    #---
+    # hooks called by the core
+
+    def instruction(self, address, name, args, pc):
+        """one instruction was executed by Core.step, pc is the PC after it"""
+        self.charge(address)
+        kind = core.transfer(name, args)
+        if kind is not None:
+            self.transfer(kind, pc)
+
+    def block(self, block, count, pc):
+        """count instructions of a Block were executed by Core.run"""
+        self.charge(block.start)
+        if block.exit is not None and count == block.count:
+            self.transfer(block.exit, pc)
+
+    def charge(self, address):
+        """give the cycles since the last call to the function on top of
+        the stack. address is an instruction of it, used for the root"""
+        if not self.stack:
+            function = self.getsymbols().function(address)
+            root = function is not None and function.address or address
+            self.stack.append(Frame(root, None, (root,), self.last))
+            self.active[root] = 1
+        cycles = self.core.cycles - self.last
+        self.last = self.core.cycles
+        frame = self.stack[-1]
+        self.exclusive[frame.function] = self.exclusive.get(frame.function, 0) + cycles
+        self.stacks[frame.key] = self.stacks.get(frame.key, 0) + cycles
+
+    def transfer(self, kind, pc):
+        regs = self.core.regs
+        if kind == 'call':
+            self.enter(pc, regs[1])
+        elif kind == 'ret':
+            self.leave((regs[1] - 2) & 0xffff)
+        else:
+            self.leave((regs[1] - 4) & 0xffff)
+
+    def interrupt(self, handler):
+        """an interrupt was accepted: PC and SR are pushed and the handler
+        at address handler is about to run"""
+        self.charge(handler)
+        self.enter(handler, self.core.regs[1])
+
+    def enter(self, function, sp):
+        """push a frame, sp is the SP with the return address on top"""
+        caller = self.stack[-1]
+        self.stack.append(Frame(function, sp, caller.key + (function,), self.last))
+        self.calls[function] = self.calls.get(function, 0) + 1
+        self.active[function] = self.active.get(function, 0) + 1
+        edge = self.edges.get((caller.function, function))
+        if edge is None:
+            edge = self.edges[(caller.function, function)] = [0, 0]
+        edge[0] += 1
+
+    def leave(self, sp):
+        """pop the frame that was entered with sp and all frames above it
+        (e.g. after a longjmp). returns that do not match a frame, like a
+        ret used as computed jump, are ignored"""
+        for n in range(len(self.stack) - 1, 0, -1):
+            if self.stack[n].sp == sp:
+                break
+        else:
+            return
+        while len(self.stack) > n:
+            self.close(self.stack.pop(), self.last)
+
+    def close(self, frame, cycles):
+        """account the inclusive cycles of a frame that ends at cycles"""
+        spent = cycles - frame.start
+        self.active[frame.function] -= 1
+        if not self.active[frame.function]:     #outermost of recursive calls
+            self.inclusive[frame.function] = self.inclusive.get(frame.function, 0) + spent
+        if len(self.stack):
+            edge = self.edges[(self.stack[-1].function, frame.function)]
+            edge[1] += spent
+
+    #---
+    # results
+
+    def name(self, address):
+        """return the function name for an entry address"""
+        name = self.getsymbols().get(address)
+        return name is not None and name or '0x%04x' % address
+
+    def profile(self):
+        """return a Profile of everything recorded so far. functions that
+        are still running are included up to the current cycle count"""
+        inclusive = dict(self.inclusive)
+        edges = dict([(e, list(v)) for e, v in self.edges.items()])
+        seen = set()
+        for n, frame in enumerate(self.stack):
+            spent = self.last - frame.start
+            if frame.function not in seen:
+                seen.add(frame.function)
+                inclusive[frame.function] = inclusive.get(frame.function, 0) + spent
+            if n:
+                edges[(self.stack[n - 1].function, frame.function)][1] += spent
+        name = self.name
+        profile = Profile()
+        for function in set(self.exclusive) | set(inclusive):
+            profile.add(name(function), self.calls.get(function, 0),
+                inclusive.get(function, 0), self.exclusive.get(function, 0))
+        for (caller, callee), (calls, cycles) in edges.items():
+            profile.addedge(name(caller), name(callee), calls, cycles)
+        for key, cycles in self.stacks.items():
+            if cycles:
+                profile.addstack(';'.join([name(a) for a in key]), cycles)
+        return profile
+
+class Profile:
+    """profiling results by function name. profiles of several runs, also
+    of different images, can be merged"""
+
+    def __init__(self):
+        self.functions = {}         #name -> [calls, inclusive, exclusive]
+        self.edges = {}             #(caller, callee) -> [calls, cycles]
+        self.stacks = {}            #'root;caller;callee' -> cycles
+
+    def add(self, name, calls, inclusive, exclusive):
+        f = self.functions.setdefault(name, [0, 0, 0])
+        f[0] += calls
+        f[1] += inclusive
+        f[2] += exclusive
+
+    def addedge(self, caller, callee, calls, cycles):
+        e = self.edges.setdefault((caller, callee), [0, 0])
+        e[0] += calls
+        e[1] += cycles
+
+    def addstack(self, stack, cycles):
+        self.stacks[stack] = self.stacks.get(stack, 0) + cycles
+
+    def merge(self, other):
+        """add the data of an other Profile"""
+        for name, (calls, inclusive, exclusive) in other.functions.items():
+            self.add(name, calls, inclusive, exclusive)
+        for (caller, callee), (calls, cycles) in other.edges.items():
+            self.addedge(caller, callee, calls, cycles)
+        for stack, cycles in other.stacks.items():
+            self.addstack(stack, cycles)
+
+    def total(self):
+        """return the number of profiled cycles"""
+        return sum([f[2] for f in self.functions.values()])
+
+    def report(self, limit=None):
+        """return a table of the functions sorted by exclusive cycles and
+        the call graph as text"""
+        total = self.total() or 1
+        lines = ['%-32s %8s %12s %12s %7s' % ('function', 'calls', 'inclusive', 'exclusive', '%')]
+        functions = sorted(self.functions.items(), key=lambda (n, f): (-f[2], n))
+        for name, (calls, inclusive, exclusive) in functions[:limit]:
+            lines.append('%-32s %8d %12d %12d %6.2f%%' % (
+                name, calls, inclusive, exclusive, 100.0 * exclusive / total))
+        lines.append('')
+        lines.append('%-32s %-32s %8s %12s' % ('caller', 'callee', 'calls', 'cycles'))
+        for (caller, callee), (calls, cycles) in sorted(self.edges.items(), key=lambda (e, v): (-v[1], e)):
+            lines.append('%-32s %-32s %8d %12d' % (caller, callee, calls, cycles))
+        return '\n'.join(lines) + '\n'
+
+    def folded(self):
+        """return the collapsed stacks, one 'root;caller;callee cycles' per
+        line, as used by flame graph tools"""
+        return ''.join(['%s %d\n' % (stack, cycles) for stack, cycles in sorted(self.stacks.items())])
+
+if __name__ == '__main__':
+    import logging
+    import testing
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] file...')
+    parser.add_option('--folded', metavar='FILE', default=None,
+        help='write collapsed stacks for flame graphs to FILE')
+    parser.add_option('-n', '--limit', type='int', default=None, metavar='N',
+        help='only list the N functions with the most cycles')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('expected at least one file')
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        filename='testing.log',
+                        filemode='w')
+    profile = Profile()
+    for filename in args:
+        profile.merge(testing.runtest(filename, profile=True).profile)
+    sys.stdout.write(profile.report(options.limit))
+    if options.folded:
+        open(options.folded, 'w').write(profile.folded())
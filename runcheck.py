@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# regression check of Core.run against Core.step. random programs are
+# assembled with the assembler of benchmark.py and run for a number of
+# instructions on separate cores: with single steps, with Core.run in
+# pieces of random instruction and cycle budgets, and with Core.run
+# without translated blocks. afterwards the registers (SR included),
+# cycle and instruction counts, RAM and the multiplier must be the same.
+#
+# if NumPy is installed, each program also runs in the lanes of a
+# batch.BatchCore, with different data in each lane, and every lane is
+# compared with a Core.run of the same data.
+#
+# programs are a loop over random instructions of all kinds and
+# addressing modes, conditional jumps forward, calls, pushes and pops and
+# accesses to the hardware multiplier. r4..r7 point into RAM and are
+# reset at the start of the loop, r8..r15 hold data.
+#
+#   runcheck.py -n 200 -i 2000
+#
+# a failure prints the seed and the program; "runcheck.py -s SEED -n 1
+# -v" repeats it.
+#
+# this is distributed under a free software license, see license.txt
+
+import sys
+import random
+import logging
+import benchmark
+try:
+    import numpy
+    import batch
+except ImportError:
+    batch = None
+
+DATA = ['r%d' % n for n in range(8, 16)]
+POINTERS = ['r4', 'r5', 'r6', 'r7']
+DOUBLE = sorted([m for m in benchmark.DOUBLE if m != 'dadd'])     #not simulated
+SINGLE = ['rrc', 'rra', 'swpb', 'sxt']
+JUMPS = ['jnz', 'jz', 'jnc', 'jc', 'jn', 'jge', 'jl', 'jmp']
+MULTIPLIER = ['&MPY', '&MPYS', '&MAC', '&MACS', '&OP2', '&RESLO', '&RESHI', '&SUMEXT']
+IMMEDIATES = [0, 1, 2, 4, 8, -1, 0x7fff, 0x8000, 0x1234, 0x00ff, 0x5a5a]
+
+def source(rnd):
+    """return a random operand"""
+    k = rnd.random()
+    if k < 0.35:
+        return rnd.choice(DATA)
+    if k < 0.55:
+        return '#%d' % rnd.choice(IMMEDIATES + [rnd.randrange(0x10000)])
+    if k < 0.65:
+        return '@%s' % rnd.choice(POINTERS)
+    if k < 0.75:
+        return '@%s+' % rnd.choice(POINTERS)
+    if k < 0.85:
+        return '%d(%s)' % (2 * rnd.randrange(16), rnd.choice(POINTERS))
+    if k < 0.93:
+        return '&0x%04x' % (0x0300 + 2 * rnd.randrange(64))
+    return rnd.choice(MULTIPLIER)
+
+def destination(rnd):
+    """return a random writable operand"""
+    k = rnd.random()
+    if k < 0.6:
+        return rnd.choice(DATA)
+    if k < 0.8:
+        return '%d(%s)' % (2 * rnd.randrange(16), rnd.choice(POINTERS))
+    if k < 0.9:
+        return '&0x%04x' % (0x0300 + 2 * rnd.randrange(64))
+    return rnd.choice(MULTIPLIER)
+
+def program(rnd, length=60):
+    """return the source of a random program, see the top"""
+    lines = ['start:']
+    for n, pointer in enumerate(POINTERS):
+        lines.append('        mov #0x%04x, %s' % (0x0200 + 0x80 * n, pointer))
+    for n in range(length):
+        lines.append('l%d:' % n)
+        k = rnd.random()
+        width = rnd.random() < 0.25 and '.b' or ''
+        if k < 0.55:
+            lines.append('        %s%s %s, %s' % (rnd.choice(DOUBLE), width, source(rnd), destination(rnd)))
+        elif k < 0.7:
+            lines.append('        %s %s' % (rnd.choice(SINGLE), destination(rnd)))
+        elif k < 0.85:
+            target = min(length, n + 1 + rnd.randrange(4))
+            lines.append('        %s l%d' % (rnd.choice(JUMPS), target))
+        elif k < 0.93:
+            lines.append('        push %s' % source(rnd))
+            lines.append('        pop %s' % rnd.choice(DATA))
+        else:
+            lines.append('        call #sub')
+    lines.append('l%d:     jmp start' % length)
+    lines.append('sub:    add %s, %s' % (rnd.choice(DATA), rnd.choice(DATA)))
+    lines.append('        ret')
+    return '\n'.join(lines) + '\n'
+
+def state(c):
+    """return the registers, counters and data memory of a core"""
+    memory = c.memory
+    return ([int(r) for r in c.R], c.cycles, c.instructions,
+        [memory._get(a) for a in range(0x0130, 0x0140, 2)],
+        [memory._get(a, 1) for a in range(0x0200, 0x0a00)])
+
+def stepped(text, count, rnd):
+    c = benchmark.prepare(text)
+    for n in xrange(count):
+        c.step()
+    return c
+
+def ran(text, count, rnd, blocks=True):
+    """run in pieces of random budgets, ending after exactly count
+    instructions"""
+    c = benchmark.prepare(text)
+    while c.instructions < count:
+        budget = min(count - c.instructions, rnd.randrange(1, 200))
+        c.run(max_instructions=budget, max_cycles=rnd.choice([None, rnd.randrange(1, 400)]),
+            blocks=blocks)
+    return c
+
+def batchstate(b, lane):
+    """return state() of a lane of a BatchCore"""
+    lanes = numpy.array([lane])
+    return ([int(r) for r in b.regs[:, lane]], int(b.cycles[lane]), int(b.instructions[lane]),
+        [int(b.mget(lanes, numpy.array([a]), 0)[0]) for a in range(0x0130, 0x0140, 2)],
+        b.read(0x0200, 0x0800)[lane].tolist())
+
+ENGINES = [
+    ('step', stepped),
+    ('run', ran),
+    ('run without blocks', lambda text, count, rnd: ran(text, count, rnd, False)),
+]
+
+def compare(name, reference, result, text):
+    """return None if two state()s are the same, else a description"""
+    for what, a, b in zip(('registers', 'cycles', 'instructions', 'multiplier', 'memory'),
+                          reference[1], result):
+        if a != b:
+            return '%s after %s differs from %s\n%r\n%r\n%s' % (
+                what, name, reference[0], a, b, text)
+    return None
+
+def check(seed, count):
+    """run one random program with all engines, return None if they
+    agree or a description of the difference"""
+    rnd = random.Random(seed)
+    text = program(rnd)
+    reference = None
+    for name, engine in ENGINES:
+        result = state(engine(text, count, random.Random(seed)))
+        if reference is None:
+            reference = name, result
+            continue
+        message = compare(name, reference, result, text)
+        if message is not None:
+            return message
+    return None
+
+def checkbatch(seed, count, lanes=4):
+    """run one random program in the lanes of a BatchCore and each lane
+    with Core.run, return None if they agree or a description of the
+    difference"""
+    rnd = random.Random(seed)
+    text = program(rnd)
+    data = [[rnd.randrange(0x10000) for r in DATA] for lane in range(lanes)]
+    b = batch.BatchCore(benchmark.prepare(text), lanes)
+    for lane, values in enumerate(data):
+        b.regs[8:16, lane] = values
+    b.run(max_instructions=count)
+    for lane, values in enumerate(data):
+        c = benchmark.prepare(text)
+        for n, value in enumerate(values):
+            c.R[8 + n].set(value)
+        c.run(max_instructions=count)
+        message = compare('batch lane %d' % lane, ('run', state(c)), batchstate(b, lane), text)
+        if message is not None:
+            return message
+    return None
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--programs', type='int', default=100, metavar='N',
+        help='number of random programs (default: %default)')
+    parser.add_option('-i', '--instructions', type='int', default=1000, metavar='N',
+        help='instructions to run of each (default: %default)')
+    parser.add_option('-s', '--seed', type='int', default=1, metavar='SEED',
+        help='seed of the first program (default: %default)')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+        help='print the seed of every program')
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    failures = 0
+    for seed in range(options.seed, options.seed + options.programs):
+        if options.verbose:
+            sys.stdout.write('seed %d\n' % seed)
+        message = check(seed, options.instructions)
+        if message is None and batch is not None:
+            message = checkbatch(seed, options.instructions)
+        if message is not None:
+            sys.stdout.write('seed %d: %s\n' % (seed, message))
+            failures += 1
+    sys.stdout.write('%d of %d programs failed\n' % (failures, options.programs))
+    sys.exit(failures and 1 or 0)
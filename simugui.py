@@ -144,7 +144,7 @@ class MemTable(wxPyGridTableBase):
                 return "0x%04x" % (row * 16)
             elif col == 17: #ASCII view
                 address = row<<4
-                bytes = [self.core.memory._get(a, bytemode=1) for a in range(address, address+16)]
+                bytes = bytearray(self.core.memory.read(address, 16))
                 return ('%c'*len(bytes)) % tuple(map(lambda x: 32<=x<127 and x or ord('.'), bytes)) #ascii
             else:
                 return "%02x" % self.core.memory._get( (row<<4) + col, bytemode=1)
@@ -601,13 +601,7 @@ class CoreFrame(wxFrame, core.Observer):
 
     def OnMultiStepClick(self, event=None):
         steps = int(self.maxsteps.GetValue())
-        self.fastupdate = 1
-        try:
-            for i in range(steps):
-                self.core.step()
-        finally:
-            self.fastupdate = 0
-            self.update()
+        self.core.run(max_instructions=steps)   #notifies once at the end
         
     def OnSizeWindow(self, event=None):
         self.update()       #init displays
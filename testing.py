@@ -16,7 +16,27 @@
 #please look at the example_tests.c and testing.h for more details on
 #how to write tests
 
+#with -j N the files are run in N worker processes. results are printed
+#as they come in and each worker logs to its own testing-<worker>.log
+
+#with --coverage FILE the executed code of all files is recorded and
+#saved to FILE, see codecoverage.py for the reports
+
+#with --image-cache DIR parsed files are kept in DIR, see imagecache.py
+
+#with --profile FILE the cycles are profiled by function and written to
+#FILE as collapsed stacks for flame graphs, see profiler.py
+
+#with --stats FILE the instruction mix, memory accesses and hot spots of
+#each file and their sum are written to FILE as JSON, see insnstats.py
+
 import sys, core, logging
+import multiprocessing
+import json
+import codecoverage
+import imagecache
+import profiler
+import insnstats
 
 #CMD codes:
 IDLE                    = 0x00
@@ -39,11 +59,17 @@ class Testing(core.Peripheral):
         self.testcount = 0
         self.failures = 0
         self.text_buffer = []
+        self.subtest = None         #name of the running subtest
+        self.subtests = []          #(name, success) of finished subtests
     
     def __contains__(self, address):
         """return true if address is handled by this peripheral"""
         return self.startaddress <= address <= (self.startaddress + 2)
 
+    def ranges(self):
+        """return the handled address ranges"""
+        return [(self.startaddress, self.startaddress + 2)]
+
     def reset(self):
         """perform a power up reset"""
         pass
@@ -60,15 +86,18 @@ class Testing(core.Peripheral):
                 self.log.info("Test finished")
             elif value == SUBTEST_START:
                 self.testcount += 1
-                self.log.info("Test: %r" % ''.join(self.text_buffer))
+                self.subtest = ''.join(self.text_buffer)
+                self.log.info("Test: %r" % self.subtest)
                 del self.text_buffer[:]
             elif value == SUBTEST_SUCCESS:
                 self.log.info("SUCCESS: %r" % ''.join(self.text_buffer))
                 del self.text_buffer[:]
+                self.subtests.append((self.subtest, True))
             elif value == SUBTEST_FAIL:
                 self.log.error("FAIL: %r" % ''.join(self.text_buffer))
                 del self.text_buffer[:]
                 self.failures += 1
+                self.subtests.append((self.subtest, False))
             elif value == SUBTEST_EXECUTE:
                 del self.text_buffer[:]
             elif value == SUBTEST_EXECUTE_DONE:
@@ -88,47 +117,205 @@ class Testing(core.Peripheral):
         return 0    #no functionality right now
 
 class TestCore(core.Core):
-    def __init__(self):
-        core.Core.__init__(self)
+    def __init__(self, trace=core.Core.TRACE_OFF):
+        core.Core.__init__(self, trace)
         self.testing = Testing(log)
         self.memory.append(self.testing)    #insert new peripherals in MSP's address pace
         self.memory.append(core.Multiplier())
+        #stop run() right after a write to CMD so that the test ends on
+        #the same instruction as with single steps
+        self.memory.setwatches[self.testing.startaddress] = self._command
+        #firmware must not write its own code, the check is free for
+        #other addresses. a write counts as failure
+        self.memory.watch(0xf000, 0xffff, core.WATCH_WRITE, 'flash memory written',
+            self._flashwritten)
         #self.reset()
 
+    def _command(self, address, bytemode, oldvalue, newvalue):
+        self.stop()
+
+    def _flashwritten(self, memory, bytemode, writing, address, value):
+        self.testing.log.error('FAIL: flash memory written @0x%04x: 0x%04x %s' % (
+            address, value, bytemode and 'b' or 'w'))
+        self.testing.failures += 1
+
     def start(self, maxsteps=2000):
         self.log.debug( 'TSTCOR: set startaddress')
         self.PC.set(self.memory.get(0xfffe))
         self.log.debug( 'TSTCOR: *** starting trace (maxsteps=%d)' % (maxsteps))
-        step = 1
+        limit = self.instructions + maxsteps
+        tracing = self.trace > self.TRACE_OFF   #log every instruction
         forever = 0
-        while forever or step <= maxsteps:
-            self.step()
-            self.log.debug( 'TSTCOR: (step %d, cycle %d)\n%r' % (
-                step, self.cycles, self))
-            step += 1
-            if self.testing.mode == TEST_END:
-                break
-            elif self.testing.mode == TEST_START:
+        while self.testing.mode != TEST_END:
+            if self.testing.mode == TEST_START:
                 forever = 1
+            if forever:
+                self.run(trace=tracing)
+            elif self.instructions < limit:
+                self.run(max_instructions=limit - self.instructions, trace=tracing)
+            else:
+                break
+            self.log.debug('TSTCOR: (step %d, cycle %d)\n%r',
+                self.instructions, self.cycles, self)
         if self.testing.mode != TEST_END:
             print "This is not a file for the tester!"
 
-if __name__ == '__main__':
+class TestResult:
+    """outcome of runtest(), it is sent back by the worker processes"""
+    def __init__(self, filename, failures=0, subtests=(), cycles=0, finished=False, error=None,
+                 coverage=None, profile=None, stats=None):
+        self.filename = filename
+        self.failures = failures
+        self.subtests = list(subtests)  #(name, success)
+        self.cycles = cycles
+        self.finished = finished        #test reached TEST_END
+        self.error = error              #exception text if it crashed
+        self.coverage = coverage        #codecoverage.Coverage if requested
+        self.profile = profile          #profiler.Profile if requested
+        self.stats = stats              #insnstats summary dict if requested
+
+    def __str__(self):
+        if self.error:
+            return '%s: ERROR %s' % (self.filename, self.error)
+        lines = ['%s: %d failures in %d subtests, %d cycles%s' % (
+            self.filename, self.failures, len(self.subtests), self.cycles,
+            (not self.finished) and ' (not a file for the tester)' or '')]
+        for name, success in self.subtests:
+            if not success:
+                lines.append('    FAIL: %s' % name)
+        return '\n'.join(lines)
+
+#trace levels by the names of the --trace option
+TRACES = {
+    'off': core.Core.TRACE_OFF,
+    'instructions': core.Core.TRACE_INSTRUCTIONS,
+    'registers': core.Core.TRACE_REGISTERS,
+    'memory': core.Core.TRACE_MEMORY,
+}
+
+def runtest(filename, coverage=False, cache=None, profile=False, stats=False, trace=core.Core.TRACE_OFF):
+    """load and run one test file, return a TestResult. with coverage,
+    the result includes the executed code, with profile the cycles per
+    function and with stats the instruction statistics. cache is an
+    optional imagecache.ImageCache for loading the file. trace is the
+    trace level of the core"""
+    log.info("Running Test: %s ..." % filename)
+    msp = TestCore(trace)
+    if coverage:
+        msp.coverage = codecoverage.Coverage()
+    if profile:
+        msp.profiler = profiler.Profiler(msp)
+    if stats:
+        insnstats.Statistics(msp)
+    msp.memory.load(filename, cache)
+    msp.start()
+    return TestResult(filename, msp.testing.failures, msp.testing.subtests,
+        msp.cycles, msp.testing.mode == TEST_END, coverage=msp.coverage,
+        profile=profile and msp.profiler.profile() or None,
+        stats=stats and msp.stats.summary() or None)
+
+def _initworker():
+    """log to a file per worker process"""
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s %(levelname)s %(message)s',
-                        filename='testing.log',
+                        filename='testing-%s.log' % multiprocessing.current_process().name,
                         filemode='w')
-    log = logging.getLogger('testing')
-    
+
+def _runworker((filename, coverage, cache, profile, stats, trace)):
+    """runtest() for the pool, errors are reported as failure"""
+    try:
+        return runtest(filename, coverage, cache, profile, stats, trace)
+    except Exception, e:
+        log.exception('test %s crashed' % filename)
+        return TestResult(filename, failures=1, error='%s: %s' % (e.__class__.__name__, e))
+
+def runparallel(filenames, jobs, coverage=None, cache=None, profile=None, stats=None,
+                trace=core.Core.TRACE_OFF):
+    """run the files in a pool of jobs worker processes. the results are
+    printed as they come in, returns the sum of the failures. the
+    coverage and the profiles of all files are merged into coverage and
+    profile if they are given, the statistics are put in the dict stats
+    by file name. the workers share the image cache and log with the
+    trace level trace"""
     failures = 0
-    for f in sys.argv[1:]:
-        print "Running Test: %s ...\n" % f
-        log.info("Running Test: %s ..." % f)
-        msp = TestCore()
-        msp.memory.load(f)
-        msp.start()
-        failures += msp.testing.failures
-        print "---------- Total Cycles: %d -----------" % msp.cycles
+    pool = multiprocessing.Pool(jobs, _initworker)
+    try:
+        for result in pool.imap_unordered(_runworker,
+                [(f, coverage is not None, cache, profile is not None, stats is not None, trace)
+                 for f in filenames]):
+            print result
+            sys.stdout.flush()
+            failures += result.failures
+            if result.coverage is not None:
+                coverage.merge(result.coverage)
+            if result.profile is not None:
+                profile.merge(result.profile)
+            if result.stats is not None:
+                stats[result.filename] = result.stats
+    finally:
+        pool.close()
+        pool.join()
+    return failures
+
+log = logging.getLogger('testing')
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [options] file.a43...')
+    parser.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+        help='run the files in N worker processes')
+    parser.add_option('--coverage', metavar='FILE', default=None,
+        help='record the executed code and save it to FILE')
+    parser.add_option('--image-cache', metavar='DIR', default=None,
+        help='keep parsed files in DIR to load them faster next time')
+    parser.add_option('--profile', metavar='FILE', default=None,
+        help='profile the cycles by function, write collapsed stacks to FILE')
+    parser.add_option('--stats', metavar='FILE', default=None,
+        help='write instruction and memory access statistics to FILE as JSON')
+    parser.add_option('--trace', type='choice', choices=['off', 'instructions', 'registers', 'memory'],
+        default='off', help='what is logged while the tests run: off (default), '
+        'instructions, registers or memory')
+    (options, args) = parser.parse_args()
+    trace = TRACES[options.trace]
+
+    coverage = None
+    if options.coverage:
+        coverage = codecoverage.Coverage()
+    cache = None
+    if options.image_cache:
+        cache = imagecache.ImageCache(options.image_cache)
+    profile = None
+    if options.profile:
+        profile = profiler.Profile()
+    stats = None
+    if options.stats:
+        stats = {}
+    if options.jobs > 1:
+        failures = runparallel(args, options.jobs, coverage, cache, profile, stats, trace)
+    else:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s %(levelname)s %(message)s',
+                            filename='testing.log',
+                            filemode='w')
+        failures = 0
+        for f in args:
+            print "Running Test: %s ...\n" % f
+            result = runtest(f, coverage is not None, cache, profile is not None, stats is not None, trace)
+            failures += result.failures
+            if coverage is not None:
+                coverage.merge(result.coverage)
+            if profile is not None:
+                profile.merge(result.profile)
+            if stats is not None:
+                stats[f] = result.stats
+            print "---------- Total Cycles: %d -----------" % result.cycles
+    if coverage is not None:
+        coverage.save(options.coverage)
+    if profile is not None:
+        open(options.profile, 'w').write(profile.folded())
+    if stats is not None:
+        json.dump({'files': stats, 'total': insnstats.merge(stats.values())},
+            open(options.stats, 'w'), indent=1, sort_keys=True)
     if failures:
         print "%d failures" % failures
         sys.exit(1)